@@ -1,9 +1,12 @@
 import pandas as pd
 import csv
+import itertools
 import requests
 import json
 from os.path import expanduser
 from requests.auth import HTTPBasicAuth
+from alpha_fingerprint import open_fingerprint_index
+from datafield_catalog import DatafieldCatalog
 import os
 os.environ['NO_PROXY'] = 'api.worldquantbrain.com'
 
@@ -41,127 +44,124 @@ def sign_in():
 '''
 # 获取数据集ID为fundamental6（Company Fundamental Data for Equity）下的所有数据字段
 ### Get Data_fields like Data Explorer 获取所有满足条件的数据字段及其ID
+# 分页并发下载、按scope缓存在 catalog/datafields/ (默认1天过期), 见datafield_catalog.py
 def get_datafields(
         s,
         searchScope,
         dataset_id: str = '',
-        search: str = ''
+        search: str = '',
+        refresh: bool = False
 ):
-    instrument_type = searchScope['instrumentType']
-    region = searchScope['region']
-    delay = searchScope['delay']
-    universe = searchScope['universe']
-
-    if len(search) == 0:
-        url_template = "https://api.worldquantbrain.com/data-fields?" + \
-                       f"&instrumentType={instrument_type}" + \
-                       f"&region={region}&delay={str(delay)}&universe={universe}&dataset.id={dataset_id}&limit=50" + \
-                       "&offset={x}"
-        count = s.get(url_template.format(x=0)).json()['count']
-    else:
-        url_template = "https://api.worldquantbrain.com/data-fields?" + \
-                       f"&instrumentType={instrument_type}" + \
-                       f"&region={region}&delay={str(delay)}&universe={universe}&limit=50" + \
-                       f"&search={search}" + \
-                       "&offset={x}"
-        count = 100
-
-    datafields_list = []
-    for x in range(0, count, 50):
-        datafields = s.get(url_template.format(x=x))
-        datafields_list.append(datafields.json()['results'])
-
-    datafields_list_flat = [item for sublist in datafields_list for item in sublist]
-
-    datafields_df = pd.DataFrame(datafields_list_flat)
-    return datafields_df
+    return DatafieldCatalog(s).fetch(searchScope, dataset_id = dataset_id, search = search, refresh = refresh)
 
 
 
 
 '''
 将alpha模板的字段组合进去表达式和setting封装
+iter_alpha_settings是生成器, 一次只生成一个payload, 百万级的组合也不占内存; alpha_setting保留原来返回列表的用法
 '''
+def iter_alpha_settings(akpha_expressions, universes = ['TOP3000'], decays = [0], neutralizations = ['SUBINDUSTRY'], truncations = [0.08]):
+    # akpha_expressions也可以是生成器; settings组合用itertools.product, 顺序和原来的嵌套循环一致
+    for alpha_expression in akpha_expressions:
+        for universe, decay, neutralization, truncation in itertools.product(universes, decays, neutralizations, truncations):
+            yield {
+                'type': 'REGULAR',
+                'settings': {
+                    'instrumentType': 'EQUITY',
+                    'region': 'USA',
+                    'universe': universe,
+                    'delay': 1,
+                    'decay': decay,
+                    'neutralization': neutralization,
+                    'truncation': truncation,
+                    'pasteurization': 'ON',
+                    'unitHandling': 'VERIFY',
+                    'nanHandling': 'OFF',
+                    'language': 'FASTEXPR',
+                    'visualization': False,
+                },
+                'regular': alpha_expression
+            }
+
+
 def alpha_setting(akpha_expressions, universes = ['TOP3000'], decays = [0], neutralizations = ['SUBINDUSTRY'], truncations = [0.08]):
-    alpha_list = []
-    for index, alpha_expression in enumerate(alpha_expressions, start=1):
-        for universe in universes:
-            for decay in decays:
-                for neutralization in neutralizations:
-                    for truncation in truncations:
-                        simulation_data = {
-                            'type': 'REGULAR',
-                            'settings': {
-                                'instrumentType': 'EQUITY',
-                                'region': 'USA',
-                                'universe': universe,
-                                'delay': 1,
-                                'decay': decay,
-                                'neutralization': neutralization,
-                                'truncation': truncation,
-                                'pasteurization': 'ON',
-                                'unitHandling': 'VERIFY',
-                                'nanHandling': 'OFF',
-                                'language': 'FASTEXPR',
-                                'visualization': False,
-                            },
-                            'regular': alpha_expression
-                        }
-                        alpha_list.append(simulation_data)
-    return alpha_list
+    return list(iter_alpha_settings(akpha_expressions, universes, decays, neutralizations, truncations))
+
+
+def grid_size(expression_count, universes = ['TOP3000'], decays = [0], neutralizations = ['SUBINDUSTRY'], truncations = [0.08]):
+    '''
+    不生成任何payload, 直接算出组合总数; expression_count可以是表达式个数或表达式列表
+    '''
+    if not isinstance(expression_count, int):
+        expression_count = len(expression_count)
+    return expression_count * len(universes) * len(decays) * len(neutralizations) * len(truncations)
 
 
 
 '''
 将alpha_list存到csv文件中
+alpha_list可以是列表或生成器, 按chunk_size一批批写入; 返回写入的行数
+append=True时追加到已有的pending csv末尾(已经在排队的不动), 文件不存在才写表头
 '''
-def alpha_to_csv(alpha_list, filename):
-    with open(filename, 'w', newline = '') as csvfile:
+def alpha_to_csv(alpha_list, filename, fingerprint_index = None, chunk_size = 10000, validator = None, append = False):
+    # fingerprint_index: 传入时跳过已经回测过的alpha (见alpha_fingerprint.py)
+    # validator: 传入时跳过本地校验不通过的表达式, 原因写进invalid_alphas.csv (见expression_validator.py)
+    if validator is not None:
+        alpha_list = validator.filter_valid(alpha_list)
+    if fingerprint_index is not None:
+        alpha_list = fingerprint_index.filter_new(alpha_list)
+    rows = ({'type': item['type'], 'settings': item['settings'], 'regular': item['regular']} for item in alpha_list)
+    written = 0
+    write_header = not (append and os.path.exists(filename) and os.path.getsize(filename) > 0)
+    with open(filename, 'a' if append else 'w', newline = '', buffering = 1 << 20) as csvfile:
         fieldnames = ['type', 'settings', 'regular']
         writer = csv.DictWriter(csvfile, fieldnames = fieldnames)
-        writer.writeheader()
-        for item in alpha_list:
-            writer.writerow({
-                'type' : item['type'],
-                'settings' : item['settings'],
-                'regular' : item['regular']
-            })
-
-
-
-
-sess = sign_in()
-searchScope = {'region': 'USA', 'delay': '1', 'universe': 'TOP3000', 'instrumentType': 'EQUITY'} # 定义搜索范围
-fnd6 = get_datafields(s=sess, searchScope=searchScope, dataset_id='fundamental6') # 从数据集中获取数据字段
-fnd6 = fnd6[fnd6['type'] == "MATRIX"] # 过滤类型为 "MATRIX" 的数据字段
-datafields_list_fnd6 = fnd6['id'].values # 提取数据字段的ID并转换为列表
-
-
-# #将alpha模板的函数和字段组合
-# # 模板<group_compare_op>(<ts_compare_op>(<company_fundamentals>,<days>),<group>)
-# group_compare_op = ['group_rank', 'group_zscore', 'group_neutralize']  # 分组比较操作符列表
-# ts_compare_op = ['ts_rank', 'ts_zscore', 'ts_av_diff']  # 时间序列比较操作符列表
-# company_fundamentals = datafields_list_fnd6
-# days = [60, 200] # 定义时间周期列表
-# group = ['market', 'industry', 'subindustry', 'sector', 'densify(pv13_h_f1_sector)'] # 定义分组依据列表
-# alpha_expressions = []
-# for gco in group_compare_op:
-#     for tco in ts_compare_op:
-#         for cf in company_fundamentals:
-#             for d in days:
-#                 for grp in group:
-#                     alpha_expressions.append(f"{gco}({tco}({cf}, {d}), {grp})")
-# print(f"there are total {len(alpha_expressions)} alpha expressions") # 输出生成的alpha表达式总数 # 打印或返回结果字符串列表
-alpha_expressions = []
-for datafield1 in datafields_list_fnd6:
-    alpha_expression = f"group_rank({datafield1}/{datafield1}, subindustry)"
-    alpha_expressions.append(alpha_expression)
-
-# universes = ['TOP3000','TOP1000','TOP500','TOP200']
-# decays = [0, 1, 5, 20, 60, 120, 250]
-# neutralizations = ['NONE', 'MARKET', 'SECTOR', 'INDUSTRY', 'SUBINDUSTRY']
-# truncations = [0.01, 0.05, 0.08]
-# alpha_list = alpha_setting(alpha_expressions, universes = universes, decays = decays, neutralizations = neutralizations, truncations = truncations)
-alpha_list = alpha_setting(alpha_expressions)
-print(f"there are {len(alpha_list)} Alphas to simulate")
-alpha_to_csv(alpha_list, "pending_alphas/pending_simulated_fnd6_selfRatioRank.csv") #pending_alphas/pending_simulated_dataset_opeartor/idea.csv
\ No newline at end of file
+        if write_header:
+            writer.writeheader()
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            writer.writerows(chunk)
+            written += len(chunk)
+    return written
+
+
+
+if __name__ == '__main__':
+    sess = sign_in()
+    searchScope = {'region': 'USA', 'delay': '1', 'universe': 'TOP3000', 'instrumentType': 'EQUITY'} # 定义搜索范围
+    fnd6_catalog = get_datafields(s=sess, searchScope=searchScope, dataset_id='fundamental6') # 从数据集中获取数据字段
+    fnd6 = fnd6_catalog[fnd6_catalog['type'] == "MATRIX"] # 过滤类型为 "MATRIX" 的数据字段
+    datafields_list_fnd6 = fnd6['id'].values # 提取数据字段的ID并转换为列表
+
+
+    from alpha_template import AlphaTemplate
+    from expression_validator import ExpressionValidator, OperatorCatalog
+
+    # #将alpha模板的函数和字段组合(模板写法见alpha_template.py, 操作符/窗口/分组默认取值同archive/world3.py)
+    # template = AlphaTemplate('<group_compare_op>(<ts_compare_op>(<field>, <days>), <group>)', field = datafields_list_fnd6)
+    # print(f"there are total {template.size()} alpha expressions") # 输出生成的alpha表达式总数
+    # alpha_expressions = template.sample(2000, by = 'field')   # 每个字段抽差不多一样多的变体, 不全跑
+    template = AlphaTemplate('group_rank(<field>/<field>, subindustry)', field = datafields_list_fnd6)
+    alpha_expressions = list(template.expressions())
+
+    # universes = ['TOP3000','TOP1000','TOP500','TOP200']
+    # decays = [0, 1, 5, 20, 60, 120, 250]
+    # neutralizations = ['NONE', 'MARKET', 'SECTOR', 'INDUSTRY', 'SUBINDUSTRY']
+    # truncations = [0.01, 0.05, 0.08]
+    # grid = dict(universes = universes, decays = decays, neutralizations = neutralizations, truncations = truncations)
+    grid = {}
+    # 生成器: 边生成边写, 不在内存里攒整个列表
+    alpha_list = iter_alpha_settings(alpha_expressions, **grid)
+    print(f"there are {grid_size(alpha_expressions, **grid)} Alphas to simulate")
+    fingerprint_index = open_fingerprint_index()
+    # 入队前本地校验: 操作符拼写/参数个数、字段是否存在、VECTOR字段用法; 字段目录要包含模板用到的全部数据集
+    validator = ExpressionValidator(OperatorCatalog.load(session = sess), datafields = fnd6)
+    written = alpha_to_csv(alpha_list, "pending_alphas/pending_simulated_fnd6_selfRatioRank.csv", fingerprint_index, validator = validator)
+    print(f"{written} Alphas written")
+    # 记下这次用的字段目录; 以后数据集加了字段用catalog_diff.py只给新字段生成、追加到这个pending csv, 不用再全量重跑
+    from catalog_diff import CatalogSnapshots
+    CatalogSnapshots(DatafieldCatalog(sess)).save(fnd6_catalog, searchScope, dataset_id = 'fundamental6')
+    print(fingerprint_index.report()) #pending_alphas/pending_simulated_dataset_opeartor/idea.csv
@@ -0,0 +1,198 @@
+'''
+alpha指纹: 表达式 + settings 归一化后的哈希, 用来跳过已经回测过的alpha
+
+- 表达式去掉所有空白; settings只保留影响回测结果的字段, 补齐默认值并统一类型
+  (pending里的payload没有maxTrade/startDate, 结果里有, 两边算出来的指纹要一致)
+- FingerprintIndex: 内存里是set, O(1)判断; 磁盘上是只追加的文本文件, 一行一个指纹
+- 第一次使用时从全部历史结果(simulated_alphas_*.csv + 结果库)建索引
+- saved记录因为重复而省下的提交次数
+'''
+import ast
+import csv
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+
+# 影响回测结果的settings字段及缺省值; startDate/endDate/visualization不参与指纹
+FINGERPRINT_SETTINGS = {
+    'instrumentType': 'EQUITY',
+    'region': 'USA',
+    'universe': 'TOP3000',
+    'delay': 1,
+    'decay': 0,
+    'neutralization': 'NONE',
+    'truncation': 0.0,
+    'pasteurization': 'ON',
+    'unitHandling': 'VERIFY',
+    'nanHandling': 'OFF',
+    'maxTrade': 'OFF',
+    'language': 'FASTEXPR',
+}
+INT_SETTINGS = ('delay', 'decay')
+FLOAT_SETTINGS = ('truncation',)
+
+
+def normalize_expression(expression):
+    return re.sub(r'\s+', '', expression or '')
+
+
+def normalize_settings(settings):
+    if isinstance(settings, str):
+        settings = ast.literal_eval(settings)
+    settings = settings or {}
+    normalized = {}
+    for key, default in FINGERPRINT_SETTINGS.items():
+        value = settings.get(key, default)
+        if value is None or value == '':
+            value = default
+        if key in INT_SETTINGS:
+            value = int(float(value))
+        elif key in FLOAT_SETTINGS:
+            value = round(float(value), 6)
+        else:
+            value = str(value).upper()
+        normalized[key] = value
+    return normalized
+
+
+def alpha_fingerprint(expression, settings):
+    canonical = json.dumps([normalize_expression(expression), normalize_settings(settings)], sort_keys = True, separators = (',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def fingerprint_of(alpha):
+    '''
+    pending里的payload ('regular'是表达式字符串) 和 /alphas/{id}的返回 ('regular'是{'code': ...}) 都可以
+    '''
+    regular = alpha.get('regular')
+    if isinstance(regular, str) and regular.startswith('{'):
+        regular = ast.literal_eval(regular)
+    if isinstance(regular, dict):
+        regular = regular.get('code')
+    return alpha_fingerprint(regular, alpha.get('settings'))
+
+
+class FingerprintIndex:
+    def __init__(self, path = 'simulated_alphas/fingerprints.txt'):
+        self.path = path
+        self.fingerprints = set()
+        self.saved = 0   # 因为重复而跳过的提交次数
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.fingerprints.update(line.strip() for line in f if line.strip())
+        self.file = None
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self.fingerprints
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _append(self, fingerprints):
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok = True)
+            self.file = open(self.path, 'a')
+        self.file.writelines(f"{fp}\n" for fp in fingerprints)
+        self.file.flush()
+
+    def add(self, fingerprint):
+        if fingerprint and fingerprint not in self.fingerprints:
+            self.fingerprints.add(fingerprint)
+            self._append([fingerprint])
+
+    def add_many(self, fingerprints):
+        new = {fp for fp in fingerprints if fp and fp not in self.fingerprints}
+        self.fingerprints.update(new)
+        if new:
+            self._append(sorted(new))
+        return len(new)
+
+    def add_alpha(self, alpha):
+        if alpha.get('regular'):
+            self.add(fingerprint_of(alpha))
+
+    def seen(self, alpha):
+        '''
+        alpha已经回测过返回True, 并计入saved
+        '''
+        if fingerprint_of(alpha) in self.fingerprints:
+            self.saved += 1
+            return True
+        return False
+
+    def filter_new(self, alphas):
+        '''
+        入队时用: 只保留没回测过的alpha, 同一批里重复的也只留一个
+        '''
+        batch = set()
+        for alpha in alphas:
+            fingerprint = fingerprint_of(alpha)
+            if fingerprint in self.fingerprints or fingerprint in batch:
+                self.saved += 1
+                continue
+            batch.add(fingerprint)
+            yield alpha
+
+    def build_from_csvs(self, pattern = 'simulated_alphas/simulated_alphas_*.csv'):
+        '''
+        历史结果csv没有表头: 第4列是settings, 第5列是regular
+        '''
+        fingerprints = []
+        for csv_path in sorted(glob.glob(pattern)):
+            with open(csv_path, 'r', newline = '') as file:
+                for values in csv.reader(file):
+                    try:
+                        fingerprints.append(fingerprint_of({'settings': values[3], 'regular': values[4]}))
+                    except (ValueError, SyntaxError, IndexError):
+                        continue
+        return self.add_many(fingerprints)
+
+    def build_from_store(self, results_store):
+        from results_store import SETTINGS_COLUMNS
+        columns = ['code'] + [column for column, _, _ in SETTINGS_COLUMNS]
+        df = results_store.query(columns = columns, order_by = None)
+        fingerprints = []
+        for row in df.itertuples(index = False):
+            row = row._asdict()
+            settings = {key: row[column] for column, _, key in SETTINGS_COLUMNS}
+            fingerprints.append(alpha_fingerprint(row['code'], settings))
+        return self.add_many(fingerprints)
+
+    def build(self, results_store = None, pattern = 'simulated_alphas/simulated_alphas_*.csv'):
+        added = self.build_from_csvs(pattern)
+        if results_store is not None:
+            added += self.build_from_store(results_store)
+        self._append([])   # 没有历史结果也留下索引文件, 下次不再重建
+        logging.info(f"Fingerprint index built: {added} new, {len(self)} in total")
+        return added
+
+    def report(self):
+        return f"Fingerprint index: {len(self)} simulated alphas known, {self.saved} duplicate submissions skipped"
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def open_fingerprint_index(path = 'simulated_alphas/fingerprints.txt', results_store = None):
+    '''
+    索引文件不存在时先从全部历史结果建一次
+    '''
+    index = FingerprintIndex(path)
+    if not index.exists():
+        index.build(results_store = results_store)
+    return index
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s - %(levelname)s - %(message)s')
+    index = FingerprintIndex()
+    index.build()
+    print(index.report())
@@ -0,0 +1,199 @@
+'''
+按历史回测结果给待回测alpha打分, 队列先发分数高的 (代替FIFO + df.sample(frac=1)打乱)
+
+- 每个alpha拆出四类特征:
+    datafield  表达式里用到的数据字段
+    operator   用到的操作符
+    template   表达式骨架: 数据字段换成<field>, 数字换成<n>, 例如 group_rank(<field>/<field>, subindustry)
+    settings   region / universe / delay / decay / neutralization / truncation 组合
+- HistoricalScorer: 每类特征的每个取值记 (次数, 指标之和), 均值向全局均值收缩(次数少的不会因为一两个好结果排到最前)
+  分数 = 各类特征收缩后均值的加权平均 + 可选的探索奖励(没怎么试过的特征加分)
+- 新结果出来时 observe(result) 增量更新, 队列定期按新分数重排
+- 打分模型可以换: 只要实现 score(alpha) -> float, 可选实现 observe(result)
+
+用法:
+    scorer = HistoricalScorer.from_store(ResultsStore())
+    AlphaSimulator(..., scorer = scorer)
+    python alpha_priority.py pending_alphas/xxx.csv     # 看排在最前面的alpha
+'''
+import ast
+import logging
+import math
+import re
+import threading
+
+from alpha_fingerprint import normalize_settings
+
+TOKEN_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_.]*|\d+(?:\.\d+)?')
+# 分组名留在模板里, 不算数据字段
+GROUP_NAMES = {'market', 'sector', 'industry', 'subindustry', 'exchange', 'country'}
+KEYWORDS = {'true', 'false', 'nan', 'inf'}
+PROFILE_SETTINGS = ('region', 'universe', 'delay', 'decay', 'neutralization', 'truncation')
+FEATURE_WEIGHTS = {'datafield': 1.0, 'operator': 0.5, 'template': 1.0, 'settings': 0.5}
+
+
+def expression_features(expression):
+    '''
+    返回 (datafields, operators, template)
+    '''
+    expression = expression or ''
+    datafields, operators, parts, position = [], [], [], 0
+    for match in TOKEN_PATTERN.finditer(expression):
+        token = match.group()
+        rest = expression[match.end():].lstrip()
+        parts.append(expression[position:match.start()])
+        position = match.end()
+        if token[0].isdigit():
+            parts.append('<n>')
+        elif rest.startswith('('):
+            operators.append(token)
+            parts.append(token)
+        elif rest.startswith('=') and not rest.startswith('=='):
+            parts.append(token)   # 关键字参数名, 例如 filter=true
+        elif token.lower() in GROUP_NAMES or token.lower() in KEYWORDS:
+            parts.append(token)
+        else:
+            datafields.append(token)
+            parts.append('<field>')
+    parts.append(expression[position:])
+    template = re.sub(r'\s+', '', ''.join(parts))
+    return sorted(set(datafields)), sorted(set(operators)), template
+
+
+def settings_profile(settings):
+    normalized = normalize_settings(settings)
+    return '/'.join(str(normalized[key]) for key in PROFILE_SETTINGS)
+
+
+def alpha_features(expression, settings):
+    '''
+    {特征类别: [取值]}
+    '''
+    datafields, operators, template = expression_features(expression)
+    return {'datafield': datafields, 'operator': operators, 'template': [template], 'settings': [settings_profile(settings)]}
+
+
+def _expression_of(alpha):
+    regular = alpha.get('regular')
+    if isinstance(regular, str) and regular.startswith('{'):
+        regular = ast.literal_eval(regular)
+    if isinstance(regular, dict):
+        regular = regular.get('code')
+    return regular
+
+
+class HistoricalScorer:
+    '''
+    target: 用哪个指标打分(/alphas返回里is下的字段), 默认fitness
+    prior_count: 向全局均值收缩的强度, 相当于每个取值先有这么多个全局均值的样本
+    exploration: 探索奖励系数, 奖励 = exploration / sqrt(1 + 次数)
+    '''
+    def __init__(self, target = 'fitness', weights = None, prior_count = 5, exploration = 0.0):
+        self.target = target
+        self.weights = weights or dict(FEATURE_WEIGHTS)
+        self.prior_count = prior_count
+        self.exploration = exploration
+        self.stats = {family: {} for family in self.weights}   # family -> {取值: [次数, 指标之和]}
+        self.count = 0
+        self.total = 0.0
+        self.version = 0   # 每observe一次加一, 队列据此判断要不要重排
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_store(cls, results_store, **kwargs):
+        '''
+        用结果库里的全部历史结果初始化
+        '''
+        scorer = cls(**kwargs)
+        columns = ['code', scorer.target] + list(PROFILE_SETTINGS)
+        frame = results_store.query(columns = columns, order_by = None, where = f"{scorer.target} IS NOT NULL")
+        for row in frame.itertuples(index = False):
+            settings = {key: getattr(row, key) for key in PROFILE_SETTINGS if getattr(row, key) == getattr(row, key)}   # 去掉NaN
+            scorer._add(row.code, settings, getattr(row, scorer.target))
+        logging.info(f"Alpha scorer loaded {scorer.count} historical results, mean {scorer.target} {scorer.mean():.3f}")
+        return scorer
+
+    def _add(self, expression, settings, value):
+        if value is None or (isinstance(value, float) and math.isnan(value)) or not expression:
+            return
+        value = float(value)
+        with self.lock:
+            for family, keys in alpha_features(expression, settings).items():
+                if family not in self.stats:
+                    continue
+                for key in keys:
+                    entry = self.stats[family].setdefault(key, [0, 0.0])
+                    entry[0] += 1
+                    entry[1] += value
+            self.count += 1
+            self.total += value
+            self.version += 1
+
+    def observe(self, result):
+        '''
+        result: /alphas/{id}的返回
+        '''
+        metrics = result.get('is')
+        if isinstance(metrics, str):
+            metrics = ast.literal_eval(metrics)
+        settings = result.get('settings')
+        if isinstance(settings, str):
+            settings = ast.literal_eval(settings)
+        self._add(_expression_of(result), settings or {}, (metrics or {}).get(self.target))
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def family_score(self, family, keys):
+        '''
+        一类特征的分数: 各取值收缩后均值的平均; 没见过的取值就是全局均值
+        '''
+        if not keys:
+            return None
+        mean = self.mean()
+        scores = []
+        for key in keys:
+            count, total = self.stats[family].get(key, (0, 0.0))
+            shrunk = (total + self.prior_count * mean) / (count + self.prior_count)
+            scores.append(shrunk + self.exploration / math.sqrt(1 + count))
+        return sum(scores) / len(scores)
+
+    def score(self, alpha):
+        settings = alpha.get('settings')
+        try:
+            features = alpha_features(_expression_of(alpha), settings)
+        except (ValueError, SyntaxError):
+            return self.mean()
+        weighted, weight_sum = 0.0, 0.0
+        with self.lock:
+            for family, weight in self.weights.items():
+                family_score = self.family_score(family, features.get(family))
+                if family_score is not None and weight:
+                    weighted += weight * family_score
+                    weight_sum += weight
+        return weighted / weight_sum if weight_sum else self.mean()
+
+    def top(self, family, n = 10, min_count = 3):
+        '''
+        某类特征里收缩后均值最高的n个取值, 方便看模型学到了什么
+        '''
+        with self.lock:
+            rows = [(key, count, (total + self.prior_count * self.mean()) / (count + self.prior_count))
+                    for key, (count, total) in self.stats[family].items() if count >= min_count]
+        return sorted(rows, key = lambda row: row[2], reverse = True)[:n]
+
+
+if __name__ == '__main__':
+    import csv
+    import sys
+    from results_store import ResultsStore
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s - %(levelname)s - %(message)s')
+    scorer = HistoricalScorer.from_store(ResultsStore())
+    for family in scorer.weights:
+        print(f"top {family}: {scorer.top(family, n = 5)}")
+    for csv_path in sys.argv[1:]:
+        with open(csv_path, 'r') as file:
+            rows = sorted(csv.DictReader(file), key = scorer.score, reverse = True)
+        print(f"{csv_path}: {len(rows)} alphas, best first:")
+        for row in rows[:10]:
+            print(f"  {scorer.score(row):.3f}  {row['regular']}")
@@ -0,0 +1,186 @@
+'''
+按分组提前淘汰(successive halving): 同一个数据字段的几十个模板变体, 先跑几个探路, 结果不行的字段剩下的变体不再跑
+
+- 分组: 默认按表达式里的数据字段(见alpha_priority.expression_features), 也可以传任意 group_key(alpha)
+- rungs: [(预算, 阈值), ...], 例如 ((3, 0.5), (9, 0.8)):
+    先放3个变体去跑, 3个结果里最好的|sharpe| < 0.5 就淘汰这个分组;
+    过了就把预算加到9个, 9个里最好的 < 0.8 淘汰; 过了最后一级, 这个分组剩下的变体全部放行
+- 探路结果没回来之前, 同组超出预算的变体先扣在pruner里(hold), 不占提交槽位; 扣住的数量有上限max_held
+- 被淘汰的分组: prune_action='drop' 直接丢弃(记入journal的dropped); 'demote' 放到最后, 队列空了才跑
+- 提交失败、回测出错、超时也算一个结果(没有指标), 预算不会卡住
+- from_store(): 用结果库里的历史结果预先填充, 以前跑过的字段不用重新探路
+simulator里的用法见 AlphaSimulator(pruner = ...)
+'''
+import ast
+import logging
+import threading
+
+from alpha_priority import expression_features, _expression_of
+
+RUN = 'run'
+HOLD = 'hold'
+DROP = 'drop'
+DEMOTE = 'demote'
+DEFAULT_RUNGS = ((3, 0.5), (9, 0.8))
+
+
+def datafield_key(alpha):
+    datafields, _, _ = expression_features(_expression_of(alpha))
+    return ','.join(datafields) or None
+
+
+class GroupState:
+    def __init__(self):
+        self.rung = 0
+        self.in_flight = 0
+        self.values = []   # 每个结果的指标, 失败为None
+        self.status = 'probing'   # probing / promoted / pruned
+        self.held = []
+
+    def best(self):
+        values = [v for v in self.values if v is not None]
+        return max(values) if values else None
+
+
+class SuccessiveHalvingPruner:
+    def __init__(self, rungs = DEFAULT_RUNGS, metric = 'sharpe', use_abs = True, group_key = datafield_key,
+                 prune_action = DROP, max_held = 500):
+        self.rungs = list(rungs)
+        self.metric = metric
+        self.use_abs = use_abs   # sharpe为负的表达式取反就是正的, 默认按绝对值看
+        self.group_key = group_key
+        self.prune_action = prune_action
+        self.max_held = max_held
+        self.groups = {}
+        self.ready = []   # 分组晋级后放行的变体, 优先于队列
+        self.demoted = []   # 淘汰后降级的变体, 队列空了才跑
+        self.dropped = []   # 淘汰后要丢弃的扣住的变体, 由simulator确认删除
+        self.counts = {'probed': 0, 'promoted_groups': 0, 'pruned_groups': 0, 'pruned_alphas': 0}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_store(cls, results_store, **kwargs):
+        pruner = cls(**kwargs)
+        frame = results_store.query(columns = ['code', pruner.metric], order_by = 'date_created')
+        for row in frame.itertuples(index = False):
+            value = getattr(row, pruner.metric)
+            pruner._record({'regular': row.code}, None if value != value else value, in_flight = False)
+        logging.info(f"Pruner loaded {len(frame)} historical results: {pruner.summary()}")
+        return pruner
+
+    def _value(self, result):
+        if result is None:
+            return None
+        metrics = result.get('is')
+        if isinstance(metrics, str):
+            metrics = ast.literal_eval(metrics)
+        value = (metrics or {}).get(self.metric)
+        if value is None:
+            return None
+        return abs(value) if self.use_abs else value
+
+    def held_count(self):
+        return sum(len(group.held) for group in self.groups.values())
+
+    def full(self):
+        '''
+        扣住的变体太多了, 先不要再从队列里取
+        '''
+        return self.held_count() >= self.max_held
+
+    def admit(self, alpha):
+        '''
+        返回 RUN / HOLD / DROP / DEMOTE; HOLD和DEMOTE的alpha由pruner保管, 之后从pop_ready / pop_demoted取
+        '''
+        key = self.group_key(alpha)
+        if key is None:
+            return RUN
+        with self.lock:
+            group = self.groups.setdefault(key, GroupState())
+            if group.status == 'promoted':
+                return RUN
+            if group.status == 'pruned':
+                self.counts['pruned_alphas'] += 1
+                if self.prune_action == DEMOTE:
+                    self.demoted.append(alpha)
+                    return DEMOTE
+                return DROP
+            if len(group.values) + group.in_flight < self.rungs[group.rung][0]:
+                group.in_flight += 1
+                self.counts['probed'] += 1
+                return RUN
+            group.held.append(alpha)
+            return HOLD
+
+    def report(self, alpha, result = None):
+        '''
+        一个变体结束: result为/alphas/{id}的返回, 失败时为None
+        '''
+        self._record(alpha, self._value(result))
+
+    def _record(self, alpha, value, in_flight = True):
+        key = self.group_key(alpha)
+        if key is None:
+            return
+        with self.lock:
+            group = self.groups.setdefault(key, GroupState())
+            if in_flight:
+                group.in_flight = max(0, group.in_flight - 1)
+            group.values.append(value)
+            self._evaluate(key, group)
+
+    def _evaluate(self, key, group):
+        '''
+        调用方持有锁; 当前这一级的结果齐了就判断淘汰还是晋级
+        '''
+        while group.status == 'probing' and len(group.values) >= self.rungs[group.rung][0]:
+            budget, threshold = self.rungs[group.rung]
+            best = group.best()
+            if best is None or best < threshold:
+                group.status = 'pruned'
+                self.counts['pruned_groups'] += 1
+                self.counts['pruned_alphas'] += len(group.held)
+                logging.info(f"Pruned group {key}: best {self.metric} {best} < {threshold} after {len(group.values)} results, "
+                             f"{len(group.held)} held variants {'demoted' if self.prune_action == DEMOTE else 'dropped'}")
+                (self.demoted if self.prune_action == DEMOTE else self.dropped).extend(group.held)
+                group.held = []
+            elif group.rung + 1 < len(self.rungs):
+                group.rung += 1
+                self._release(group, self.rungs[group.rung][0] - len(group.values) - group.in_flight)
+            else:
+                group.status = 'promoted'
+                self.counts['promoted_groups'] += 1
+                logging.info(f"Promoted group {key}: best {self.metric} {best} after {len(group.values)} results")
+                self._release(group, len(group.held))
+
+    def _release(self, group, n):
+        n = max(0, min(n, len(group.held)))
+        released, group.held = group.held[:n], group.held[n:]
+        if group.status == 'probing':
+            group.in_flight += n
+            self.counts['probed'] += n
+        self.ready.extend(released)
+
+    def pop_ready(self, match = None):
+        with self.lock:
+            return _pop(self.ready, match)
+
+    def pop_demoted(self, match = None):
+        with self.lock:
+            return _pop(self.demoted, match)
+
+    def take_dropped(self):
+        with self.lock:
+            dropped, self.dropped = self.dropped, []
+        return dropped
+
+    def summary(self):
+        with self.lock:
+            return dict(self.counts, held = self.held_count(), groups = len(self.groups))
+
+
+def _pop(alphas, match):
+    for index, alpha in enumerate(alphas):
+        if match is None or match(alpha):
+            return alphas.pop(index)
+    return None
@@ -0,0 +1,406 @@
+'''
+待回测alpha的队列
+
+CsvAlphaQueue: pending csv -> 内存缓冲(sim_queue_ls)
+- 缓冲空了才从pending csv里批量取出batch_size个alpha, 取出后覆写pending csv
+- 多个AlphaSimulator(多账号)可以共用同一个队列对象; 所有simulator跑在同一个事件循环里,
+  pop()中间没有await, 同一个alpha不会被发给两个账号
+- state_file: 共用队列时缓冲由队列自己保存, 重启后接着用
+- 取出 / 重排都是读整个文件、写.tmp、os.replace, 期间持有pending_lock(path); 其他进程往pending csv追加
+  (catalog_diff.enqueue_alphas)也要拿这把锁, 否则中间追加的行会被覆盖掉
+
+SqliteAlphaQueue: pending存在SQLite表里
+- 每批取出(dequeue)、确认(ack)、放回(requeue)都只动涉及的那几行, 不再整表重写
+- 取出的alpha标记为leased, 提交成功或记录失败后ack删除; 进程中途退出, 重启时leased的行会自动放回队列
+- settings在导入时解析一次存成JSON, 取出时不再ast.literal_eval
+- import_csv: 导入现有 pending_alphas/*.csv
+
+两种队列对simulator的接口一致: pop() / pop_matching(predicate) / refill() / ack(alpha) / requeue(alpha) / buffer
+
+scorer(见alpha_priority.py): 传入时按分数从高到低出队, 不传还是FIFO
+- CsvAlphaQueue: 把pending csv整体按分数重排后再按顺序取; 每次重排都要解析、重写整个文件,
+  几百万行的pending很慢, 所以open_alpha_queue默认不给csv队列打分, 要sort_csv = True才开
+- SqliteAlphaQueue: 分数存在priority列, 按priority取
+- 打分模型有新结果(scorer.version变了)且距上次重排超过rescore_interval秒时重新打分
+'''
+import ast
+import csv
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+    import msvcrt
+
+QUEUE_ID_KEY = '_qid'   # SqliteAlphaQueue取出的alpha带上行id, 提交前会被去掉
+
+
+def payload_of(alpha):
+    '''
+    去掉队列自己用的下划线字段, 得到真正发给API的payload
+    '''
+    return {k: v for k, v in alpha.items() if not k.startswith('_')}
+
+
+def parse_settings(settings):
+    if isinstance(settings, str):
+        try:
+            return ast.literal_eval(settings)
+        except (ValueError, SyntaxError):
+            print(f"Error wvaluating settings: {settings}")
+    elif not isinstance(settings, dict):
+        print(f"Unexcepted type for settings:{type(settings)}")
+    return settings
+
+
+@contextmanager
+def pending_lock(path):
+    '''
+    pending csv的进程间排他锁; 锁在旁边的 <path>.lock 上(csv本身会被os.replace换掉, 锁不住)
+    '''
+    with open(path + '.lock', 'a+') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class ScoredQueue:
+    '''
+    两种队列共用的重新打分判断
+    '''
+    def _init_scorer(self, scorer, rescore_interval):
+        self.scorer = scorer
+        self.rescore_interval = rescore_interval
+        self.scored_at = None
+        self.scored_version = None
+
+    def _should_rescore(self):
+        if self.scorer is None:
+            return False
+        if self.scored_at is None:
+            return True
+        version = getattr(self.scorer, 'version', None)
+        return version != self.scored_version and time.time() - self.scored_at >= self.rescore_interval
+
+    def _mark_scored(self):
+        self.scored_at = time.time()
+        self.scored_version = getattr(self.scorer, 'version', None)
+
+
+class CsvAlphaQueue(ScoredQueue):
+    def __init__(self, file_path, batch_size = 20, buffer = None, state_file = None, monitor_file = 'progress_alphas/sim_queue.csv',
+                 scorer = None, rescore_interval = 3600):
+        self.file_path = file_path
+        self.batch_size = batch_size
+        self._init_scorer(scorer, rescore_interval)
+        self.state_file = state_file
+        self.monitor_file = monitor_file
+        self.buffer = buffer if buffer is not None else []
+        self.saves_buffer = bool(state_file)   # 缓冲是否由队列自己保存(否则由simulator的journal恢复)
+        if state_file and buffer is None:
+            self._load_state()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def _load_state(self):
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r') as f:
+                    self.buffer = json.load(f).get("sim_queue_ls", [])
+                logging.info(f"Recover queue successfully: {len(self.buffer)} pending")
+            except Exception as e:
+                logging.error(f"Fail to recover queue: {e}")
+
+    def _save_state(self):
+        if self.state_file:
+            with open(self.state_file, 'w') as f:
+                json.dump({"sim_queue_ls": self.buffer}, f)
+
+    def read_batch(self, batch_size = None):
+        '''
+        1. d打开alpha_list_pending_simulated
+        2. 去除batch_size个alpha放入列表变量alphas
+        3. 取出后覆写(overwrite) alpha_list_pending_simulated
+        4. 把取出的alphas写到sim_queue.csv文件中,方便随时监控在排队的alpha有多少
+        5. 返回列表变量alphas
+        '''
+        batch_size = batch_size or self.batch_size
+        if self._should_rescore():
+            self.sort_pending()
+        alphas = []
+        temp_file_name = self.file_path + '.tmp'
+        with pending_lock(self.file_path):
+            with open(self.file_path, 'r') as file, open(temp_file_name, 'w', newline = '') as temp_file:
+                reader = csv.DictReader(file)
+                fieldnemas = reader.fieldnames
+                writer = csv.DictWriter(temp_file, fieldnames = fieldnemas)
+                writer.writeheader()
+                for _ in range(batch_size):
+                    try:
+                        row = next(reader)
+                        if 'settings' in row:
+                            row['settings'] = parse_settings(row['settings'])
+                        alphas.append(row)
+                    except StopIteration:
+                        break
+                for remaining_row in reader:
+                    writer.writerow(remaining_row)
+            os.replace(temp_file_name, self.file_path)
+        if alphas and self.monitor_file:
+            with open(self.monitor_file, 'w') as file:
+                writer = csv.DictWriter(file, fieldnames = alphas[0].keys())
+                if file.tell() == 0:
+                    writer.writeheader()
+                writer.writerows(alphas)
+        return alphas
+
+    def sort_pending(self):
+        '''
+        pending csv按scorer的分数从高到低重排(分数相同保持原顺序)
+        '''
+        with pending_lock(self.file_path):
+            with open(self.file_path, 'r') as file:
+                reader = csv.DictReader(file)
+                fieldnames = reader.fieldnames
+                rows = list(reader)
+            rows.sort(key = self.scorer.score, reverse = True)
+            temp_file_name = self.file_path + '.tmp'
+            with open(temp_file_name, 'w', newline = '') as temp_file:
+                writer = csv.DictWriter(temp_file, fieldnames = fieldnames)
+                writer.writeheader()
+                writer.writerows(rows)
+            os.replace(temp_file_name, self.file_path)
+        self._mark_scored()
+        logging.info(f"Sorted {len(rows)} pending alphas in {self.file_path} by score")
+
+    def refill(self):
+        if len(self.buffer) < 1:
+            self.buffer = self.read_batch()
+            self._save_state()
+
+    def pop(self):
+        '''
+        弹出下一个alpha, 缓冲空了就先从csv文件中重新填充; 没有alpha可用时返回None
+        '''
+        self.refill()
+        if not self.buffer:
+            return None
+        alpha = self.buffer.pop(0)
+        self._save_state()
+        return alpha
+
+    def pop_matching(self, predicate):
+        '''
+        弹出缓冲里第一个满足predicate的alpha(multi-simulation凑同一批用), 没有返回None
+        '''
+        self.refill()
+        alpha = _pop_matching(self.buffer, predicate)
+        if alpha is not None:
+            self._save_state()
+        return alpha
+
+    def ack(self, alpha):
+        # 从csv取出时就已经删掉了, 无需确认
+        pass
+
+    def requeue(self, alpha):
+        self.buffer.insert(0, alpha)
+        self._save_state()
+
+
+class SqliteAlphaQueue(ScoredQueue):
+    def __init__(self, db_path, batch_size = 20, scorer = None, rescore_interval = 3600):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._init_scorer(scorer, rescore_interval)
+        self.buffer = []
+        self.saves_buffer = True
+        self.conn = sqlite3.connect(db_path, check_same_thread = False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending_alphas ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " payload TEXT NOT NULL,"
+            " leased_at REAL,"
+            " source TEXT,"
+            " priority REAL NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(pending_alphas)")]
+        if 'priority' not in columns:
+            self.conn.execute("ALTER TABLE pending_alphas ADD COLUMN priority REAL NOT NULL DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_pending_leased ON pending_alphas(leased_at, id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_pending_priority ON pending_alphas(leased_at, priority DESC, id)")
+        self.conn.commit()
+        recovered = self.requeue_leased()
+        if recovered:
+            logging.info(f"Recover queue successfully: {recovered} leased alphas put back")
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def count(self):
+        '''
+        返回 (未取出数, 已取出未确认数)
+        '''
+        pending = self.conn.execute("SELECT COUNT(*) FROM pending_alphas WHERE leased_at IS NULL").fetchone()[0]
+        leased = self.conn.execute("SELECT COUNT(*) FROM pending_alphas WHERE leased_at IS NOT NULL").fetchone()[0]
+        return pending, leased
+
+    def enqueue(self, alphas, source = None, fingerprint_index = None, validator = None):
+        '''
+        fingerprint_index: 传入时跳过已经回测过的alpha
+        validator: 传入时跳过本地校验不通过的alpha(见expression_validator.py)
+        '''
+        if validator is not None:
+            alphas = validator.filter_valid(alphas)
+        if fingerprint_index is not None:
+            alphas = fingerprint_index.filter_new(alphas)
+        score = self.scorer.score if self.scorer is not None else (lambda alpha: 0.0)
+        rows = ((json.dumps(payload_of(alpha)), source, score(alpha)) for alpha in alphas)
+        with self.conn:
+            cursor = self.conn.executemany("INSERT INTO pending_alphas (payload, source, priority) VALUES (?, ?, ?)", rows)
+        return cursor.rowcount
+
+    def rescore(self):
+        '''
+        用scorer重新计算所有未取出alpha的priority
+        '''
+        rows = self.conn.execute("SELECT id, payload FROM pending_alphas WHERE leased_at IS NULL").fetchall()
+        with self.conn:
+            self.conn.executemany("UPDATE pending_alphas SET priority = ? WHERE id = ?",
+                                  [(self.scorer.score(json.loads(payload)), qid) for qid, payload in rows])
+        self._mark_scored()
+        logging.info(f"Rescored {len(rows)} pending alphas in {self.db_path}")
+        return len(rows)
+
+    def import_csv(self, csv_path, chunk_size = 5000, fingerprint_index = None, validator = None):
+        '''
+        导入 pending_alphas/*.csv (type, settings, regular), settings只在这里解析一次
+        '''
+        total = 0
+        with open(csv_path, 'r') as file:
+            chunk = []
+            for row in csv.DictReader(file):
+                if 'settings' in row:
+                    row['settings'] = parse_settings(row['settings'])
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    total += self.enqueue(chunk, source = csv_path, fingerprint_index = fingerprint_index, validator = validator)
+                    chunk = []
+            if chunk:
+                total += self.enqueue(chunk, source = csv_path, fingerprint_index = fingerprint_index, validator = validator)
+        logging.info(f"Imported {total} alphas from {csv_path} into {self.db_path}")
+        return total
+
+    def dequeue(self, batch_size = None):
+        '''
+        取出batch_size个alpha并标记为leased, 每个alpha带上QUEUE_ID_KEY
+        '''
+        batch_size = batch_size or self.batch_size
+        if self._should_rescore():
+            self.rescore()
+        with self.conn:
+            rows = self.conn.execute(
+                "SELECT id, payload FROM pending_alphas WHERE leased_at IS NULL ORDER BY priority DESC, id LIMIT ?", (batch_size,)
+            ).fetchall()
+            self.conn.executemany("UPDATE pending_alphas SET leased_at = ? WHERE id = ?", [(time.time(), qid) for qid, _ in rows])
+        alphas = []
+        for qid, payload in rows:
+            alpha = json.loads(payload)
+            alpha[QUEUE_ID_KEY] = qid
+            alphas.append(alpha)
+        return alphas
+
+    def read_batch(self, batch_size = None):
+        return self.dequeue(batch_size)
+
+    def ack(self, alpha):
+        qid = alpha.get(QUEUE_ID_KEY)
+        if qid is not None:
+            with self.conn:
+                self.conn.execute("DELETE FROM pending_alphas WHERE id = ?", (qid,))
+
+    def requeue(self, alpha):
+        qid = alpha.get(QUEUE_ID_KEY)
+        if qid is not None:
+            with self.conn:
+                self.conn.execute("UPDATE pending_alphas SET leased_at = NULL WHERE id = ?", (qid,))
+
+    def requeue_leased(self):
+        with self.conn:
+            cursor = self.conn.execute("UPDATE pending_alphas SET leased_at = NULL WHERE leased_at IS NOT NULL")
+        return cursor.rowcount
+
+    def refill(self):
+        if len(self.buffer) < 1:
+            self.buffer = self.dequeue()
+
+    def pop(self):
+        self.refill()
+        if not self.buffer:
+            return None
+        return self.buffer.pop(0)
+
+    def pop_matching(self, predicate):
+        self.refill()
+        return _pop_matching(self.buffer, predicate)
+
+    def close(self):
+        for alpha in self.buffer:
+            self.requeue(alpha)
+        self.buffer = []
+        self.conn.close()
+
+
+def _pop_matching(buffer, predicate):
+    for index, alpha in enumerate(buffer):
+        if predicate(alpha):
+            return buffer.pop(index)
+    return None
+
+
+def open_alpha_queue(path, batch_size = 20, scorer = None, sort_csv = False, **kwargs):
+    '''
+    .db / .sqlite 用SqliteAlphaQueue, .json是多个campaign的配置(见campaign_scheduler.py), 其他(csv)用CsvAlphaQueue
+    scorer默认只用于SQLite队列(priority列); csv队列要sort_csv = True才按分数整体重排
+    '''
+    if path.endswith('.json'):
+        from campaign_scheduler import CampaignScheduler   # campaign_scheduler依赖本模块
+        return CampaignScheduler.from_config(path, batch_size, scorer = scorer)
+    if path.endswith(('.db', '.sqlite', '.sqlite3')):
+        return SqliteAlphaQueue(path, batch_size, scorer = scorer)
+    if scorer is not None and not sort_csv:
+        logging.info(f"Scorer ignored for csv queue {path}, import it into a SQLite queue or pass sort_csv = True to order by score")
+        scorer = None
+    return CsvAlphaQueue(path, batch_size, scorer = scorer, **kwargs)
+
+
+if __name__ == '__main__':
+    # python alpha_queue.py pending_alphas/pending.db pending_alphas/pending_simulated_fnd6_selfRatioRank.csv ...
+    import sys
+    from alpha_fingerprint import open_fingerprint_index
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s - %(levelname)s - %(message)s')
+    queue = SqliteAlphaQueue(sys.argv[1])
+    fingerprint_index = open_fingerprint_index()
+    for csv_path in sys.argv[2:]:
+        queue.import_csv(csv_path, fingerprint_index = fingerprint_index)
+    print(f"pending / leased: {queue.count()}")
+    print(fingerprint_index.report())
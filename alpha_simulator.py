@@ -2,7 +2,7 @@
 Alpha Simulator 路线图 with「随时停掉, 随时重启, 接着跑」
 
 pending: 还没开始跑的 alphs, 取出后就会被删除
-simulated_alphas_xxx.csv: 已经完成的alpha
+simulated_alphas.db: 已经完成的alpha(结果库, 历史的simulated_alphas_xxx.csv用results_store.py迁移进来)
 active_simulations.csv: 正在运行的任务
 fail_alphas.csv: 失败的alphas
 
@@ -60,13 +60,36 @@ import logging
 import time
 import ast
 import os
+import asyncio
 from datetime import datetime, timedelta
 from pytz import timezone
 from os.path import expanduser
 from requests.auth import HTTPBasicAuth
 from logging.handlers import TimedRotatingFileHandler
+from concurrent.futures import ThreadPoolExecutor
+from poll_scheduler import PollScheduler, DEADLINE
+from alpha_priority import HistoricalScorer
+from alpha_pruning import SuccessiveHalvingPruner, RUN, DROP, DEMOTE
+from self_correlation import SelfCorrelation
+from alpha_queue import open_alpha_queue, payload_of
+from task_journal import TaskJournal, TASK_ID_KEY
+from results_store import ResultsStore
+from alpha_fingerprint import open_fingerprint_index, fingerprint_of
+from simulator_metrics import SimulatorMetrics, start_status_server
+from simulator_events import EventStream
+from brain_transport import BrainTransport, RetryPolicy, BRAIN_API_URL, parse_retry_after
+from concurrency_control import AimdController, TokenBucket
 import os
 os.environ['NO_PROXY'] = 'api.worldquantbrain.com'
+# API地址(BRAIN_API_URL, 见brain_transport.py)可以用环境变量BRAIN_API_URL或构造参数base_url指向本地的mock_brain_server.py
+BRAIN_HTTP2 = os.environ.get('BRAIN_HTTP2') == '1'   # 需要 pip install 'httpx[http2]'
+# 同一个multi-simulation里的alpha这些settings必须一致
+MULTI_SIMULATION_KEYS = ('instrumentType', 'region', 'universe', 'delay', 'language')
+
+
+def multi_simulation_key(alpha):
+    settings = alpha.get('settings') if isinstance(alpha.get('settings'), dict) else {}
+    return (alpha.get('type') or 'REGULAR',) + tuple(str(settings.get(key)) for key in MULTI_SIMULATION_KEYS)
 
 '''
 # 配置日志按美东时间按天分割
@@ -111,332 +134,754 @@ def setup_logging():
 # 初始化日志
 setup_logging()
 '''
-import os
-import logging
-from datetime import datetime, timedelta
-from pytz import timezone
-from logging.handlers import BaseRotatingHandler
-
-# 自定义美东时间轮换处理器
-class EasternTimeRotatingFileHandler(BaseRotatingHandler):
-    def __init__(self, filename_template, backupCount=30):
-        self.eastern = timezone('US/Eastern')
-        self.filename_template = filename_template  # 传入带占位符的模板，如"logs/simulation_{}.log"
-        self.backupCount = backupCount
-        self.current_date = self._get_current_eastern_date()
-        self.baseFilename = self._get_current_filename()
-        # 确保日志目录存在
-        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
-        super().__init__(self.baseFilename, 'a', encoding='utf-8')
-
-    def _get_current_eastern_date(self):
-        return datetime.now(self.eastern).strftime('%Y-%m-%d')
-
-    def _get_current_filename(self):
-        return self.filename_template.format(self.current_date)
-
-    def shouldRollover(self, record):
-        # 检查美东时间是否已跨天
-        new_date = self._get_current_eastern_date()
-        if new_date != self.current_date:
-            self.current_date = new_date
-            return True
-        return False
-
-    def doRollover(self):
-        # 关闭当前日志文件
-        self.stream.close()
-        
-        # 处理旧日志（确保在logs目录内）
-        old_filename = self.baseFilename
-        if self.backupCount > 0:
-            # 无需重命名，直接使用日期命名
-            pass
-        
-        # 更新文件名并打开新文件
-        self.baseFilename = self._get_current_filename()
-        self.stream = self._open()
-
-        # 删除超出保留数量的旧日志
-        self._cleanup_old_logs()
-
-    def _cleanup_old_logs(self):
-        # 获取所有日志文件并按日期排序
-        log_dir = os.path.dirname(self.baseFilename)
-        log_files = [f for f in os.listdir(log_dir) if f.startswith('simulation_') and f.endswith('.log')]
-        log_files.sort(reverse=True)  # 最新的在前
-        
-        # 删除多余日志
-        if len(log_files) > self.backupCount:
-            for file in log_files[self.backupCount:]:
-                os.remove(os.path.join(log_dir, file))
-
-# 配置日志按美东时间按天分割
-def setup_logging():
-    # 日志格式（包含美东时间）
-    log_format = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    
-    # 创建自定义处理器（指定日志路径模板）
-    handler = EasternTimeRotatingFileHandler(
-        filename_template="logs/simulation_{}.log",
-        backupCount=30  # 保留30天的日志
-    )
-    handler.setFormatter(log_format)
-    
-    # 获取根日志器并配置
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    # 移除现有处理器避免重复输出
-    if logger.hasHandlers():
-        logger.handlers.clear()
-    logger.addHandler(handler)
-    
-    # 添加控制台输出
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(log_format)
-    logger.addHandler(console_handler)
-
-# 初始化日志
-setup_logging()
-
-
-with open(expanduser('config/brain_credentials.txt')) as f:
-    credentials = json.load(f)
-username, password = credentials
+# 日志按美东时间按天分割, 由后台线程批量写(见simulator_logging.py)
+from simulator_logging import setup_logging
 
 eastern = timezone('US/Eastern') # 获取美东时间
 fmt = '%Y-%m-%d'
 loc_dt = datetime.now(eastern)
-print("Current time in Eastern is", loc_dt.strftime(fmt))
 
 
 # logging.basicConfig(level = logging.INFO, format = '%(asctime)s - %(levelname)s - %(message)s', filename = 'simulation.log', filemode='a')
 
 
 class AlphaSimulator:
-    def __init__(self, max_concurrent, username, password, alpha_list_file_path, batch_numer_for_every_queue):
+    def __init__(self, max_concurrent, username, password, alpha_list_file_path, batch_numer_for_every_queue, alpha_queue = None, progress_file = None, journal = None, results_store = None, fingerprint_index = None, base_url = None, metrics = None, events = None, concurrency = None, multi_size = 1, scorer = None, pruner = None, correlation = None):
         self.fail_alphas = 'progress_alphas/fail_alphas.csv'
-        self.simulated_alphas = f'simulated_alphas/simulated_alphas_{loc_dt.strftime(fmt)}.csv'
-        self.progress_file = "progress_alphas/progress_state.json"   ### 改动点：新增进度文件，断点续跑使用
+        # 完成的alpha写进带索引的结果库; 历史的simulated_alphas_<date>.csv用 python results_store.py 迁移
+        self.results_store = results_store if results_store is not None else ResultsStore('simulated_alphas/simulated_alphas.db')
+        # 已回测alpha的指纹, 取出时跳过重复的; 完成后加入
+        self.fingerprint_index = fingerprint_index if fingerprint_index is not None else open_fingerprint_index(results_store = self.results_store)
+        self.progress_file = progress_file or "progress_alphas/progress_state.json"   # 旧版进度文件, 只在第一次启动时迁移进journal
         self.fail_simulations = "progress_alphas/fail_simulations.csv"
-        self.max_concurrent = max_concurrent
+        # 在跑上限由AIMD控制器动态调整: max_concurrent是初始值, 最多涨到3倍; 请求速率由令牌桶限制
+        self.concurrency = concurrency if concurrency is not None else AimdController(initial = max_concurrent, max_limit = max_concurrent * 3, name = username)
+        self.concurrency.on_change = self._on_limit_change
+        self.rate_limiter = TokenBucket(rate = 5, capacity = 10)
         self.active_simulations = []
         self.simulation_start_times = {}   ### 改动点：记录每个 simulation 的开始时间
+        self.simulation_alphas = {}   # sim_url -> 提交的alpha列表(带任务id); 普通simulation一个, multi-simulation多个
+        self.multi_size = multi_size   # >1时把最多这么多个兼容的alpha合成一个multi-simulation提交, 只占一个槽位
+        self.simulation_timeout = 600
+        self.poll_scheduler = PollScheduler(default_interval = 2, timeout = self.simulation_timeout)   # 按Retry-After排期查询, 超时也在里面
+        self.retry_after_hints = {}   # sim_url -> 最近一次查询返回的Retry-After秒数
+        self.poll_counts = {}   # sim_url -> 已查询进度的次数
+        self.submit_seconds = {}   # sim_url -> 提交花了多久(含重试), 写进submitted事件
         self.username = username
         self.password = password
+        self.base_url = (base_url or BRAIN_API_URL).rstrip('/')
+        # 计数器/直方图, 多账号共用一个; 用start_status_server暴露成/metrics和/status
+        self.metrics = metrics if metrics is not None else SimulatorMetrics()
+        self.metrics.register(self)
+        # 结构化事件流 logs/events_<date>.jsonl, 用simulation_analytics.py分析
+        self.events = events if events is not None else EventStream()
+        # 重试策略: 提交要等到有空槽位, 重试多一些; 查询进度失败了反正会重新排期, 少重试几次
+        self.submit_retry = RetryPolicy(max_attempts = 12, base_delay = 1, max_delay = 60)
+        self.poll_retry = RetryPolicy(max_attempts = 3, base_delay = 0.5, max_delay = 10)
         self.session = self.sign_in(username, password)
         self.alpha_list_file_path = alpha_list_file_path
-        self.sim_queue_ls = []
         self.batch_numer_for_every_queue = batch_numer_for_every_queue
+        # 多账号共用一个队列、一个journal时由AlphaSimulatorPool传入; .db文件用SqliteAlphaQueue
+        self.owns_queue = alpha_queue is None
+        # scorer: 按历史结果给pending打分, 先发分数高的(见alpha_priority.py); None为FIFO
+        self.scorer = scorer
+        # pruner: 同一字段的变体先跑几个探路, 结果差的字段剩下的变体不再跑(见alpha_pruning.py); None为不淘汰
+        self.pruner = pruner
+        # correlation: 完成的alpha后台拉PnL, 本地算和已提交alpha的自相关(见self_correlation.py); None为不拉
+        self.correlation = correlation
+        self.owns_correlation = True   # AlphaSimulatorPool里共用一个, 由pool在退出时close
+        self.alpha_queue = alpha_queue if alpha_queue is not None else open_alpha_queue(alpha_list_file_path, batch_numer_for_every_queue, scorer = scorer)
+        self.journal = journal if journal is not None else TaskJournal("progress_alphas/task_journal.jsonl")   # 任务状态的预写日志, 取代整份重写progress_state.json
 
         self._load_progress()   ### 改动点：初始化时恢复上次进度
+        for sim_url in self.active_simulations:
+            self.poll_scheduler.add(sim_url, self.simulation_start_times.get(sim_url))
+
+    @property
+    def max_concurrent(self):
+        return self.concurrency.limit
+
+    @property
+    def sim_queue_ls(self):
+        return self.alpha_queue.buffer
 
-    def _save_progress(self):   ### 改动点：保存进度
-        state = {
-            "sim_queue_ls": self.sim_queue_ls,
-            "active_simulations": self.active_simulations
-        }
-        with open(self.progress_file, "w") as f:
-            json.dump(state, f)
+    @sim_queue_ls.setter
+    def sim_queue_ls(self, alphas):
+        self.alpha_queue.buffer = alphas
+
+    def _migrate_legacy_progress(self):
+        '''
+        旧版progress_state.json只有sim_queue_ls和url, 没有开始时间: 迁移时开始时间按现在算
+        '''
+        try:
+            with open(self.progress_file, "r") as f:
+                state = json.load(f)
+        except Exception as e:
+            logging.error(f"Fail to recover progress: {e}")
+            return
+        if self.owns_queue:
+            for alpha in state.get("sim_queue_ls", []):
+                self.journal.queued(alpha)
+        for sim_url in state.get("active_simulations", []):
+            self.journal.submitted({}, sim_url, account = self.username)
+        os.replace(self.progress_file, self.progress_file + ".migrated")
+        logging.info(f"Migrated {self.progress_file} into task journal {self.journal.path}")
 
     def _load_progress(self):   ### 改动点：恢复进度
+        '''
+        重放journal: 恢复本账号在跑的simulation(含payload和真实开始时间), 自己的队列还要恢复未提交的alpha
+        '''
         if os.path.exists(self.progress_file):
-            try:
-                with open(self.progress_file, "r") as f:
-                    state = json.load(f)
-                self.sim_queue_ls = state.get("sim_queue_ls", [])
-                self.active_simulations = state.get("active_simulations", [])
-                logging.info(f"Recover progress successfully: {len(self.sim_queue_ls)} pending, {len(self.active_simulations)} active")
-            except Exception as e:
-                logging.error(f"Fail to recover progress: {e}")
+            self._migrate_legacy_progress()
+        for task_id, task in self.journal.active_tasks(account = self.username):
+            alpha = dict(task['payload'] or {})
+            alpha[TASK_ID_KEY] = task_id
+            if task['url'] not in self.simulation_alphas:
+                self.active_simulations.append(task['url'])
+                self.simulation_start_times[task['url']] = task['submitted_at']
+            self.simulation_alphas.setdefault(task['url'], []).append(alpha)
+        if self.owns_queue:
+            restore_queue_buffer(self.journal, self.alpha_queue)
+        logging.info(f"Recover progress successfully: {len(self.sim_queue_ls)} pending, {len(self.active_simulations)} active")
 
     def sign_in(self, username, password):
-        s = requests.Session()
-        s.auth = (username, password)
-        count = 0
-        count_limit = 30
-        while True:
-            try:
-                response = s.post('https://api.worldquantbrain.com/authentication')
-                response.raise_for_status()
-                break
-            except:
-                count += 1
-                logging.error("Connection down, try to login again...")
-                time.sleep(1)
-                if count > count_limit:
-                    logging.error(f"{username} failed too many times, returning None.")
-                    return None
+        '''
+        返回BrainTransport(用法同requests.Session); 登录重试、session过期后的重新登录都在transport里
+        '''
+        transport = BrainTransport(self.base_url, username, password, pool_size = self.concurrency.max_limit * 2 + 4, http2 = BRAIN_HTTP2,
+                                   rate_limiter = self.rate_limiter, on_login = self._on_login, on_retry = self._on_retry, on_throttle = self._on_throttle)
+        if not transport.sign_in():
+            logging.error(f"{username} failed too many times, returning None.")
+            return None
+        return transport
+
+    def _on_login(self, relogin):
         logging.info("Login to BRAIN successfully.")
-        return s
-    
+        self.metrics.inc('relogins_total' if relogin else 'logins_total', self.username)
+        self.events.emit('login', account = self.username, relogin = relogin)
+
+    def _on_retry(self, cause):
+        self.metrics.inc('http_retries_total', self.username, cause = cause)
+
+    def _on_throttle(self, concurrent_limit):
+        # 并发上限的429: 平台此刻认的上限就是已经在跑的数量
+        self.concurrency.on_throttled(self._in_flight(), concurrent_limit = concurrent_limit)
+
+    def _on_limit_change(self, old, new, reason):
+        self.events.emit('limit', account = self.username, old = old, new = new, reason = reason)
+
+    def _in_flight(self):
+        return len(self.active_simulations)
+
     def read_alphas_frm_csv_in_batches(self, batch_size = 50):
+        return self.alpha_queue.read_batch(batch_size)
+
+    def _post_simulation(self, payload):
         '''
-        1. d打开alpha_list_pending_simulated
-        2. 去除batch_size个alpha放入列表变量alphas
-        3. 取出后覆写(overwrite) alpha_list_pending_simulated
-        4. 把取出的alphas写到sim_queue.csv文件中,方便随时监控在排队的alpha有多少
-        5. 返回列表变量alphas
+        重试(429 / 5xx / 网络错误, 指数退避)和重新登录(401)由transport处理; 返回location, 失败返回None
         '''
-        alphas = []
-        temp_file_name = self.alpha_list_file_path + '.tmp'
-        with open(self.alpha_list_file_path, 'r') as file, open(temp_file_name, 'w', newline = '') as temp_file:
-            reader = csv.DictReader(file)
-            fieldnemas = reader.fieldnames
-            writer = csv.DictWriter(temp_file, fieldnames = fieldnemas)
-            writer.writeheader()
-            for _ in range(batch_size):
-                try:
-                    row = next(reader)
-                    if 'settings' in row:
-                        if isinstance(row['settings'], str):
-                            try:
-                                row['settings'] = ast.literal_eval(row['settings'])
-                            except (ValueError, SyntaxError):
-                                print(f"Error wvaluating settings: {row['settings']}")
-                        elif isinstance(row['settings'], dict):
-                            pass
-                        else:
-                            print(f"Unexcepted type for settings:{type(row['settings'])}")
-                    alphas.append(row)
-                except StopIteration:
-                    break
-            for remaining_row in reader:
-                writer.writerow(remaining_row)
-        os.replace(temp_file_name, self.alpha_list_file_path)
-        if alphas:
-            with open('progress_alphas/sim_queue.csv', 'w') as file:
-                writer = csv.DictWriter(file, fieldnames = alphas[0].keys())
-                if file.tell() == 0:
-                    writer.writeheader()
-                writer.writerows(alphas)
-        return alphas
-    
+        started = time.time()
+        try:
+            response = self.session.post(f'{self.base_url}/simulations', json = payload, retry = self.submit_retry)
+            response.raise_for_status()
+            if "location" in response.headers:
+                logging.info("Alpha location retrieved successfully.")
+                logging.info(f"Location:{response.headers['Location']}")
+                self.metrics.observe('submit_latency_seconds', time.time() - started, self.username)
+                self.submit_seconds[response.headers['Location']] = round(time.time() - started, 3)
+                return response.headers['Location']
+            logging.error(f"No location in simulation response: {response.status_code}")
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error in sending simualtion request:{e}")
+        logging.error(f"Simulation request failed after {time.time() - started:.1f}s, skipping this alpha.")
+        return None
+
     def simulate_alpha(self, alpha):
-        count = 0
-        while True:
-            try:
-                response = self.session.post('https://api.worldquantbrain.com/simulations', json = alpha)
-                response.raise_for_status
-                if "location" in response.headers:
-                    logging.info("Alpha location retrieved successfully.")
-                    logging.info(f"Location:{response.headers['Location']}")
-                    return response.headers['Location']
-            except requests.exceptions.RequestException as e:
-                logging.error(f"Error in sending simualtion request:{e}")
-                if count > 35:
-                    self.session = self.sign_in(self.username, self.password)
-                    logging.error("Error occured too many times, skipping this alpha and re logging in.")
-                    break
-                logging.error("Error in sending simulation request. Retry after 5s...")
-                time.sleep(5)
-                count += 1
-        logging.error("Simulation request failed  after {count} attempts.")
+        location_url = self._post_simulation(payload_of(alpha))
+        if location_url is None:
+            self._record_fail_alpha(alpha)
+        return location_url
+
+    def simulate_alphas(self, alphas):
+        '''
+        一个alpha走simulate_alpha; 多个alpha作为一个multi-simulation提交(payload是列表)
+        '''
+        if len(alphas) == 1:
+            return self.simulate_alpha(alphas[0])
+        location_url = self._post_simulation([payload_of(alpha) for alpha in alphas])
+        if location_url is None:
+            for alpha in alphas:
+                self._record_fail_alpha(alpha)
+        return location_url
+
+    def _record_fail_alpha(self, alpha):
+        alpha = payload_of(alpha)
         with open(self.fail_alphas, 'a', newline = '') as file:
             writer = csv.DictWriter(file, fieldnames = alpha.keys())
             writer.writerow(alpha)
-        return None
-    
+
+    def _record_fail_simulation(self, sim_id):
+        with open(self.fail_simulations, 'a', newline = '') as file:
+            writer = csv.DictWriter(file, fieldnames = ["id"])
+            writer.writerow({"id": sim_id})
+
+    def _record_simulated_alpha(self, sim_progress):
+        self.results_store.add(sim_progress, account = self.username)   # 标记是哪个账号跑的
+        self.metrics.inc('completed_total', self.username)
+        self.fingerprint_index.add_alpha(sim_progress)
+        if hasattr(self.scorer, 'observe'):
+            self.scorer.observe(sim_progress)
+        if self.pruner is not None:
+            self.pruner.report(sim_progress, sim_progress)
+        if self.correlation is not None:
+            self.correlation.observe(sim_progress, session = self.session)
+
+    def _next_alpha(self, match = None):
+        '''
+        从sim_queue_ls弹出下一个alpha, 队列空了就先从csv文件中重新填充
+        match: 只弹出满足条件的alpha(凑multi-simulation用)
+        没有alpha可用时返回None
+        '''
+        if self.pruner is not None:
+            for alpha in self.pruner.take_dropped():
+                self._drop_pruned(alpha)
+            alpha = self.pruner.pop_ready(match)   # 探路通过的分组放行的变体优先
+            if alpha is not None:
+                return alpha
+        while True:
+            alpha = None
+            if self.pruner is None or not self.pruner.full():
+                self.alpha_queue.refill()
+                for queued_alpha in self.sim_queue_ls:
+                    if TASK_ID_KEY not in queued_alpha:
+                        self.journal.queued(queued_alpha)
+                alpha = self.alpha_queue.pop() if match is None else self.alpha_queue.pop_matching(match)
+            if alpha is None:
+                demoted = self.pruner.pop_demoted(match) if self.pruner is not None else None
+                if demoted is None and match is None:
+                    logging.info("No alphas available in the queue.")
+                return demoted
+            if self.fingerprint_index.seen(alpha):
+                logging.info(f"Skip already simulated alpha: {alpha.get('regular')}. {self.fingerprint_index.report()}")
+                self.journal.dropped(alpha.get(TASK_ID_KEY))
+                self.alpha_queue.ack(alpha)
+                self.metrics.inc('duplicates_skipped_total', self.username)
+                self.events.emit('dropped', account = self.username, fingerprint = fingerprint_of(alpha))
+                continue
+            decision = self.pruner.admit(alpha) if self.pruner is not None else RUN
+            if decision == RUN:
+                return alpha
+            if decision == DROP:
+                self._drop_pruned(alpha)
+            # HOLD / DEMOTE: alpha由pruner保管, 不ack, 重启后会从journal / SQLite的leased里恢复
+
+    def _drop_pruned(self, alpha):
+        logging.info(f"Pruned alpha: {alpha.get('regular')}. {self.pruner.summary()}")
+        self.journal.dropped(alpha.get(TASK_ID_KEY))
+        self.alpha_queue.ack(alpha)
+        self.metrics.inc('pruned_total', self.username)
+        self.events.emit('dropped', account = self.username, fingerprint = fingerprint_of(alpha), reason = 'pruned')
+
+    def _next_batch(self):
+        '''
+        multi_size > 1 时, 再从队列里取最多multi_size - 1个settings兼容的alpha, 和第一个一起提交
+        '''
+        alpha = self._next_alpha()
+        if alpha is None:
+            return []
+        batch = [alpha]
+        key = multi_simulation_key(alpha)
+        while len(batch) < self.multi_size:
+            alpha = self._next_alpha(match = lambda queued_alpha: multi_simulation_key(queued_alpha) == key)
+            if alpha is None:
+                break
+            batch.append(alpha)
+        return batch
+
+    def _start_simulation(self, location_url, alphas):
+        self.active_simulations.append(location_url)
+        self.simulation_start_times[location_url] = time.time()   ### 改动点：记录开始时间
+        self.simulation_alphas[location_url] = alphas
+        self.poll_scheduler.add(location_url, self.simulation_start_times[location_url])
+        submit_seconds = self.submit_seconds.pop(location_url, None)
+        for alpha in alphas:
+            self.journal.submitted(alpha, location_url, account = self.username, ts = self.simulation_start_times[location_url])
+            self.metrics.inc('submitted_total', self.username)
+            self.events.emit('submitted', sim_url = location_url, account = self.username, fingerprint = fingerprint_of(alpha),
+                             expression = alpha.get('regular'), submit_seconds = submit_seconds, batch = len(alphas) if len(alphas) > 1 else None)
+        self.concurrency.on_submitted(self._in_flight())
+
+    def _submit_failed(self, alphas):
+        for alpha in alphas:
+            if self.pruner is not None:
+                self.pruner.report(alpha)
+            self.journal.failed(alpha.get(TASK_ID_KEY), reason = 'submit')
+            self.metrics.inc('failures_total', self.username, cause = 'submit')
+            self.events.emit('failed', account = self.username, fingerprint = fingerprint_of(alpha), reason = 'submit')
+
+    def _finish_simulation(self, sim_url, alpha_id = None, reason = None, outcomes = None):
+        '''
+        reason为None表示正常完成, 否则记为失败(error / timeout)
+        outcomes: multi-simulation每个child各自的结果 [(alpha, alpha_id, reason)]; 不传时所有alpha都是同一个结果
+        '''
+        alphas = self.simulation_alphas.pop(sim_url, None) or [{}]
+        if outcomes is None:
+            outcomes = [(alpha, alpha_id, reason) for alpha in alphas]
+        for alpha, child_alpha_id, child_reason in outcomes:
+            fingerprint = fingerprint_of(alpha) if alpha.get('regular') else None
+            self.events.emit('completed' if child_reason is None else 'failed', sim_url = sim_url, account = self.username,
+                             fingerprint = fingerprint, alpha_id = child_alpha_id, reason = child_reason)
+            if child_reason is None:
+                self.journal.completed(alpha.get(TASK_ID_KEY), url = sim_url, alpha_id = child_alpha_id)
+            else:
+                self.journal.failed(alpha.get(TASK_ID_KEY), url = sim_url, reason = child_reason)
+                self.metrics.inc('failures_total', self.username, cause = child_reason)
+                if self.pruner is not None:
+                    self.pruner.report(alpha)
+        if any(child_reason is None for _, _, child_reason in outcomes) and self.simulation_start_times.get(sim_url):
+            self.metrics.observe('completion_seconds', time.time() - self.simulation_start_times[sim_url], self.username)
+            self.concurrency.on_completed(time.time() - self.simulation_start_times[sim_url])
+        self.metrics.observe('polls_per_simulation', self.poll_counts.pop(sim_url, 0), self.username)
+        self.active_simulations.remove(sim_url)
+        self.simulation_start_times.pop(sim_url, None)   ### 改动点：移除计时
+        self.poll_scheduler.remove(sim_url)
+        self.retry_after_hints.pop(sim_url, None)
+
     def load_new_alpha_and_simulate(self):
-        if len(self.sim_queue_ls) < 1:
-            self.sim_queue_ls = self.read_alphas_frm_csv_in_batches(self.batch_numer_for_every_queue)
+        self.alpha_queue.refill()
 
         if len(self.active_simulations) >= self.max_concurrent:
-            logging.info(f"Max concurrent simulations reached({self.max_concurrent}). Waiting 2 seconds")
-            time.sleep(2)
+            logging.info(f"Max concurrent simulations reached({self.max_concurrent}). Waiting for the next due simulation")
             return
-        
+
         logging.info("Loadin new alpha...")
-        try:
-            alpha = self.sim_queue_ls.pop(0)
+        alphas = self._next_batch()
+        if not alphas:
+            return
+        for alpha in alphas:
             logging.info(f"Strating simulation for alpha: {alpha['regular']} with settings: {alpha['settings']}")
-            location_url = self.simulate_alpha(alpha)
-            if location_url:
-                self.active_simulations.append(location_url)
-                self.simulation_start_times[location_url] = time.time()   ### 改动点：记录开始时间
-                self._save_progress()   ### 改动点：保存进度
-        except IndexError:
-            logging.info("No alphas available in the queue.")
+        location_url = self.simulate_alphas(alphas)
+        if location_url:
+            self._start_simulation(location_url, alphas)
+        else:
+            self._submit_failed(alphas)
+        for alpha in alphas:
+            self.alpha_queue.ack(alpha)   # 拿到location或已写入fail_alphas, 都可以从队列里确认删除
 
     def check_simulation_porgress(self, simulation_progress_url):
+        self.poll_counts[simulation_progress_url] = self.poll_counts.get(simulation_progress_url, 0) + 1
+        self.metrics.inc('polls_total', self.username)
         try:
-            simulation_progress = self.session.get(simulation_progress_url)
+            simulation_progress = self.session.get(simulation_progress_url, retry = self.poll_retry)
             simulation_progress.raise_for_status()
             # logging.info(simulation_progress.json())
-            if simulation_progress.headers.get("Rety-After", 0) == 0:
+            retry_after = parse_retry_after(simulation_progress)
+            if retry_after is None and simulation_progress.headers.get("Retry-After"):
+                # 既不是秒数也不是HTTP日期: 当作还没跑完, 按默认间隔再查
+                logging.warning(f"Unparseable Retry-After {simulation_progress.headers.get('Retry-After')!r} from {simulation_progress_url}")
+                retry_after = self.poll_scheduler.default_interval
+            retry_after = retry_after or 0
+            self.events.emit('polled', sim_url = simulation_progress_url, account = self.username, retry_after = retry_after)
+            self.retry_after_hints[simulation_progress_url] = retry_after
+            if retry_after == 0:
+                children = simulation_progress.json().get("children")
+                if children:
+                    return {"children": [self._child_result(child_id) for child_id in children]}
                 alpha_id = simulation_progress.json().get("alpha")
                 if alpha_id:
-                    alpha_response = self.session.get(f"https://api.worldquantbrain.com/alphas/{alpha_id}")
-                    alpha_response.raise_for_status
+                    alpha_response = self.session.get(f"{self.base_url}/alphas/{alpha_id}", retry = self.poll_retry)
+                    alpha_response.raise_for_status()
                     return alpha_response.json()
                 status = simulation_progress.json().get("status")
                 if status == 'ERROR':
                     logging.error(f"{simulation_progress_url} request get ERROR status")
-                    with open(self.fail_simulations, 'a', newline = '') as file:
-                        writer = csv.DictWriter(file, fieldnames = ["id"])
-                        writer.writerow({"id": simulation_progress.json().get("id")})
+                    self._record_fail_simulation(simulation_progress.json().get("id"))
                     return simulation_progress.json()
         except requests.exceptions.RequestException as e:
             logging.error(f"Error fetching simulation progress: {e}")
-            self.session = self.sign_in(self.username, self.password)
+            self.metrics.inc('failures_total', self.username, cause = 'poll')
             return None
-        
+
+    def _child_result(self, child_id):
+        '''
+        multi-simulation的一个child: 完成返回/alphas/{id}的结果, 出错返回child的进度(status为ERROR)
+        '''
+        child_progress = self.session.get(f"{self.base_url}/simulations/{child_id}", retry = self.poll_retry)
+        child_progress.raise_for_status()
+        child = child_progress.json()
+        if child.get("alpha"):
+            alpha_response = self.session.get(f"{self.base_url}/alphas/{child['alpha']}", retry = self.poll_retry)
+            alpha_response.raise_for_status()
+            return alpha_response.json()
+        logging.error(f"Child simulation {child_id} ended with status: {child.get('status')}")
+        self._record_fail_simulation(child.get("id", child_id))
+        return dict(child, status = 'ERROR')
+
+    def _reschedule_poll(self, sim_url):
+        self.poll_scheduler.reschedule(sim_url, self.retry_after_hints.get(sim_url))
+
+    def _timeout_simulation_id(self, sim_url):
+        logging.error(f"{sim_url} request takes more than 10 minutes.")
+        try:
+            sim_progress = self.session.get(sim_url, retry = self.poll_retry)
+            sim_progress.raise_for_status()
+            sim_data = sim_progress.json()
+        except Exception as e:
+            sim_data = {"id": "unknown"}
+            logging.error(f"Failed to fetch simulation id for timeout case: {e}")
+        return sim_data.get("id")
+
+    def _expire_simulation(self, sim_url, sim_id):
+        '''
+        超时(simulation_timeout, 默认600秒 = 10分钟)的simulation: 记录到fail_simulations.csv并移出活动列表
+        '''
+        self._record_fail_simulation(sim_id)
+        self._finish_simulation(sim_url, reason = 'timeout')
+
+    def _complete_multi_simulation(self, sim_url, children):
+        '''
+        child结果按指纹对回提交的alpha(对不上的按提交顺序), 每个alpha各自记结果
+        '''
+        unmatched = list(self.simulation_alphas.get(sim_url, []))
+        paired = [None] * len(children)
+        for index, child in enumerate(children):
+            if not child.get('regular'):
+                continue
+            fingerprint = fingerprint_of(child)
+            for alpha in unmatched:
+                if alpha.get('regular') and fingerprint_of(alpha) == fingerprint:
+                    paired[index] = alpha
+                    unmatched.remove(alpha)
+                    break
+        for index in range(len(children)):
+            if paired[index] is None:
+                paired[index] = unmatched.pop(0) if unmatched else {}
+        outcomes = []
+        for alpha, child in zip(paired, children):
+            if child.get('status') == 'ERROR':
+                outcomes.append((alpha, None, 'error'))
+                continue
+            logging.info(f"Alpha id: {child.get('id')} ended with status: {child.get('status')}. Removing from active list.")
+            self._record_simulated_alpha(child)
+            outcomes.append((alpha, child.get('id'), None))
+        outcomes.extend((alpha, None, 'error') for alpha in unmatched)   # 没有对应child的alpha
+        self._finish_simulation(sim_url, outcomes = outcomes)
+
+    def _complete_simulation(self, sim_url, sim_progress):
+        if "children" in sim_progress:
+            self._complete_multi_simulation(sim_url, sim_progress["children"])
+            return
+        alpha_id = sim_progress.get("id")
+        status = sim_progress.get("status")
+        if status != 'ERROR':
+            logging.info(f"Alpha id: {alpha_id} ended with status: {status}. Removing from active list.")
+            self._record_simulated_alpha(sim_progress)
+            self._finish_simulation(sim_url, alpha_id = alpha_id)
+        else:
+            self._finish_simulation(sim_url, reason = 'error')
+
     def check_simulation_status(self):
-        count = 0
+        '''
+        只查询poll_scheduler里已经到期的simulation:
+        - POLL到期: 查询进度, 没完成就按Retry-After重新排期
+        - DEADLINE到期: 超时, 记录失败并移出活动列表
+        '''
         if len(self.active_simulations) == 0:
             logging.info("No one is in active simulation row.")
             return None
-        for sim_url in list(self.active_simulations):
+        for sim_url, kind in self.poll_scheduler.pop_due():
+            if sim_url not in self.active_simulations:
+                continue
+            if kind == DEADLINE:
+                self._expire_simulation(sim_url, self._timeout_simulation_id(sim_url))
+                continue
             sim_progress = self.check_simulation_porgress(sim_url)
             if sim_progress is None:
-                # ✅ 改动点：检查是否超时（600秒 = 10分钟）
-                start_time = self.simulation_start_times.get(sim_url)
-                if start_time and (time.time() - start_time > 600):
-                    logging.error(f"{sim_url} request takes more than 10 minutes.")
-                    try:
-                        sim_progress = self.session.get(sim_url)
-                        sim_progress.raise_for_status()
-                        sim_data = sim_progress.json()
-                    except Exception as e:
-                        sim_data = {"id": "unknown"}
-                        logging.error(f"Failed to fetch simulation id for timeout case: {e}")
-                    with open(self.fail_simulations, 'a', newline='') as file:
-                        writer = csv.DictWriter(file, fieldnames=["id"])
-                        writer.writerow({"id": sim_data.get("id")})
-                    self.active_simulations.remove(sim_url)
-                    self.simulation_start_times.pop(sim_url, None)   ### 移除计时
-                    self._save_progress()
-                    continue   # 跳过后续正常检查
-                else :
-                    count += 1
-                    continue
-            alpha_id = sim_progress.get("id")
-            status = sim_progress.get("status")
-            if status != 'ERROR':
-                logging.info(f"Alpha id: {alpha_id} ended with status: {status}. Removing from active list.")
-                with open(self.simulated_alphas, 'a', newline = '') as file:
-                    writer = csv.DictWriter(file, fieldnames = sim_progress.keys())
-                    writer.writerow(sim_progress)
-            self.active_simulations.remove(sim_url)
-            self.simulation_start_times.pop(sim_url, None)   ### 改动点：移除计时
-            self._save_progress()   ### 改动点：保存进度
-        logging.info(f"Total {count} simulations are in progress for account {self.username}")
+                self._reschedule_poll(sim_url)
+                continue
+            self._complete_simulation(sim_url, sim_progress)
+        logging.info(f"Total {len(self.active_simulations)} simulations are in progress for account {self.username}")
+
+    def _idle_seconds(self, cap = 2):
+        '''
+        主循环下一次醒来前要睡多久: 槽位满了就一直睡到最早到期的simulation, 否则最多睡cap秒再尝试提交
+        '''
+        if len(self.active_simulations) >= self.max_concurrent:
+            return self.poll_scheduler.seconds_until_due(cap = None) or 0
+        return self.poll_scheduler.seconds_until_due(cap = cap)
 
     def manage_simulations(self):
         if not self.session:
             logging.error("Failed to sign in. Exiting...")
             return
+        self.events.emit('started', account = self.username, max_concurrent = self.max_concurrent)
+        try:
+            while True:
+                self.check_simulation_status()
+                self.load_new_alpha_and_simulate()
+                time.sleep(self._idle_seconds())
+        finally:
+            self.journal.sync()
+            if self.correlation is not None and self.owns_correlation:
+                self.correlation.close()   # 等还在排队的PnL拉完再落盘
+
+
+class AsyncAlphaSimulator(AlphaSimulator):
+    '''
+    asyncio版本的回测引擎, 文件语义(pending / progress / simulated / fail)与AlphaSimulator完全一致
+
+    - 提交(simulate_alpha)、进度查询(check_simulation_porgress, 包含/alphas/{id})都作为独立的task并发执行,
+      一个慢请求不会卡住其他槽位
+    - requests是阻塞的, 所有HTTP调用都放到专用线程池里跑, 事件循环只负责调度和写文件
+    - 有simulation结束时立刻唤醒提交循环补位, 不再固定sleep 2秒
+    '''
+    def __init__(self, *args, poll_interval = 2, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.poll_interval = poll_interval
+        self.submitting = 0   # 正在提交、还没拿到location的simulation数(一个multi-simulation算一个)
+        self.poll_scheduler.default_interval = poll_interval
+        self.executor = ThreadPoolExecutor(max_workers = self.concurrency.max_limit * 2 + 4)
+        self.slot_freed = None
+        self.schedule_changed = None   # 新增simulation时唤醒_poll_loop重新计算睡眠时间
+        self.tasks = set()   # 提交 / 查询 / 超时的task, 留着引用, 结束时取出异常写日志
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Simulator task failed: {task.exception()!r}", exc_info = task.exception())
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def _free_slots(self):
+        return self.max_concurrent - len(self.active_simulations) - self.submitting
+
+    def _in_flight(self):
+        return len(self.active_simulations) + self.submitting
+
+    def _on_throttle(self, concurrent_limit):
+        # 被拒的这次提交也算在submitting里, 不算它; 其他还在提交的可能已经在平台上跑了, 所以算上
+        self.concurrency.on_throttled(self._in_flight() - 1, concurrent_limit = concurrent_limit)
+
+    def _on_limit_change(self, old, new, reason):
+        super()._on_limit_change(old, new, reason)
+        # 上限提高只发生在事件循环里(_start_simulation), 唤醒提交循环补位
+        if new > old and self.slot_freed is not None:
+            self.slot_freed.set()
+
+    def _start_simulation(self, location_url, alphas):
+        super()._start_simulation(location_url, alphas)
+        if self.schedule_changed is not None:
+            self.schedule_changed.set()
+
+    def _finish_simulation(self, sim_url, alpha_id = None, reason = None, outcomes = None):
+        super()._finish_simulation(sim_url, alpha_id = alpha_id, reason = reason, outcomes = outcomes)
+        if self.slot_freed is not None:
+            self.slot_freed.set()
+
+    async def _submit(self, alphas):
+        started = False
+        try:
+            for alpha in alphas:
+                logging.info(f"Strating simulation for alpha: {alpha['regular']} with settings: {alpha['settings']}")
+            location_url = await self._call(self.simulate_alphas, alphas)
+            if location_url:
+                started = True   # 平台上已经在跑了, 之后出错也不能再放回队列
+                self._start_simulation(location_url, alphas)
+            else:
+                self._submit_failed(alphas)
+            for alpha in alphas:
+                self.alpha_queue.ack(alpha)
+        except Exception:
+            # 意外错误(写fail_alphas / journal失败等): 还没提交成功的放回队列, 之后重发
+            if not started:
+                for alpha in reversed(alphas):
+                    self.alpha_queue.requeue(alpha)
+            raise
+        finally:
+            self.submitting -= 1
+            self.slot_freed.set()
+
+    async def _poll(self, sim_url):
+        try:
+            sim_progress = await self._call(self.check_simulation_porgress, sim_url)
+            if sim_progress is not None and sim_url in self.active_simulations:
+                self._complete_simulation(sim_url, sim_progress)
+        finally:
+            # 没跑完、查询失败或处理结果时出错: 只要还在活动列表里就重新排期, 不会一直占着槽位等到超时
+            if sim_url in self.active_simulations:
+                self._reschedule_poll(sim_url)
+                self.schedule_changed.set()
+
+    async def _expire(self, sim_url):
+        sim_id = await self._call(self._timeout_simulation_id, sim_url)
+        if sim_url in self.active_simulations:
+            self._expire_simulation(sim_url, sim_id)
+
+    async def _poll_loop(self):
+        '''
+        只在有simulation到期时醒来; 没有到期的就睡到最早的到期时间(或有新simulation加入)
+        '''
         while True:
-            self.check_simulation_status()
-            self.load_new_alpha_and_simulate()
-            time.sleep(2)
-
-# pending_alphas/pending_simulated_fnd6_ratioRank.csv
-# pending_alphas/pending_simulated_fnd6_selfRatioRank.csv
-# pending_simulated_fnd6_ratioRank_shuffled
-alpha_list_file_path = 'pending_alphas/pending_simulated_fnd6_ratioRank_shuffled.csv'
-simulator = AlphaSimulator(max_concurrent = 3, username = username, password = password, alpha_list_file_path = alpha_list_file_path, batch_numer_for_every_queue = 20)
-simulator.manage_simulations()
\ No newline at end of file
+            due_items = self.poll_scheduler.pop_due()
+            for sim_url, kind in due_items:
+                if sim_url not in self.active_simulations:
+                    continue
+                if kind == DEADLINE:
+                    self._spawn(self._expire(sim_url))
+                else:
+                    self._spawn(self._poll(sim_url))
+            if due_items:
+                logging.info(f"Total {len(self.active_simulations)} simulations are in progress for account {self.username}")
+            self.schedule_changed.clear()
+            try:
+                await asyncio.wait_for(self.schedule_changed.wait(), timeout = self.poll_scheduler.seconds_until_due())
+            except asyncio.TimeoutError:
+                pass
+
+    async def _submit_loop(self):
+        while True:
+            if self._free_slots() <= 0:
+                self.slot_freed.clear()
+                await self.slot_freed.wait()
+                continue
+            logging.info("Loadin new alpha...")
+            alphas = self._next_batch()
+            if not alphas:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            self.submitting += 1
+            self._spawn(self._submit(alphas))
+
+    async def run(self):
+        if not self.session:
+            logging.error("Failed to sign in. Exiting...")
+            return
+        self.slot_freed = asyncio.Event()
+        self.schedule_changed = asyncio.Event()
+        self.events.emit('started', account = self.username, max_concurrent = self.max_concurrent)
+        try:
+            await asyncio.gather(self._poll_loop(), self._submit_loop())
+        finally:
+            self.executor.shutdown(wait = False)
+            self.journal.sync()
+            if self.correlation is not None and self.owns_correlation:
+                self.correlation.close()   # 等还在排队的PnL拉完再落盘
+
+    def manage_simulations(self):
+        asyncio.run(self.run())
+
+
+def restore_queue_buffer(journal, alpha_queue):
+    '''
+    journal里已进入内存队列、还没提交的alpha:
+    - CsvAlphaQueue取出时已从csv删掉, 放回内存缓冲
+    - SqliteAlphaQueue重启时会自己把leased的行放回表里, journal里的这些任务直接作废
+    - CampaignScheduler按alpha所属的campaign分别处理
+    '''
+    if hasattr(alpha_queue, 'restore'):
+        alpha_queue.restore(journal)
+    elif alpha_queue.saves_buffer:
+        for task_id, _ in journal.queued_tasks():
+            journal.dropped(task_id)
+    else:
+        alpha_queue.buffer = journal.queued_alphas() + alpha_queue.buffer
+
+
+class AlphaSimulatorPool:
+    '''
+    多账号共用一个pending队列
+
+    - 每个账号一个AsyncAlphaSimulator: 各自的session、max_concurrent、重新登录和进度文件
+    - 所有账号共用一个队列(CsvAlphaQueue / SqliteAlphaQueue), 跑在同一个事件循环里, 同一个alpha只会发给一个账号
+    - 所有账号共用一个TaskJournal, 记录里带account, 重启后各账号只恢复自己在跑的simulation
+    - 结果写入结果库时带上account列
+    accounts: [(username, password)] 或 [(username, password, max_concurrent)]
+    '''
+    def __init__(self, accounts, alpha_list_file_path, batch_numer_for_every_queue, max_concurrent = 3, poll_interval = 2, base_url = None, multi_size = 1, scorer = None, pruner = None, correlation = None):
+        self.alpha_queue = open_alpha_queue(alpha_list_file_path, batch_numer_for_every_queue, scorer = scorer)
+        self.journal = TaskJournal("progress_alphas/pool_task_journal.jsonl")
+        self.results_store = ResultsStore('simulated_alphas/simulated_alphas.db')
+        self.fingerprint_index = open_fingerprint_index(results_store = self.results_store)
+        self.metrics = SimulatorMetrics()
+        self.events = EventStream()
+        self.correlation = correlation
+        restore_queue_buffer(self.journal, self.alpha_queue)
+        self.simulators = []
+        for account in accounts:
+            username, password = account[0], account[1]
+            account_max_concurrent = account[2] if len(account) > 2 else max_concurrent
+            simulator = AsyncAlphaSimulator(
+                max_concurrent = account_max_concurrent, username = username, password = password,
+                alpha_list_file_path = alpha_list_file_path, batch_numer_for_every_queue = batch_numer_for_every_queue,
+                alpha_queue = self.alpha_queue, progress_file = f"progress_alphas/progress_state_{username}.json",
+                journal = self.journal, results_store = self.results_store, fingerprint_index = self.fingerprint_index,
+                metrics = self.metrics, events = self.events, poll_interval = poll_interval, base_url = base_url, multi_size = multi_size,
+                scorer = scorer, pruner = pruner, correlation = correlation)
+            simulator.owns_correlation = False
+            self.simulators.append(simulator)
+        logging.info(f"Simulator pool ready: {len(self.simulators)} accounts, {sum(s.max_concurrent for s in self.simulators)} slots in total")
+
+    async def run(self):
+        try:
+            await asyncio.gather(*(simulator.run() for simulator in self.simulators))
+        finally:
+            if self.correlation is not None:
+                self.correlation.close()   # 所有账号都停了才关, 等还在排队的PnL拉完再落盘
+
+    def manage_simulations(self):
+        asyncio.run(self.run())
+
+
+def load_accounts(credentials_path = 'config/brain_credentials.txt'):
+    '''
+    brain_credentials.txt 可以是 ["username", "password"],
+    也可以是多个账号 [["username", "password"], ["username", "password", max_concurrent], ...]
+    '''
+    with open(expanduser(credentials_path)) as f:
+        credentials = json.load(f)
+    if credentials and isinstance(credentials[0], str):
+        return [tuple(credentials)]
+    return [tuple(account) for account in credentials]
+
+
+if __name__ == '__main__':
+    # 初始化日志
+    setup_logging()
+
+    accounts = load_accounts('config/brain_credentials.txt')
+    print("Current time in Eastern is", loc_dt.strftime(fmt))
+
+    # pending_alphas/pending_simulated_fnd6_ratioRank.csv
+    # pending_alphas/pending_simulated_fnd6_selfRatioRank.csv
+    # pending_simulated_fnd6_ratioRank_shuffled
+    # 也可以先 python alpha_queue.py pending_alphas/pending.db pending_alphas/xxx.csv 导入SQLite队列, 再把路径换成 pending_alphas/pending.db
+    # 同时跑多个pending文件: 路径换成 config/campaigns.json(每个campaign的path / weight / priority / quota, 见campaign_scheduler.py),
+    # 按权重公平分配槽位, 运行中改这个文件就能增删campaign
+    alpha_list_file_path = 'pending_alphas/pending_simulated_fnd6_ratioRank_shuffled.csv'
+    # 账号有multi-simulation权限时可以加 multi_size = 10, 一次提交最多10个alpha, 只占一个槽位
+    # 按历史结果(每个数据字段/操作符/模板/settings的平均fitness)排序, 先发最有希望的; 不需要时传 scorer = None
+    # 只对SQLite队列(.db)生效, csv队列仍按文件顺序(整体重排要重写整个pending文件)
+    scorer = HistoricalScorer.from_store(ResultsStore('simulated_alphas/simulated_alphas.db'))
+    # 可选: 每个数据字段先跑3个变体, 最好的|sharpe|不到0.5就把这个字段的其他变体放到队列最后(prune_action = DEMOTE, 队列空了才跑);
+    # prune_action = DROP 会把它们从pending里ack掉、永久丢弃, 确认不要了再用
+    # pruner = SuccessiveHalvingPruner.from_store(ResultsStore('simulated_alphas/simulated_alphas.db'), rungs = ((3, 0.5), (9, 0.8)), prune_action = DEMOTE)
+    pruner = None
+    # 完成的alpha顺手拉PnL存进本地矩阵, 提交前用 python self_correlation.py 查和已提交alpha的相关性; 不需要时传 correlation = None
+    correlation = SelfCorrelation(base_url = BRAIN_API_URL)
+    if len(accounts) > 1:
+        simulator = AlphaSimulatorPool(accounts, alpha_list_file_path = alpha_list_file_path, batch_numer_for_every_queue = 20, max_concurrent = 3, scorer = scorer, pruner = pruner, correlation = correlation)
+    else:
+        username, password = accounts[0][:2]
+        # simulator = AlphaSimulator(max_concurrent = 3, username = username, password = password, alpha_list_file_path = alpha_list_file_path, batch_numer_for_every_queue = 20)
+        simulator = AsyncAlphaSimulator(max_concurrent = 3, username = username, password = password, alpha_list_file_path = alpha_list_file_path, batch_numer_for_every_queue = 20, scorer = scorer, pruner = pruner, correlation = correlation)
+    # 状态接口: curl localhost:9108/status (JSON) 或 /metrics (Prometheus)
+    start_status_server(simulator.metrics, port = int(os.environ.get('SIMULATOR_STATUS_PORT', 9108)))
+    simulator.manage_simulations()
@@ -0,0 +1,193 @@
+'''
+alpha模板: 用带类型的占位符写模板, 代替手写的多层for循环 + f-string
+
+    template = AlphaTemplate('<group_compare_op>(<ts_compare_op>(<field>, <days>), <group>)', field = fnd6)
+    template.size()                      # 组合总数, 不展开
+    expressions = template.expressions() # 生成器, 按块向量化展开、去重
+    alpha_to_csv(template.alphas(decays = [0, 4]), 'pending_alphas/xxx.csv', fingerprint_index)
+
+- 占位符 <类型> 的取值范围(domain):
+    构造时或bind()时按类型名传入: 列表 / range / pandas Series / get_datafields返回的DataFrame(取id列)
+    没传的用DEFAULT_DOMAINS里的(archive/world3.py里那几组操作符、分组、窗口)
+- 同一个占位符出现多次取同一个值: group_rank(<field>/<field>, subindustry)
+  要同类型的不同取值用 <类型#编号>: <field>/<field#2>, 取值范围和<field>一样, 各自独立组合
+- where(constraint): 槽位之间的约束, constraint(df) 对一块组合(每个槽位一列)返回布尔数组, 例如
+    template.where(distinct('field', 'field#2'))
+    template.where(lambda df: ~((df['group_compare_op'] == 'group_neutralize') & (df['group'] == 'market')))
+- sample(n, by = 'field'): 分层随机抽样, 每个<field>取值抽差不多一样多的组合, 不用全部展开
+- 展开按chunk_size块做: 下标用numpy算, 字符串用pandas按列拼接, 约束过滤后块内去重; 槽位取值本身先去重
+- delta_expressions('field', new): 只展开至少有一个<field>/<field#n>取新值的组合(数据集新增字段时用, 见catalog_diff.py)
+  跨块的重复(不同组合拼出同一个字符串)交给alpha_to_csv(fingerprint_index = ...)去掉
+'''
+import re
+
+import numpy as np
+import pandas as pd
+
+from alpha_creator import iter_alpha_settings
+
+SLOT_PATTERN = re.compile(r'<(\w+)(?:#(\w+))?>')
+
+DEFAULT_DOMAINS = {
+    'group_compare_op': ['group_rank', 'group_zscore', 'group_neutralize'],
+    'ts_compare_op': ['ts_rank', 'ts_zscore', 'ts_av_diff'],
+    'days': [60, 200],
+    'group': ['market', 'industry', 'subindustry', 'sector', 'densify(pv13_h_f1_sector)'],
+}
+
+
+def as_domain(values):
+    '''
+    各种形式的取值范围 -> 去重后的字符串数组(保持原顺序)
+    '''
+    if isinstance(values, pd.DataFrame):
+        values = values['id']
+    if isinstance(values, (str, int, float)):
+        values = [values]
+    return pd.unique(pd.Series(list(values), dtype = object).astype(str)).astype(object)
+
+
+def distinct(*slots):
+    '''
+    约束: 这几个槽位的取值两两不同
+    '''
+    def constraint(df):
+        mask = np.ones(len(df), dtype = bool)
+        for i, left in enumerate(slots):
+            for right in slots[i + 1:]:
+                mask &= (df[left] != df[right]).to_numpy()
+        return mask
+    return constraint
+
+
+class AlphaTemplate:
+    def __init__(self, pattern, constraints = None, **domains):
+        self.pattern = pattern
+        self.literals = SLOT_PATTERN.split(pattern)[::3]   # 占位符之间的字面量
+        self.references = ['#'.join(filter(None, m)) for m in SLOT_PATTERN.findall(pattern)]   # 按出现顺序, 可重复
+        self.slots = list(dict.fromkeys(self.references))   # 去重后的槽位
+        self.types = {slot: slot.split('#')[0] for slot in self.slots}
+        self.domains = {}
+        self.constraints = list(constraints or [])
+        self.bind(**domains)
+
+    def bind(self, **domains):
+        '''
+        按类型名(或完整槽位名, 如 field#2)绑定取值范围, 返回self
+        '''
+        for slot, slot_type in self.types.items():
+            if slot in domains:
+                self.domains[slot] = as_domain(domains[slot])
+            elif slot_type in domains:
+                self.domains[slot] = as_domain(domains[slot_type])
+            elif slot not in self.domains and slot_type in DEFAULT_DOMAINS:
+                self.domains[slot] = as_domain(DEFAULT_DOMAINS[slot_type])
+        return self
+
+    def where(self, constraint):
+        self.constraints.append(constraint)
+        return self
+
+    def _check_bound(self):
+        missing = [slot for slot in self.slots if slot not in self.domains]
+        if missing:
+            raise ValueError(f"Template {self.pattern!r} has unbound slots: {missing}")
+
+    def shape(self):
+        self._check_bound()
+        return tuple(len(self.domains[slot]) for slot in self.slots)
+
+    def size(self):
+        '''
+        组合总数(约束过滤前)
+        '''
+        return int(np.prod(self.shape(), dtype = np.int64)) if self.slots else 1
+
+    def _render(self, flat_indices):
+        '''
+        一块扁平下标 -> 满足约束、块内去重后的表达式数组
+        '''
+        if not self.slots:
+            return np.array([self.pattern], dtype = object)
+        positions = np.unravel_index(flat_indices, self.shape())
+        frame = pd.DataFrame({slot: self.domains[slot][position] for slot, position in zip(self.slots, positions)})
+        for constraint in self.constraints:
+            frame = frame[np.asarray(constraint(frame), dtype = bool)]
+        expressions = pd.Series(self.literals[0], index = frame.index, dtype = object)
+        for reference, literal in zip(self.references, self.literals[1:]):
+            expressions = expressions + frame[reference] + literal
+        return pd.unique(expressions)
+
+    def expressions(self, chunk_size = 100000):
+        '''
+        生成器: 按块展开全部组合
+        '''
+        total = self.size()
+        for start in range(0, total, chunk_size):
+            yield from self._render(np.arange(start, min(start + chunk_size, total), dtype = np.int64))
+
+    def sample(self, n, by = None, seed = 0):
+        '''
+        随机抽n个表达式; by为槽位名时分层: 每个取值抽 n / 取值个数 个(余数随机分给一部分取值)
+        约束过滤掉的按比例多抽补上; 满足约束的组合不够时返回的会少于n
+        '''
+        rng = np.random.default_rng(seed)
+        total = self.size()
+        if by is None:
+            strata = [(rng.choice(total, min(total, n * 2), replace = False), n)]
+        else:
+            shape = self.shape()
+            axis = self.slots.index(by)
+            values = shape[axis]
+            quotas = np.full(values, n // values)
+            quotas[rng.choice(values, n % values, replace = False)] += 1
+            other_shape = shape[:axis] + shape[axis + 1:]
+            other_total = int(np.prod(other_shape, dtype = np.int64))
+            strata = []
+            for value, quota in enumerate(quotas):
+                if quota:
+                    picked = rng.choice(other_total, min(other_total, int(quota) * 2), replace = False)
+                    other = np.unravel_index(picked, other_shape) if other_shape else ()
+                    full = other[:axis] + (np.full(len(picked), value),) + other[axis:]
+                    strata.append((np.ravel_multi_index(full, shape), quota))
+        sampled = []
+        for indices, quota in strata:
+            sampled.extend(self._render(indices)[:quota])
+        return sampled
+
+    def _rebound(self, domains):
+        return AlphaTemplate(self.pattern, self.constraints, **dict(self.domains, **domains))
+
+    def delta_expressions(self, slot_type, new_values, chunk_size = 100000):
+        '''
+        生成器: 只展开slot_type类型的槽位里至少有一个取new_values的组合, 组合数和新值个数成正比
+        按"第一个取新值的槽位"分成互不重叠的几份: 第i份里它前面的同类型槽位只取旧值, 它自己取新值, 后面的取全部
+        new_values不在当前取值范围里的会被忽略
+        '''
+        self._check_bound()
+        new_values = as_domain(new_values)
+        is_new = {slot: pd.Series(self.domains[slot]).isin(new_values).to_numpy() for slot in self.slots if self.types[slot] == slot_type}
+        typed = list(is_new)
+        for i, slot in enumerate(typed):
+            if not is_new[slot].any():
+                continue
+            overrides = {slot: self.domains[slot][is_new[slot]]}
+            for previous in typed[:i]:
+                overrides[previous] = self.domains[previous][~is_new[previous]]
+            yield from self._rebound(overrides).expressions(chunk_size)
+
+    def alphas(self, expressions = None, **settings_grid):
+        '''
+        展开成pending的payload生成器, 直接传给alpha_to_csv / SqliteAlphaQueue.enqueue
+        settings_grid: universes / decays / neutralizations / truncations, 同alpha_creator.iter_alpha_settings
+        '''
+        return iter_alpha_settings(self.expressions() if expressions is None else expressions, **settings_grid)
+
+
+if __name__ == '__main__':
+    # python alpha_template.py '<group_compare_op>(<ts_compare_op>(<field>, <days>), <group>)' assets sales cash
+    import sys
+    template = AlphaTemplate(sys.argv[1], field = sys.argv[2:] or ['close'])
+    print(f"{template.size()} combinations")
+    for expression in template.sample(10):
+        print(expression)
@@ -0,0 +1,190 @@
+'''
+离线跑分: 用mock_brain_server.py代替真实的BRAIN API, 比较调度改动前后的效率
+
+- 在临时目录里生成n个待回测alpha(pending csv), 起一个mock server, 用指定的引擎跑完全部alpha
+- 报告: 每小时完成的alpha数、每个完成的alpha平均查询了几次进度、槽位空闲时间(秒)和利用率
+  events_completed: simulation_analytics按事件流统计的完成数, 应该和server统计的completed一致(multi-simulation也是)
+- 引擎: sync(AlphaSimulator) / async(AsyncAlphaSimulator) / pool(AlphaSimulatorPool, --accounts个账号)
+
+用法:
+    python benchmark.py --engine async -n 60 --duration 5 15 --retry-after 2.5
+    python benchmark.py --engine sync -n 30 --json
+    python benchmark.py --engine async -n 60 --multi-size 5
+'''
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+import simulation_analytics
+from mock_brain_server import MockBrainConfig, MockBrainServer
+
+BENCHMARK_FIELDS = ['regular', 'type', 'settings']
+
+
+def write_pending_alphas(path, n, seed = 0):
+    '''
+    生成n个互不相同的alpha, 格式与pending_alphas/*.csv一致
+    '''
+    rng = random.Random(seed)
+    with open(path, 'w', newline = '') as file:
+        writer = csv.DictWriter(file, fieldnames = BENCHMARK_FIELDS)
+        writer.writeheader()
+        for i in range(n):
+            settings = {'instrumentType': 'EQUITY', 'region': 'USA', 'universe': 'TOP3000', 'delay': 1,
+                        'decay': rng.choice([0, 4, 8]), 'neutralization': 'SUBINDUSTRY', 'truncation': 0.08,
+                        'pasteurization': 'ON', 'unitHandling': 'VERIFY', 'nanHandling': 'OFF',
+                        'language': 'FASTEXPR', 'visualization': False}
+            writer.writerow({'regular': f"rank(ts_mean(close, {i + 1}) / ts_mean(volume, {rng.randint(2, 60)}))",
+                             'type': 'REGULAR', 'settings': repr(settings)})
+
+
+def pending_left(path):
+    with open(path, 'r') as file:
+        return sum(1 for _ in csv.DictReader(file))
+
+
+def _finished(simulators, pending_path):
+    journal = simulators[0].journal
+    if journal.tasks or any(getattr(s, 'submitting', 0) for s in simulators):
+        return False
+    return all(not s.active_simulations for s in simulators) and pending_left(pending_path) == 0
+
+
+def run_sync(simulator, pending_path, max_seconds):
+    '''
+    手动单步AlphaSimulator.manage_simulations的循环体, 跑完就停
+    '''
+    deadline = time.time() + max_seconds
+    while time.time() < deadline:
+        simulator.check_simulation_status()
+        simulator.load_new_alpha_and_simulate()
+        if _finished([simulator], pending_path):
+            return True
+        time.sleep(simulator._idle_seconds())
+    return False
+
+
+async def run_async(simulators, pending_path, max_seconds):
+    tasks = [asyncio.create_task(simulator.run()) for simulator in simulators]
+    deadline = time.time() + max_seconds
+    finished = False
+    try:
+        while time.time() < deadline:
+            await asyncio.sleep(0.2)
+            if any(task.done() for task in tasks):
+                break
+            if _finished(simulators, pending_path):
+                finished = True
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+    return finished
+
+
+def run_benchmark(engine = 'async', n = 60, accounts = 2, max_concurrent = 3, poll_interval = 2, max_seconds = 1800, config = None, workdir = None,
+                  multi_size = 1):
+    from alpha_simulator import AlphaSimulator, AsyncAlphaSimulator, AlphaSimulatorPool
+    os.environ['NO_PROXY'] = ','.join(filter(None, [os.environ.get('NO_PROXY'), '127.0.0.1', 'localhost']))
+
+    config = config or MockBrainConfig(concurrent_limit = max_concurrent)
+    server = MockBrainServer(config).start()
+    cwd = os.getcwd()
+    workdir = workdir or tempfile.mkdtemp(prefix = 'brain_benchmark_')
+    os.makedirs(workdir, exist_ok = True)
+    # simulator里的路径都是相对路径, 在临时目录里跑, 不碰真实的progress/simulated文件
+    os.chdir(workdir)
+    try:
+        for folder in ('pending_alphas', 'progress_alphas', 'simulated_alphas'):
+            os.makedirs(folder, exist_ok = True)
+        pending_path = 'pending_alphas/benchmark.csv'
+        write_pending_alphas(pending_path, n)
+
+        started = time.time()
+        if engine == 'pool':
+            pool = AlphaSimulatorPool([(f"bench{i}", 'password') for i in range(accounts)], pending_path, 20,
+                                      max_concurrent = max_concurrent, poll_interval = poll_interval, base_url = server.base_url,
+                                      multi_size = multi_size)
+            simulators = pool.simulators
+        else:
+            simulator_class = AsyncAlphaSimulator if engine == 'async' else AlphaSimulator
+            kwargs = {'poll_interval': poll_interval} if engine == 'async' else {}
+            simulators = [simulator_class(max_concurrent, 'bench0', 'password', pending_path, 20, base_url = server.base_url,
+                                          multi_size = multi_size, **kwargs)]
+        if engine == 'sync':
+            finished = run_sync(simulators[0], pending_path, max_seconds)
+        else:
+            finished = asyncio.run(run_async(simulators, pending_path, max_seconds))
+        elapsed = time.time() - started
+        simulators[0].journal.sync()
+
+        # 槽位按平台的真实上限算; simulator自己的上限是AIMD调出来的
+        slots = (config.concurrent_limit or max_concurrent) * len(simulators)
+        stats = server.stats(slots = slots, since = started)
+        completed = stats.get('completed', 0)
+        events_completed = simulation_analytics.summary(simulation_analytics.load_events())['completed']
+        if events_completed != completed:
+            logging.warning(f"Event analytics counted {events_completed} completions, mock server counted {completed}")
+        return {
+            'engine': engine,
+            'alphas': n,
+            'finished': finished,
+            'elapsed_seconds': round(elapsed, 2),
+            'completed': completed,
+            'events_completed': events_completed,
+            'completed_per_hour': round(completed * 3600 / elapsed, 1) if elapsed else None,
+            'polls': stats.get('polls', 0),
+            'polls_per_completion': round(stats['polls_per_completion'], 2) if stats['polls_per_completion'] else None,
+            'idle_slot_seconds': round(stats['idle_slot_seconds'], 2),
+            'slot_utilization': round(stats['slot_utilization'], 3) if stats['slot_utilization'] else None,
+            'throttled': stats.get('throttled', 0) + stats.get('concurrency_rejected', 0),
+            'server_errors': stats.get('server_errors', 0),
+            'final_limits': [s.max_concurrent for s in simulators],
+            'workdir': workdir,
+        }
+    finally:
+        os.chdir(cwd)
+        server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Offline throughput benchmark against mock_brain_server')
+    parser.add_argument('--engine', choices = ['sync', 'async', 'pool'], default = 'async')
+    parser.add_argument('-n', type = int, default = 60, help = 'number of alphas to simulate')
+    parser.add_argument('--accounts', type = int, default = 2, help = 'accounts for the pool engine')
+    parser.add_argument('--max-concurrent', type = int, default = 3, help = 'initial limit of the simulator')
+    parser.add_argument('--platform-limit', type = int, default = None, help = 'concurrent limit enforced by the mock server (default: --max-concurrent)')
+    parser.add_argument('--poll-interval', type = float, default = 2)
+    parser.add_argument('--multi-size', type = int, default = 1, help = 'alphas per multi-simulation (1 = off)')
+    parser.add_argument('--duration', type = float, nargs = 2, default = [5, 15], metavar = ('MIN', 'MAX'), help = 'simulation duration, uniform')
+    parser.add_argument('--retry-after', type = float, default = 2.5)
+    parser.add_argument('--latency', type = float, nargs = 2, default = [0.05, 0.2], metavar = ('MIN', 'MAX'), help = 'request latency, uniform')
+    parser.add_argument('--throttle-rate', type = float, default = 0.0)
+    parser.add_argument('--error-rate', type = float, default = 0.0)
+    parser.add_argument('--sim-error-rate', type = float, default = 0.0)
+    parser.add_argument('--session-ttl', type = float, default = None)
+    parser.add_argument('--max-seconds', type = float, default = 1800)
+    parser.add_argument('--json', action = 'store_true', help = 'print the report as JSON')
+    parser.add_argument('-v', '--verbose', action = 'store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.INFO if args.verbose else logging.WARNING, format = '%(asctime)s - %(levelname)s - %(message)s')
+    latency = ('uniform', *args.latency)
+    config = MockBrainConfig(submit_latency = latency, poll_latency = latency, alpha_latency = latency,
+                             sim_duration = ('uniform', *args.duration), retry_after = args.retry_after,
+                             concurrent_limit = args.platform_limit or args.max_concurrent, throttle_rate = args.throttle_rate,
+                             error_rate = args.error_rate, sim_error_rate = args.sim_error_rate, session_ttl = args.session_ttl)
+    report = run_benchmark(args.engine, args.n, accounts = args.accounts, max_concurrent = args.max_concurrent,
+                           poll_interval = args.poll_interval, max_seconds = args.max_seconds, config = config, multi_size = args.multi_size)
+    if args.json:
+        print(json.dumps(report, indent = 2))
+    else:
+        for key, value in report.items():
+            print(f"{key:>22}: {value}")
@@ -0,0 +1,284 @@
+'''
+BRAIN API的HTTP传输层, 取代sign_in / simulate_alpha / check_simulation_porgress里各自手写的重试
+
+- 连接池: requests.Session + HTTPAdapter(pool_maxsize跟并发数走), 可选HTTP/2(装了httpx和h2时)
+- 重试按状态码区分:
+    网络错误 / 超时 / 5xx  指数退避 + 随机抖动(full jitter), 计入熔断器
+    429                    优先按Retry-After等待, 否则指数退避; 不计入熔断器(服务器是好的)
+    401                    session过期: 重新登录一次后重试; 并发请求同时遇到401时只登录一次
+    其他4xx                不重试, 直接抛出
+- 限速: 可选的TokenBucket, 每个请求先拿令牌; 429(并发上限的429除外)时整个桶暂停
+- 熔断器: 连续失败达到阈值后断开, 断开期间所有请求等待, reset_timeout后只放一个探测请求过去,
+  成功才恢复; 不会出现所有线程一起重试、一起重新登录的情况
+- 最终失败抛BrainRequestError(requests.exceptions.RequestException的子类), 调用方原来的except不用改
+- BRAIN_API_URL: 所有模块共用的API地址, 可以用环境变量BRAIN_API_URL指向本地的mock_brain_server.py或测试环境
+'''
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from concurrency_control import CONCURRENT_LIMIT_MARKER
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+BRAIN_API_URL = os.environ.get('BRAIN_API_URL', 'https://api.worldquantbrain.com')
+NETWORK_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+if httpx is not None:
+    NETWORK_ERRORS += (httpx.TransportError,)
+
+
+class BrainRequestError(requests.exceptions.RequestException):
+    def __init__(self, message, status_code = None, response = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = response
+
+
+class CircuitOpenError(BrainRequestError):
+    pass
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts = 5, base_delay = 1.0, max_delay = 60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, retry_after = None):
+        '''
+        attempt从0开始; 服务器给了Retry-After就照它等, 否则 uniform(0, min(max_delay, base * 2^attempt))
+        '''
+        if retry_after:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold = 5, reset_timeout = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_until = 0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def wait(self, timeout = None):
+        '''
+        等到允许发请求为止; 断开时等reset_timeout, 半开时只放一个探测请求; 超过timeout返回False
+        '''
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            with self.lock:
+                now = time.time()
+                if self.state == self.CLOSED:
+                    return True
+                if self.state == self.OPEN and now >= self.open_until:
+                    self.state = self.HALF_OPEN
+                    self.probing = False
+                if self.state == self.HALF_OPEN and not self.probing:
+                    self.probing = True
+                    return True
+                pause = self.open_until - now if self.state == self.OPEN else 0.5
+            if deadline is not None and time.time() + min(pause, 1) > deadline:
+                return False
+            time.sleep(max(0.05, min(pause, 1)))
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logging.info("Circuit closed: BRAIN API is responding again.")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.error(f"Circuit open after {self.failures} consecutive failures, pausing requests for {self.reset_timeout}s.")
+                self.state = self.OPEN
+                self.open_until = time.time() + self.reset_timeout
+                self.probing = False
+
+
+class BrainTransport:
+    '''
+    用法和requests.Session一样: transport.get(url) / transport.post(url, json = ...)
+    返回的response状态码一定 < 400, 否则抛BrainRequestError
+    '''
+    def __init__(self, base_url, username, password, pool_size = 10, retry = None, login_retry = None, breaker = None,
+                 timeout = (10, 60), http2 = False, open_wait = 300, rate_limiter = None, on_login = None, on_retry = None, on_throttle = None):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.retry = retry or RetryPolicy()
+        self.login_retry = login_retry or RetryPolicy(max_attempts = 30, base_delay = 1, max_delay = 30)
+        self.breaker = breaker or CircuitBreaker()
+        self.timeout = timeout
+        self.open_wait = open_wait   # 熔断器断开时最多等多久, 超过抛CircuitOpenError
+        self.on_login = on_login   # on_login(relogin): 登录成功的回调, 用来计数和写事件
+        self.on_retry = on_retry   # on_retry(cause): 每次重试的回调
+        self.on_throttle = on_throttle   # on_throttle(concurrent_limit): 收到429的回调, 用来调整并发上限
+        self.rate_limiter = rate_limiter   # TokenBucket, 每个请求(含登录)先拿令牌
+        self.login_lock = threading.Lock()
+        self.login_generation = 0   # 每登录成功一次加一, 用来合并并发的重新登录
+        self.http2 = http2 and httpx is not None
+        if http2 and not self.http2:
+            logging.warning("httpx is not installed, falling back to HTTP/1.1 (pip install 'httpx[http2]').")
+        self.client = self._make_client(pool_size)
+
+    def _make_client(self, pool_size):
+        if self.http2:
+            limits = httpx.Limits(max_connections = pool_size, max_keepalive_connections = pool_size)
+            return httpx.Client(http2 = True, auth = (self.username, self.password), limits = limits,
+                                timeout = httpx.Timeout(self.timeout[1], connect = self.timeout[0]))
+        session = requests.Session()
+        session.auth = (self.username, self.password)
+        adapter = HTTPAdapter(pool_connections = 4, pool_maxsize = pool_size, max_retries = 0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _send(self, method, url, **kwargs):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        if self.http2:
+            return self.client.request(method, url, **kwargs)
+        return self.client.request(method, url, timeout = self.timeout, **kwargs)
+
+    def _login(self):
+        '''
+        调用方持有login_lock
+        '''
+        for attempt in range(self.login_retry.max_attempts):
+            try:
+                response = self._send('POST', f'{self.base_url}/authentication')
+                if response.status_code < 400:
+                    relogin = self.login_generation > 0
+                    self.login_generation += 1
+                    if self.on_login:
+                        self.on_login(relogin)
+                    return True
+                if response.status_code in (401, 403):
+                    logging.error(f"{self.username} login rejected with status {response.status_code}.")
+                    return False
+                retry_after = _retry_after(response)
+            except NETWORK_ERRORS as e:
+                logging.error(f"Connection down, try to login again... ({e})")
+                retry_after = None
+            time.sleep(self.login_retry.delay(attempt, retry_after))
+        logging.error(f"{self.username} failed to login after {self.login_retry.max_attempts} attempts.")
+        return False
+
+    def sign_in(self):
+        with self.login_lock:
+            return self._login()
+
+    def relogin(self, seen_generation):
+        '''
+        请求发出时的登录代数还是当前代数才真正重新登录; 否则别的线程已经登录过了
+        '''
+        with self.login_lock:
+            if self.login_generation != seen_generation:
+                return True
+            return self._login()
+
+    def request(self, method, url, retry = None, **kwargs):
+        retry = retry or self.retry
+        relogged = False
+        last_error = None
+        for attempt in range(retry.max_attempts):
+            if not self.breaker.wait(self.open_wait):
+                raise CircuitOpenError(f"Circuit open, {method} {url} not sent")
+            generation = self.login_generation
+            try:
+                response = self._send(method, url, **kwargs)
+            except NETWORK_ERRORS as e:
+                self.breaker.record_failure()
+                last_error = BrainRequestError(f"{method} {url} failed: {e}")
+                self._backoff(retry, attempt, 'network')
+                continue
+            status = response.status_code
+            if status >= 500:
+                self.breaker.record_failure()
+                last_error = BrainRequestError(f"{method} {url} returned {status}", status, response)
+                self._backoff(retry, attempt, 'server_error', _retry_after(response))
+                continue
+            self.breaker.record_success()
+            if status < 400:
+                return response
+            if status == 401 and not relogged:
+                relogged = True
+                logging.info(f"Session expired for {self.username}, logging in again.")
+                if self.relogin(generation):
+                    continue
+            if status == 429:
+                # 并发上限的429说明槽位满了, 不是请求太快, 不用暂停其他请求
+                concurrent_limit = CONCURRENT_LIMIT_MARKER in _text(response)
+                if self.on_throttle:
+                    self.on_throttle(concurrent_limit)
+                if self.rate_limiter is not None and not concurrent_limit:
+                    self.rate_limiter.pause(retry.delay(attempt, _retry_after(response)))
+                last_error = BrainRequestError(f"{method} {url} throttled (429)", status, response)
+                self._backoff(retry, attempt, 'concurrent_limit' if concurrent_limit else 'throttled', _retry_after(response))
+                continue
+            raise BrainRequestError(f"{method} {url} returned {status}: {_text(response)[:200]}", status, response)
+        raise last_error or BrainRequestError(f"{method} {url} failed after {retry.max_attempts} attempts")
+
+    def _backoff(self, retry, attempt, cause, retry_after = None):
+        if self.on_retry:
+            self.on_retry(cause)
+        if attempt + 1 < retry.max_attempts:
+            time.sleep(retry.delay(attempt, retry_after))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self.client.close()
+
+
+def parse_retry_after(response):
+    '''
+    Retry-After头: 秒数或HTTP日期, 返回秒数(可以是0); 没有这个头或格式不认识时返回None
+    '''
+    value = (response.headers.get('Retry-After') or '').strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after(response):
+    return parse_retry_after(response) or None
+
+
+def _text(response):
+    try:
+        return response.text
+    except Exception:
+        return ''
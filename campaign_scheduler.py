@@ -0,0 +1,312 @@
+'''
+多个campaign同时跑: 每个campaign一个pending文件(csv或.db), 按权重公平分配空出来的槽位
+代替改注释切换alpha_list_file_path再重启
+
+- Campaign: name / path / weight(权重) / priority(优先级) / quota(最多发多少个alpha, 不填为不限)
+- 调度(weighted fair queuing): 每个campaign有一个虚拟时间vtime, 发出一个alpha后 vtime += 1 / weight;
+  每次在还有alpha、没用完quota的campaign里, 先看priority(高的优先), 同一档里选vtime最小的
+  所以同一档里长期来看发出的数量和weight成正比; 空了一阵又有alpha的campaign, vtime从当前的全局虚拟时间算起, 不会攒一大笔额度一下子占满槽位
+- quota按从文件里取出的个数算(重启后journal恢复的alpha不重复计), 快用完时只取剩下额度那么多, 不会有取出来却发不出去的alpha
+- 运行中增删: 改campaigns.json(每reload_interval秒检查一次修改时间), 或调用add_campaign / remove_campaign
+  删掉的campaign不再从文件里取, 已经取到缓冲里的照常发完; 缓冲发完、发出去的也都ack / requeue了才关掉它的队列
+- 接口和CsvAlphaQueue / SqliteAlphaQueue一样(pop / pop_matching / refill / ack / requeue / buffer),
+  open_alpha_queue('config/campaigns.json') 返回的就是它, AlphaSimulator / AlphaSimulatorPool不用改
+- 每个alpha带上CAMPAIGN_KEY(下划线开头, 提交前去掉); pop出去的alpha另外按对象记下来自哪个campaign(leased),
+  ack / requeue先查leased, 查不到(重启前就提交了的)再按CAMPAIGN_KEY找; 各campaign取出的个数和vtime存在state_file
+
+campaigns.json:
+    [
+        {"name": "ratioRank", "path": "pending_alphas/pending_simulated_fnd6_ratioRank.csv", "weight": 2},
+        {"name": "selfRatioRank", "path": "pending_alphas/pending_simulated_fnd6_selfRatioRank.csv", "weight": 1, "quota": 5000},
+        {"name": "urgent", "path": "pending_alphas/urgent.db", "priority": 1}
+    ]
+'''
+import json
+import logging
+import os
+import time
+
+from alpha_queue import open_alpha_queue, _pop_matching
+from task_journal import TASK_ID_KEY
+
+CAMPAIGN_KEY = '_campaign'
+
+
+class Campaign:
+    def __init__(self, name, path, weight = 1.0, priority = 0, quota = None):
+        if weight <= 0:
+            raise ValueError(f"Campaign {name} must have a positive weight, got {weight}")
+        self.name = name
+        self.path = path
+        self.weight = float(weight)
+        self.priority = priority
+        self.quota = quota
+        self.queue = None
+        self.vtime = 0.0
+        self.taken = 0   # 从文件里取出的个数, 算quota用
+        self.dispatched = 0   # 本进程发出的个数
+        self.in_flight = 0   # pop出去、还没ack / requeue的个数
+        self.retired = False   # 已删除: 不再从文件里取, 缓冲发完就移除
+        self.exhausted = False   # 上次取的时候文件里已经没有alpha了
+
+    @classmethod
+    def from_dict(cls, config):
+        return cls(config['name'], config['path'], weight = config.get('weight', 1.0), priority = config.get('priority', 0),
+                   quota = config.get('quota'))
+
+    def remaining(self):
+        '''
+        还能从文件里取多少个
+        '''
+        if self.retired:
+            return 0
+        if self.quota is None:
+            return None
+        return max(0, self.quota - self.taken)
+
+    def summary(self):
+        return {'path': self.path, 'weight': self.weight, 'priority': self.priority, 'quota': self.quota,
+                'taken': self.taken, 'dispatched': self.dispatched, 'in_flight': self.in_flight, 'buffered': len(self.queue.buffer), 'vtime': round(self.vtime, 3),
+                'retired': self.retired, 'exhausted': self.exhausted}
+
+
+class CampaignScheduler:
+    saves_buffer = False   # 各campaign的缓冲由simulator的journal恢复, 见restore()
+
+    def __init__(self, campaigns = (), batch_size = 20, scorer = None, config_path = None, state_file = None, reload_interval = 30):
+        self.batch_size = batch_size
+        self.scorer = scorer
+        self.config_path = config_path
+        self.config_mtime = None
+        self.reload_interval = reload_interval
+        self.last_reload = 0.0
+        self.state_file = state_file
+        state = self._load_state()
+        self.saved = state.get('campaigns', {})
+        self.virtual_time = state.get('virtual_time', 0.0)
+        self.campaigns = {}
+        self.leased = {}   # id(alpha) -> (alpha, campaign), pop出去还没ack / requeue的
+        for campaign in campaigns:
+            self.add_campaign(campaign)
+
+    @classmethod
+    def from_config(cls, config_path, batch_size = 20, scorer = None, state_file = None, **kwargs):
+        scheduler = cls(batch_size = batch_size, scorer = scorer, config_path = config_path,
+                        state_file = state_file or os.path.join('progress_alphas', os.path.splitext(os.path.basename(config_path))[0] + '_state.json'), **kwargs)
+        scheduler.reload(force = True)
+        return scheduler
+
+    def _load_state(self):
+        if self.state_file and os.path.exists(self.state_file):
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def _save_state(self):
+        if not self.state_file:
+            return
+        for name, campaign in self.campaigns.items():
+            self.saved[name] = {'taken': campaign.taken, 'vtime': campaign.vtime}
+        temp_path = self.state_file + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'virtual_time': self.virtual_time, 'campaigns': self.saved}, f)
+        os.replace(temp_path, self.state_file)
+
+    def add_campaign(self, campaign):
+        '''
+        新增campaign, 同名的已存在时只更新weight / priority / quota(path不同按新campaign处理)
+        '''
+        existing = self.campaigns.get(campaign.name)
+        if existing is not None and existing.path == campaign.path:
+            existing.weight, existing.priority, existing.quota = campaign.weight, campaign.priority, campaign.quota
+            existing.retired = False
+            return existing
+        if existing is not None:
+            existing.retired = True
+            logging.warning(f"Campaign {campaign.name} path changed from {existing.path} to {campaign.path}")
+        saved = self.saved.get(campaign.name, {})
+        campaign.taken = saved.get('taken', 0)
+        campaign.vtime = max(saved.get('vtime', 0.0), self.virtual_time)
+        campaign.queue = open_alpha_queue(campaign.path, self.batch_size, scorer = self.scorer)
+        if existing is not None:
+            # 旧的缓冲还没发完, 换个名字留着发完; 缓冲里的alpha跟着改标记, 不然ack / requeue会找到新campaign的队列
+            self.campaigns.pop(existing.name)
+            existing.name = f"{existing.name}@{existing.path}"
+            for alpha in existing.queue.buffer:
+                alpha[CAMPAIGN_KEY] = existing.name
+            self.campaigns[existing.name] = existing
+        self.campaigns[campaign.name] = campaign
+        logging.info(f"Campaign {campaign.name} added: {campaign.summary()}")
+        return campaign
+
+    def remove_campaign(self, name):
+        campaign = self.campaigns.get(name)
+        if campaign is not None and not campaign.retired:
+            campaign.retired = True
+            logging.info(f"Campaign {name} removed, {len(campaign.queue.buffer)} buffered alphas will still be simulated")
+
+    def reload(self, force = False):
+        '''
+        campaigns.json改过了就重新加载: 新增的加入、参数变了的更新、没有了的删除
+        '''
+        if self.config_path is None or (not force and time.time() - self.last_reload < self.reload_interval):
+            return
+        self.last_reload = time.time()
+        try:
+            mtime = os.path.getmtime(self.config_path)
+            if not force and mtime == self.config_mtime:
+                return
+            with open(self.config_path, 'r') as f:
+                configs = json.load(f)
+            campaigns = [Campaign.from_dict(config) for config in configs]
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Failed to load campaigns from {self.config_path}: {e}")
+            return
+        self.config_mtime = mtime
+        for campaign in campaigns:
+            self.add_campaign(campaign)
+        names = {campaign.name for campaign in campaigns}
+        for name in list(self.campaigns):
+            if name not in names:
+                self.remove_campaign(name)
+
+    def _prune(self):
+        for name, campaign in list(self.campaigns.items()):
+            if campaign.retired and not campaign.queue.buffer and not campaign.in_flight:
+                if hasattr(campaign.queue, 'close'):
+                    campaign.queue.close()
+                del self.campaigns[name]
+                logging.info(f"Campaign {name} finished")
+
+    @property
+    def buffer(self):
+        '''
+        各campaign缓冲里的alpha(同一批dict对象), simulator用它写journal
+        '''
+        return [alpha for campaign in self.campaigns.values() for alpha in campaign.queue.buffer]
+
+    @buffer.setter
+    def buffer(self, alphas):
+        raise AttributeError("CampaignScheduler buffers are per campaign, use restore(journal)")
+
+    def __len__(self):
+        return sum(len(campaign.queue.buffer) for campaign in self.campaigns.values())
+
+    def restore(self, journal):
+        '''
+        重启时把journal里已取出、还没提交的alpha放回所属campaign的缓冲
+        SQLite的campaign会自己把leased的行放回表里, 这些journal任务直接作废
+        '''
+        restored = 0
+        fallback = next((campaign for campaign in self.campaigns.values() if not campaign.queue.saves_buffer), None)
+        for alpha in journal.queued_alphas():
+            campaign = self.campaigns.get(alpha.get(CAMPAIGN_KEY))
+            if campaign is not None and campaign.queue.saves_buffer:
+                journal.dropped(alpha[TASK_ID_KEY])
+                continue
+            if campaign is None:
+                # 旧版journal里没有campaign标记, 或者campaign已经删掉: 已经从文件里取出来了, 交给第一个csv campaign发
+                if fallback is None:
+                    logging.warning(f"Dropped queued alpha {alpha[TASK_ID_KEY]}: campaign {alpha.get(CAMPAIGN_KEY)} not found")
+                    journal.dropped(alpha[TASK_ID_KEY])
+                    continue
+                campaign = fallback
+                alpha[CAMPAIGN_KEY] = campaign.name
+            campaign.queue.buffer.append(alpha)
+            restored += 1
+        if restored:
+            logging.info(f"Restored {restored} queued alphas into campaigns")
+
+    def _fill(self, campaign):
+        if campaign.queue.buffer or campaign.retired:
+            return
+        remaining = campaign.remaining()
+        batch_size = self.batch_size if remaining is None else min(self.batch_size, remaining)
+        if batch_size <= 0:
+            return
+        alphas = campaign.queue.read_batch(batch_size)
+        for alpha in alphas:
+            alpha[CAMPAIGN_KEY] = campaign.name
+        campaign.queue.buffer = alphas
+        campaign.taken += len(alphas)
+        campaign.exhausted = not alphas
+        if alphas:
+            self._save_state()
+
+    def refill(self):
+        self.reload()
+        self._prune()
+        for campaign in self.campaigns.values():
+            self._fill(campaign)
+
+    def _order(self):
+        '''
+        有alpha可发的campaign: priority高的在前, 同一档按vtime从小到大
+        '''
+        ready = [campaign for campaign in self.campaigns.values() if campaign.queue.buffer]
+        return sorted(ready, key = lambda campaign: (-campaign.priority, campaign.vtime, campaign.name))
+
+    def _charge(self, campaign):
+        # 从空闲恢复的campaign不能带着很小的vtime回来
+        start = max(campaign.vtime, self.virtual_time)
+        campaign.vtime = start + 1.0 / campaign.weight
+        self.virtual_time = start
+        campaign.dispatched += 1
+
+    def pop_matching(self, predicate):
+        self.refill()
+        for campaign in self._order():
+            alpha = campaign.queue.buffer.pop(0) if predicate is None else _pop_matching(campaign.queue.buffer, predicate)
+            if alpha is not None:
+                self._charge(campaign)
+                campaign.in_flight += 1
+                self.leased[id(alpha)] = (alpha, campaign)
+                return alpha
+        return None
+
+    def pop(self):
+        return self.pop_matching(None)
+
+    def _release(self, alpha):
+        '''
+        alpha来自哪个campaign: pop出去的按对象查(同时结束in_flight计数), 否则按CAMPAIGN_KEY
+        '''
+        leased_alpha, campaign = self.leased.get(id(alpha), (None, None))
+        if leased_alpha is alpha:
+            del self.leased[id(alpha)]
+            campaign.in_flight -= 1
+            return campaign
+        campaign = self.campaigns.get(alpha.get(CAMPAIGN_KEY))
+        if campaign is None:
+            logging.warning(f"Alpha from unknown campaign {alpha.get(CAMPAIGN_KEY)}: {alpha.get('regular')}")
+        return campaign
+
+    def ack(self, alpha):
+        campaign = self._release(alpha)
+        if campaign is not None:
+            campaign.queue.ack(alpha)
+
+    def requeue(self, alpha):
+        campaign = self._release(alpha)
+        if campaign is None:
+            return
+        campaign.queue.buffer.insert(0, alpha)
+        campaign.dispatched = max(0, campaign.dispatched - 1)
+
+    def read_batch(self, batch_size = None):
+        alphas = []
+        for _ in range(batch_size or self.batch_size):
+            alpha = self.pop()
+            if alpha is None:
+                break
+            alphas.append(alpha)
+        return alphas
+
+    def summary(self):
+        return {name: campaign.summary() for name, campaign in self.campaigns.items()}
+
+    def close(self):
+        self._save_state()
+        for campaign in self.campaigns.values():
+            if hasattr(campaign.queue, 'close'):
+                campaign.queue.close()
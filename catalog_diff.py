@@ -0,0 +1,169 @@
+'''
+数据字段目录的快照和增量: 数据集新增字段时只给新的字段生成alpha, 追加到现有的pending队列末尾
+(不再重跑alpha_creator.py整个覆写pending csv, 已经在排队的alpha位置不变, 跑过的也不会重新排队)
+
+- 快照: 每个 (scope, dataset, search) 一份 catalog/snapshots/*.pkl, 记录上次生成alpha时的字段目录
+- diff_catalogs(old, new): 按id比较, 得到 added / removed / changed
+    changed只看COMPARE_COLUMNS(type / description / dataset / category), coverage、userCount这些天天变的不算
+- sync_campaign(): 刷新目录 -> 和快照比较 -> 只把新变得可用的字段代入模板展开 -> 追加进pending -> 更新快照
+    可用 = 通过eligible过滤(例如只要MATRIX); 新增的字段, 以及类型变了、现在才通过过滤的字段都算
+    其余变化(描述改了)表达式不变, 不重新排队; 删掉的、不再通过过滤的字段只在日志里报告
+- 没有快照时所有字段都算新增; 已经用alpha_creator.py全量生成过的campaign先用baseline = True只记快照
+- simulator可能正在跑时最好用SQLite队列(.db); 追加到pending csv时先把增量写到临时文件,
+  再拿pending_lock(和CsvAlphaQueue取alpha用的同一把锁)一次追加进去, 不会被simulator的覆写冲掉;
+  其他往pending csv里写的脚本也必须拿这把锁
+
+用法:
+    catalog = DatafieldCatalog(sess)
+    template = AlphaTemplate('group_rank(<field>/<field#2>, subindustry)')
+    sync_campaign(catalog, scope, template, 'pending_alphas/pending_simulated_fnd6.csv', dataset_id = 'fundamental6',
+                  eligible = lambda df: df[df['type'] == 'MATRIX'], fingerprint_index = open_fingerprint_index())
+'''
+import logging
+import os
+import shutil
+
+import pandas as pd
+
+from alpha_creator import alpha_to_csv
+from alpha_queue import pending_lock
+
+SNAPSHOT_DIR = 'catalog/snapshots'
+COMPARE_COLUMNS = ('type', 'description', 'dataset_id', 'category_id')
+
+
+class CatalogDiff:
+    def __init__(self, added, removed, changed, current):
+        self.added = added
+        self.removed = removed
+        self.changed = changed   # 多一列changed_columns: 哪些列变了
+        self.current = current
+
+    def __bool__(self):
+        return bool(len(self.added) or len(self.removed) or len(self.changed))
+
+    def summary(self):
+        return {'added': len(self.added), 'removed': len(self.removed), 'changed': len(self.changed), 'total': len(self.current)}
+
+
+def _comparable(column):
+    # category列的取值集合两边不一样时不能直接比较, 统一转成字符串, 缺失值记成空串
+    return column.astype(object).where(column.notna(), '').astype(str)
+
+
+def diff_catalogs(old, new, columns = COMPARE_COLUMNS):
+    '''
+    old为None(还没有快照)时全部算新增
+    '''
+    if old is None:
+        return CatalogDiff(new, new.iloc[0:0], new.iloc[0:0].assign(changed_columns = ''), new)
+    old_ids, new_ids = set(old['id']), set(new['id'])
+    added = new[~new['id'].isin(old_ids)]
+    removed = old[~old['id'].isin(new_ids)]
+    columns = [column for column in columns if column in old.columns and column in new.columns]
+    before = old[old['id'].isin(new_ids)].set_index('id')
+    after = new[new['id'].isin(old_ids)].set_index('id').reindex(before.index)
+    differs = pd.DataFrame({column: _comparable(before[column]) != _comparable(after[column]) for column in columns}, index = before.index)
+    changed_ids = differs.index[differs.any(axis = 1)] if columns else before.index[0:0]
+    changed = new[new['id'].isin(changed_ids)].copy()
+    changed['changed_columns'] = [','.join(column for column in columns if differs.at[field, column]) for field in changed['id']]
+    return CatalogDiff(added.reset_index(drop = True), removed.reset_index(drop = True), changed.reset_index(drop = True), new)
+
+
+class CatalogSnapshots:
+    def __init__(self, catalog, snapshot_dir = SNAPSHOT_DIR):
+        self.catalog = catalog   # DatafieldCatalog
+        self.snapshot_dir = snapshot_dir
+
+    def path(self, scope, dataset_id = '', search = ''):
+        # 文件名和目录缓存的一样
+        return os.path.join(self.snapshot_dir, os.path.basename(self.catalog.cache_path(scope, dataset_id, search)))
+
+    def load(self, scope, dataset_id = '', search = ''):
+        path = self.path(scope, dataset_id, search)
+        return pd.read_pickle(path) if os.path.exists(path) else None
+
+    def save(self, frame, scope, dataset_id = '', search = ''):
+        path = self.path(scope, dataset_id, search)
+        os.makedirs(self.snapshot_dir, exist_ok = True)
+        temp_path = path + '.tmp'
+        frame.to_pickle(temp_path)
+        os.replace(temp_path, path)
+
+    def diff(self, scope, dataset_id = '', search = '', refresh = True, columns = COMPARE_COLUMNS):
+        '''
+        当前目录(默认忽略缓存重新下载)和快照比较; 不更新快照, 新字段入队成功后再save
+        '''
+        current = self.catalog.fetch(scope, dataset_id = dataset_id, search = search, refresh = refresh)
+        return diff_catalogs(self.load(scope, dataset_id, search), current, columns)
+
+
+def enqueue_alphas(alphas, pending, fingerprint_index = None, validator = None):
+    '''
+    追加进现有的pending队列: .db / .sqlite 用SqliteAlphaQueue.enqueue, 其他按csv追加到文件末尾
+    csv: 展开、过滤、写临时文件都在锁外做, 只有最后的追加持有pending_lock, simulator最多等一次文件拷贝
+    '''
+    if isinstance(pending, str) and not pending.endswith(('.db', '.sqlite', '.sqlite3')):
+        temp_path = pending + '.delta.tmp'
+        written = alpha_to_csv(alphas, temp_path, fingerprint_index, validator = validator)
+        try:
+            with pending_lock(pending), open(temp_path, 'r', newline = '') as delta:
+                if os.path.exists(pending) and os.path.getsize(pending) > 0:
+                    delta.readline()   # 表头已经有了
+                with open(pending, 'a', newline = '') as target:
+                    shutil.copyfileobj(delta, target)
+        finally:
+            os.remove(temp_path)
+        return written
+    from alpha_queue import SqliteAlphaQueue
+    queue = SqliteAlphaQueue(pending) if isinstance(pending, str) else pending
+    try:
+        return queue.enqueue(alphas, source = 'catalog_diff', fingerprint_index = fingerprint_index, validator = validator)
+    finally:
+        if queue is not pending:
+            queue.close()
+
+
+def sync_campaign(catalog, scope, template, pending, dataset_id = '', search = '', slot_type = 'field', eligible = None,
+                  fingerprint_index = None, validator = None, baseline = False, snapshots = None, **settings_grid):
+    '''
+    pending: pending csv路径、.db路径或SqliteAlphaQueue
+    eligible(df) -> df: 哪些字段代入模板(例如只要MATRIX), 不传为全部
+    settings_grid: universes / decays / neutralizations / truncations, 同alpha_creator.iter_alpha_settings
+    返回 {added, removed, changed, total, new_fields, stale_fields, enqueued}
+    '''
+    snapshots = snapshots or CatalogSnapshots(catalog)
+    eligible = eligible or (lambda frame: frame)
+    previous = snapshots.load(scope, dataset_id, search)
+    diff = snapshots.diff(scope, dataset_id, search)
+    current_ids = eligible(diff.current)['id']
+    previous_ids = set(eligible(previous)['id']) if previous is not None else set()
+    new_fields = current_ids[~current_ids.isin(previous_ids)]
+    stale_fields = previous_ids - set(current_ids)
+    summary = dict(diff.summary(), new_fields = len(new_fields), stale_fields = len(stale_fields), enqueued = 0)
+    if stale_fields:
+        logging.warning(f"{len(stale_fields)} datafields are gone or no longer eligible for {template.pattern!r}, "
+                        f"their pending alphas will fail: {sorted(stale_fields)[:10]}")
+    if len(new_fields) and not baseline:
+        template.bind(**{slot_type: current_ids})
+        alphas = template.alphas(template.delta_expressions(slot_type, new_fields), **settings_grid)
+        summary['enqueued'] = enqueue_alphas(alphas, pending, fingerprint_index, validator)
+    snapshots.save(diff.current, scope, dataset_id, search)
+    logging.info(f"Catalog sync {dataset_id or search or 'all'} -> {pending}: {summary}")
+    return summary
+
+
+if __name__ == '__main__':
+    # python catalog_diff.py 'group_rank(<field>/<field#2>, subindustry)' fundamental6 pending_alphas/pending_simulated_fnd6.csv [--baseline]
+    import sys
+    from alpha_creator import sign_in
+    from alpha_fingerprint import open_fingerprint_index
+    from alpha_template import AlphaTemplate
+    from datafield_catalog import DatafieldCatalog
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s - %(levelname)s - %(message)s')
+    args = [arg for arg in sys.argv[1:] if arg != '--baseline']
+    searchScope = {'region': 'USA', 'delay': '1', 'universe': 'TOP3000', 'instrumentType': 'EQUITY'}
+    summary = sync_campaign(DatafieldCatalog(sign_in()), searchScope, AlphaTemplate(args[0]), args[2], dataset_id = args[1],
+                            eligible = lambda df: df[df['type'] == 'MATRIX'], fingerprint_index = open_fingerprint_index(),
+                            baseline = '--baseline' in sys.argv)
+    print(summary)
@@ -0,0 +1,143 @@
+'''
+并发数和请求速率的自适应控制
+
+AimdController: 在跑的simulation数上限(代替写死的max_concurrent)
+- 加性增: 槽位用满、提交成功、完成耗时平稳时, 每完成一轮(limit个)提交上限 +1, 但不超过记住的平台上限ceiling
+- 乘性减:
+    CONCURRENT_SIMULATION_LIMIT_EXCEEDED  平台的真实上限就是当前在跑数: 记为ceiling(取历次的最小值), 直接降到它;
+                                          这种429每次都处理, 不受cooldown限制
+    其他429                               上限 × decrease
+    完成耗时明显变长(快EWMA > 慢EWMA × latency_tolerance)  上限 × latency_decrease
+  降过一次后cooldown秒内不再降, 一阵429只算一次
+- 重新探测: reprobe_interval秒没再遇到并发上限的429, ceiling +1 (平台上限可能调高了); 又遇到就退回去
+TokenBucket: 每个账号的请求速率; 遇到429时整个桶暂停Retry-After秒, 所有线程一起等
+'''
+import logging
+import threading
+import time
+
+CONCURRENT_LIMIT_MARKER = 'CONCURRENT_SIMULATION_LIMIT'
+
+
+class AimdController:
+    def __init__(self, initial = 3, min_limit = 1, max_limit = 10, increase = 1.0, decrease = 0.5, latency_decrease = 0.9,
+                 latency_tolerance = 1.5, latency_window = 10, cooldown = 10, reprobe_interval = 1800, name = None):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, initial)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_decrease = latency_decrease
+        self.latency_tolerance = latency_tolerance
+        self.latency_window = latency_window   # 至少这么多个完成样本后才用耗时判断
+        self.cooldown = cooldown
+        self.reprobe_interval = reprobe_interval
+        self.name = name
+        self.value = float(initial)
+        self.fast_latency = None   # 最近的完成耗时(EWMA, alpha = 0.3)
+        self.slow_latency = None   # 基线(EWMA, alpha = 0.05)
+        self.samples = 0
+        self.last_decrease = 0
+        self.ceiling = None   # 并发上限的429看到的平台上限, None为还没遇到过
+        self.ceiling_at = 0
+        self.on_change = None   # on_change(old, new, reason): 上限变化的回调
+        self.lock = threading.Lock()
+
+    @property
+    def limit(self):
+        return max(self.min_limit, min(self.max_limit, int(self.value)))
+
+    def _set(self, value, reason):
+        old = self.limit
+        upper = self.max_limit if self.ceiling is None else min(self.max_limit, self.ceiling)
+        self.value = max(float(self.min_limit), min(float(upper), value))
+        if self.limit != old:
+            logging.info(f"Concurrency limit {self.name or ''} {old} -> {self.limit} ({reason})")
+            if self.on_change:
+                self.on_change(old, self.limit, reason)
+
+    def latency_rising(self):
+        return (self.samples >= self.latency_window and self.slow_latency
+                and self.fast_latency > self.slow_latency * self.latency_tolerance)
+
+    def on_submitted(self, in_flight):
+        '''
+        提交成功; 只有槽位用满时才加(没用满说明瓶颈不在上限, 加了也没意义)
+        '''
+        with self.lock:
+            if self.ceiling is not None and time.time() - self.ceiling_at >= self.reprobe_interval:
+                self.ceiling += 1
+                self.ceiling_at = time.time()
+                logging.info(f"Concurrency ceiling {self.name or ''} raised to {self.ceiling} to reprobe the platform limit")
+            if in_flight >= self.limit and not self.latency_rising():
+                self._set(self.value + self.increase / max(1.0, self.value), 'submissions succeeding')
+
+    def on_completed(self, duration):
+        with self.lock:
+            self.samples += 1
+            if self.fast_latency is None:
+                self.fast_latency = self.slow_latency = duration
+                return
+            self.fast_latency += 0.3 * (duration - self.fast_latency)
+            self.slow_latency += 0.05 * (duration - self.slow_latency)
+            if self.latency_rising() and time.time() - self.last_decrease >= self.cooldown:
+                self.last_decrease = time.time()
+                self._set(self.value * self.latency_decrease, f"latency rising {self.fast_latency:.0f}s vs {self.slow_latency:.0f}s")
+
+    def on_throttled(self, in_flight = None, concurrent_limit = False):
+        '''
+        in_flight: 被拒时平台上已经在跑的数量(不含被拒的这一个)
+        '''
+        with self.lock:
+            if concurrent_limit and in_flight:
+                self.ceiling = in_flight if self.ceiling is None else min(self.ceiling, in_flight)
+                self.ceiling_at = time.time()
+                self.last_decrease = time.time()
+                self._set(min(self.value, self.ceiling), 'concurrent simulation limit')
+                return
+            if time.time() - self.last_decrease < self.cooldown:
+                return
+            self.last_decrease = time.time()
+            self._set(self.value * self.decrease, '429')
+
+
+class TokenBucket:
+    def __init__(self, rate = 5.0, capacity = 10):
+        self.rate = rate   # 每秒补充的令牌数
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        '''
+        阻塞直到拿到一个令牌, 返回等待的秒数
+        '''
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    pause = self.paused_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    pause = (1 - self.tokens) / self.rate
+            time.sleep(pause)
+            waited += pause
+
+    def pause(self, seconds):
+        '''
+        429之后整个桶暂停, 令牌清零, 恢复后从空桶开始慢慢补
+        '''
+        with self.lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+            self.tokens = 0.0
+            self.updated = self.paused_until
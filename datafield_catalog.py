@@ -0,0 +1,164 @@
+'''
+数据字段目录: 代替get_datafields每次运行都串行翻页下载 /data-fields
+
+- 先请求第一页拿到count, 其余页用线程池并发拉; search模式也按返回的count翻页(原来写死count = 100会漏)
+- 每个 (instrumentType, region, delay, universe, dataset, search) 一份磁盘缓存, 过期时间ttl秒(默认1天)
+  缓存是pickle的DataFrame: 列类型原样保存, 读出来不用再解析 (装了pyarrow的话可以换成parquet)
+- 返回按列展开、带类型的DataFrame:
+    id / description / type(category: MATRIX / VECTOR / GROUP) / dataset_id / dataset_name / category_id / category_name /
+    region / delay / universe / coverage / user_count / alpha_count / date_created ...
+  原来用到的 df['id'] / df['type'] 不变
+
+用法:
+    catalog = DatafieldCatalog(sess)
+    fnd6 = catalog.fetch({'region': 'USA', 'delay': 1, 'universe': 'TOP3000', 'instrumentType': 'EQUITY'}, dataset_id = 'fundamental6')
+    catalog.fetch(scope, refresh = True)   # 忽略缓存重新下载
+'''
+import hashlib
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import pandas as pd
+
+from brain_transport import BRAIN_API_URL
+
+CACHE_DIR = 'catalog/datafields'
+PAGE_SIZE = 50
+
+# API字段(json_normalize之后的列名) -> 列名
+RENAMED_COLUMNS = {
+    'dataset.id': 'dataset_id',
+    'dataset.name': 'dataset_name',
+    'category.id': 'category_id',
+    'category.name': 'category_name',
+    'subcategory.id': 'subcategory_id',
+    'subcategory.name': 'subcategory_name',
+    'userCount': 'user_count',
+    'alphaCount': 'alpha_count',
+    'dateCreated': 'date_created',
+    'dateModified': 'date_modified',
+}
+STRING_COLUMNS = ['id', 'description', 'dataset_id', 'dataset_name', 'category_id', 'category_name', 'region', 'universe']
+CATEGORY_COLUMNS = ['type', 'region', 'universe', 'dataset_id', 'category_id']
+
+
+def normalize_scope(scope):
+    return {
+        'instrumentType': str(scope.get('instrumentType', 'EQUITY')),
+        'region': str(scope.get('region', 'USA')),
+        'delay': int(scope.get('delay', 1)),
+        'universe': str(scope.get('universe', 'TOP3000')),
+    }
+
+
+def to_frame(records):
+    '''
+    /data-fields 的results -> 带类型的DataFrame
+    '''
+    if not records:
+        return pd.DataFrame({column: pd.Series(dtype = 'string') for column in ['id', 'description', 'type', 'dataset_id']})
+    frame = pd.json_normalize(records).rename(columns = RENAMED_COLUMNS)
+    frame = frame.drop_duplicates('id').reset_index(drop = True)
+    for column in STRING_COLUMNS:
+        if column in frame.columns:
+            frame[column] = frame[column].astype('string')
+    for column in ('delay', 'user_count', 'alpha_count'):
+        if column in frame.columns:
+            frame[column] = pd.to_numeric(frame[column], errors = 'coerce').astype('Int64')
+    if 'coverage' in frame.columns:
+        frame['coverage'] = pd.to_numeric(frame['coverage'], errors = 'coerce').astype('float64')
+    for column in ('date_created', 'date_modified'):
+        if column in frame.columns:
+            frame[column] = pd.to_datetime(frame[column], errors = 'coerce', utc = True)
+    for column in CATEGORY_COLUMNS:
+        if column in frame.columns:
+            frame[column] = frame[column].astype('category')
+    return frame
+
+
+class DatafieldCatalog:
+    def __init__(self, session, base_url = BRAIN_API_URL, cache_dir = CACHE_DIR, ttl = 86400, workers = 8, page_size = PAGE_SIZE):
+        self.session = session   # requests.Session 或 BrainTransport
+        self.base_url = base_url.rstrip('/')
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.workers = workers
+        self.page_size = page_size
+
+    def cache_path(self, scope, dataset_id = '', search = ''):
+        scope = normalize_scope(scope)
+        name = f"{scope['instrumentType']}_{scope['region']}_{scope['delay']}_{scope['universe']}_{dataset_id or 'all'}"
+        if search:
+            # search可能有空格、特殊字符, 文件名里放可读的一段 + 短哈希
+            name += f"_search_{re.sub(r'[^A-Za-z0-9]+', '-', search)[:30]}_{hashlib.sha1(search.encode('utf-8')).hexdigest()[:8]}"
+        return os.path.join(self.cache_dir, name + '.pkl')
+
+    def _url(self, scope, dataset_id, search, offset):
+        scope = normalize_scope(scope)
+        params = dict(scope, limit = self.page_size, offset = offset)
+        if dataset_id:
+            params['dataset.id'] = dataset_id
+        if search:
+            params['search'] = search
+        return f"{self.base_url}/data-fields?{urlencode(params)}"
+
+    def _get_page(self, url, attempts = 5):
+        '''
+        requests.Session没有重试, 这里对429/5xx按Retry-After或指数退避重试; BrainTransport自己会重试
+        '''
+        for attempt in range(attempts):
+            response = self.session.get(url)
+            if response.status_code == 429 or response.status_code >= 500:
+                retry_after = response.headers.get('Retry-After')
+                time.sleep(float(retry_after) if retry_after else min(30, 2 ** attempt))
+                continue
+            response.raise_for_status()
+            return response.json()
+        response.raise_for_status()
+        raise RuntimeError(f"Failed to fetch {url} after {attempts} attempts")
+
+    def download(self, scope, dataset_id = '', search = ''):
+        '''
+        不看缓存, 下载全部分页
+        '''
+        started = time.time()
+        first = self._get_page(self._url(scope, dataset_id, search, 0))
+        count = first.get('count', len(first.get('results', [])))
+        offsets = range(self.page_size, count, self.page_size)
+        records = list(first.get('results', []))
+        with ThreadPoolExecutor(max_workers = max(1, self.workers)) as executor:
+            for page in executor.map(self._get_page, (self._url(scope, dataset_id, search, offset) for offset in offsets)):
+                records.extend(page.get('results', []))
+        if len(records) < count:
+            logging.warning(f"Datafield catalog returned {len(records)} of {count} fields for {normalize_scope(scope)} {dataset_id or search}")
+        logging.info(f"Downloaded {len(records)} datafields in {len(offsets) + 1} pages ({time.time() - started:.1f}s)")
+        return to_frame(records)
+
+    def fetch(self, scope, dataset_id = '', search = '', refresh = False):
+        '''
+        缓存没过期直接读缓存, 否则下载并写缓存
+        '''
+        path = self.cache_path(scope, dataset_id, search)
+        if not refresh and os.path.exists(path) and time.time() - os.path.getmtime(path) < self.ttl:
+            return pd.read_pickle(path)
+        frame = self.download(scope, dataset_id, search)
+        os.makedirs(self.cache_dir, exist_ok = True)
+        temp_path = path + '.tmp'
+        frame.to_pickle(temp_path)
+        os.replace(temp_path, path)
+        return frame
+
+    def fetch_many(self, scopes, dataset_id = '', search = '', refresh = False):
+        '''
+        多个scope一起拉, 返回 {(region, delay, universe): DataFrame}, 可以直接传给ExpressionValidator(datafields = ...)
+        '''
+        catalogs = {}
+        for scope in scopes:
+            normalized = normalize_scope(scope)
+            key = (normalized['region'].upper(), normalized['delay'], normalized['universe'].upper())
+            catalogs[key] = self.fetch(scope, dataset_id, search, refresh)
+        return catalogs
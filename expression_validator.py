@@ -0,0 +1,411 @@
+'''
+表达式本地校验: 入队前就把明显不对的表达式挑出来, 不用等回测失败(fail_simulations.csv / fail_alphas.csv)才发现
+
+检查:
+- 语法: 括号、逗号、运算符; 支持 a = expr; ... 多语句、? : 三元、关键字参数 (rate = 2)
+- 操作符: 不在操作符目录里的(拼错的, 给出最接近的名字)、参数个数不对、关键字参数不存在
+- 数据字段: 不在当前 region/delay/universe 的字段目录里的
+- 类型: VECTOR字段没有直接用vec_*聚合; group_*的group参数传了MATRIX/VECTOR字段
+
+目录:
+- OperatorCatalog: /operators 的返回缓存在 catalog/operators.json(默认7天过期); 没有缓存又没有session时用内置的常用操作符
+- 数据字段: get_datafields返回的DataFrame(至少有id和type列), 或 {(region, delay, universe): DataFrame}
+  不传时不检查字段; 传了就要传整个scope的字段, 只传一个dataset的话其他dataset的字段会被当成不存在
+
+用法:
+    validator = ExpressionValidator(OperatorCatalog.load(session = sess), datafields = fields_df)
+    validator.validate('ts_rank(close, 20)')       # -> [] 或 ['unknown operator ts_rnak (did you mean ts_rank?)']
+    alpha_to_csv(alpha_list, filename, fingerprint_index, validator = validator)   # 不合法的写进 progress_alphas/invalid_alphas.csv
+'''
+import ast
+import csv
+import difflib
+import json
+import logging
+import os
+import re
+import time
+
+from brain_transport import BRAIN_API_URL
+
+OPERATOR_CACHE = 'catalog/operators.json'
+INVALID_ALPHAS = 'progress_alphas/invalid_alphas.csv'
+GROUP_NAMES = {'market', 'sector', 'industry', 'subindustry', 'exchange', 'country'}
+CONSTANTS = {'true', 'false', 'nan', 'inf'}
+
+# /operators 没有缓存时用的常用操作符定义, 格式同 /operators 返回的definition
+BUILTIN_OPERATORS = [
+    'abs(x)', 'add(x, y, ..., filter = false)', 'densify(x)', 'divide(x, y)', 'exp(x)', 'inverse(x)', 'log(x)',
+    'max(x, y, ...)', 'min(x, y, ...)', 'multiply(x, y, ..., filter = false)', 'power(x, y)', 'reverse(x)', 'sign(x)',
+    'signed_power(x, y)', 'sqrt(x)', 'subtract(x, y, filter = false)', 's_log_1p(x)', 'log_diff(x)',
+    'and(x, y)', 'or(x, y)', 'not(x)', 'if_else(x, y, z)', 'is_nan(x)',
+    'ts_rank(x, d, constant = 0)', 'ts_zscore(x, d)', 'ts_av_diff(x, d)', 'ts_mean(x, d)', 'ts_std_dev(x, d)', 'ts_sum(x, d)',
+    'ts_delta(x, d)', 'ts_delay(x, d)', 'ts_corr(x, y, d)', 'ts_covariance(y, x, d)', 'ts_decay_linear(x, d, dense = false)',
+    'ts_arg_max(x, d)', 'ts_arg_min(x, d)', 'ts_backfill(x, lookback = d, k = 1, ignore = "NAN")', 'ts_scale(x, d, constant = 0)',
+    'ts_quantile(x, d, driver = "gaussian")', 'ts_product(x, d)', 'ts_count_nans(x, d)', 'ts_regression(y, x, d, lag = 0, rettype = 0)',
+    'ts_step(d)', 'ts_min(x, d)', 'ts_max(x, d)', 'days_from_last_change(x)', 'hump(x, hump = 0.01)', 'kth_element(x, d, k = 1)',
+    'last_diff_value(x, d)', 'ts_decay_exp_window(x, d, factor = 1.0)',
+    'rank(x, rate = 2)', 'zscore(x)', 'scale(x, scale = 1, longscale = 1, shortscale = 1)', 'normalize(x, useStd = false, limit = 0.0)',
+    'quantile(x, driver = "gaussian", sigma = 1.0)', 'winsorize(x, std = 4)',
+    'vec_avg(x)', 'vec_sum(x)', 'vec_max(x)', 'vec_min(x)', 'vec_count(x)', 'vec_stddev(x)',
+    'group_rank(x, group)', 'group_zscore(x, group)', 'group_neutralize(x, group)', 'group_mean(x, weight, group)',
+    'group_scale(x, group)', 'group_backfill(x, group, d, std = 4.0)', 'bucket(x, range = "0, 1, 0.1", buckets = "")',
+    'trade_when(x, y, z)',
+]
+
+TOKEN_PATTERN = re.compile(r'''
+    (?P<number>\d+\.\d*|\.\d+|\d+)
+  | (?P<name>[A-Za-z_][A-Za-z0-9_.]*)
+  | (?P<string>"[^"]*"|'[^']*')
+  | (?P<op>&&|\|\||==|!=|<=|>=|[-+*/^<>?:(),;=!])
+  | (?P<space>\s+)
+''', re.VERBOSE)
+
+BINARY_PRECEDENCE = [('||',), ('&&',), ('==', '!='), ('<', '>', '<=', '>='), ('+', '-'), ('*', '/'), ('^',)]
+
+
+class ExpressionSyntaxError(ValueError):
+    pass
+
+
+class OperatorSignature:
+    def __init__(self, name, required, optional, variadic = False):
+        self.name = name
+        self.required = required   # 必填参数名
+        self.optional = optional   # 有缺省值的参数名
+        self.variadic = variadic
+
+    @classmethod
+    def parse(cls, definition):
+        '''
+        'ts_rank(x, d, constant = 0)' -> OperatorSignature; 'x + y' 这类中缀写法返回None
+        '''
+        match = re.match(r'\s*([A-Za-z_]\w*)\s*\((.*)\)', definition)
+        if not match:
+            return None
+        depth, current, params, quote = 0, '', [], None
+        for char in match.group(2):
+            if quote:
+                quote = None if char == quote else quote
+            elif char in '"\'':
+                quote = char
+            elif char == '(':
+                depth += 1
+            elif char == ')':
+                if depth == 0:
+                    break   # definition后面可能还有 ", x + y" 这样的其他写法
+                depth -= 1
+            elif char == ',' and depth == 0:
+                params.append(current)
+                current = ''
+                continue
+            current += char
+        params.append(current)
+        required, optional, variadic = [], [], False
+        for param in (p.strip() for p in params):
+            if not param:
+                continue
+            if param.strip('.') == '':
+                variadic = True
+            elif '=' in param:
+                optional.append(param.split('=')[0].strip())
+            else:
+                required.append(param)
+        return cls(match.group(1), required, optional, variadic)
+
+    def check(self, positional, keywords):
+        errors = []
+        unknown = [k for k in keywords if k not in self.optional and k not in self.required]
+        if unknown:
+            errors.append(f"{self.name}: unknown keyword argument {', '.join(unknown)}")
+        filled = positional + sum(1 for k in keywords if k in self.required)
+        if filled < len(self.required):
+            errors.append(f"{self.name} expects at least {len(self.required)} arguments, got {filled}")
+        elif not self.variadic and positional > len(self.required) + len(self.optional):
+            errors.append(f"{self.name} expects at most {len(self.required) + len(self.optional)} arguments, got {positional}")
+        return errors
+
+    def parameter(self, index):
+        names = self.required + self.optional
+        return names[index] if index < len(names) else None
+
+
+class OperatorCatalog:
+    def __init__(self, definitions):
+        self.signatures = {}
+        for definition in definitions:
+            signature = OperatorSignature.parse(definition)
+            if signature is not None:
+                self.signatures[signature.name] = signature
+
+    @classmethod
+    def builtin(cls):
+        return cls(BUILTIN_OPERATORS)
+
+    @classmethod
+    def load(cls, session = None, path = OPERATOR_CACHE, ttl = 7 * 86400, base_url = BRAIN_API_URL):
+        '''
+        缓存没过期用缓存; 否则有session就重新拉 /operators; 都没有用内置的
+        '''
+        if os.path.exists(path) and (session is None or time.time() - os.path.getmtime(path) < ttl):
+            with open(path, 'r') as file:
+                return cls.from_records(json.load(file))
+        if session is not None:
+            response = session.get(f"{base_url}/operators")
+            response.raise_for_status()
+            records = response.json()
+            os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+            with open(path, 'w') as file:
+                json.dump(records, file)
+            logging.info(f"Cached {len(records)} operators in {path}")
+            return cls.from_records(records)
+        logging.warning(f"No operator catalog at {path}, using the builtin list of common operators")
+        return cls.builtin()
+
+    @classmethod
+    def from_records(cls, records):
+        # /operators的每条记录: {'name', 'category', 'scope', 'definition', ...}; scope不含REGULAR的不能在表达式里用
+        return cls([r.get('definition') or f"{r['name']}(x, ...)" for r in records
+                    if 'REGULAR' in (r.get('scope') or ['REGULAR'])])
+
+    def __contains__(self, name):
+        return name in self.signatures
+
+    def get(self, name):
+        return self.signatures.get(name)
+
+    def suggest(self, name):
+        matches = difflib.get_close_matches(name, self.signatures, n = 1)
+        return matches[0] if matches else None
+
+
+# 语法树节点: ('num', value) / ('str', value) / ('name', id) / ('call', name, [args], {kw: arg}) / ('op', symbol, [operands])
+def tokenize(expression):
+    expression = re.sub(r'/\*.*?\*/', ' ', expression, flags = re.S)   # 去掉 /* 注释 */
+    tokens, position = [], 0
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match:
+            raise ExpressionSyntaxError(f"unexpected character {expression[position]!r} at {position}")
+        position = match.end()
+        if match.lastgroup != 'space':
+            tokens.append((match.lastgroup, match.group()))
+    return tokens
+
+
+class Parser:
+    def __init__(self, expression):
+        self.tokens = tokenize(expression)
+        self.index = 0
+
+    def peek(self, offset = 0):
+        index = self.index + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, value = None):
+        kind, token = self.peek()
+        if kind is None or (value is not None and token != value):
+            raise ExpressionSyntaxError(f"expected {value or 'more input'}, got {token or 'end of expression'}")
+        self.index += 1
+        return token
+
+    def parse(self):
+        '''
+        返回 [(变量名或None, 语法树)]
+        '''
+        statements = []
+        while self.peek()[0] is not None:
+            target = None
+            if self.peek()[0] == 'name' and self.peek(1)[1] == '=':
+                target = self.take()
+                self.take('=')
+            statements.append((target, self.ternary()))
+            if self.peek()[1] == ';':
+                self.take(';')
+            elif self.peek()[0] is not None:
+                raise ExpressionSyntaxError(f"unexpected {self.peek()[1]!r}")
+        if not statements:
+            raise ExpressionSyntaxError("empty expression")
+        return statements
+
+    def ternary(self):
+        condition = self.binary(0)
+        if self.peek()[1] == '?':
+            self.take('?')
+            if_true = self.ternary()
+            self.take(':')
+            return ('op', '?:', [condition, if_true, self.ternary()])
+        return condition
+
+    def binary(self, level):
+        if level == len(BINARY_PRECEDENCE):
+            return self.unary()
+        left = self.binary(level + 1)
+        while self.peek()[0] == 'op' and self.peek()[1] in BINARY_PRECEDENCE[level]:
+            symbol = self.take()
+            left = ('op', symbol, [left, self.binary(level + 1)])
+        return left
+
+    def unary(self):
+        if self.peek()[1] in ('-', '+', '!'):
+            return ('op', self.take(), [self.unary()])
+        return self.primary()
+
+    def primary(self):
+        kind, token = self.peek()
+        if kind == 'number':
+            self.take()
+            return ('num', float(token))
+        if kind == 'string':
+            self.take()
+            return ('str', token[1:-1])
+        if token == '(':
+            self.take('(')
+            node = self.ternary()
+            self.take(')')
+            return node
+        if kind == 'name':
+            self.take()
+            if self.peek()[1] != '(':
+                return ('name', token)
+            self.take('(')
+            args, keywords = [], {}
+            while self.peek()[1] != ')':
+                if self.peek()[0] == 'name' and self.peek(1)[1] == '=':
+                    keyword = self.take()
+                    self.take('=')
+                    keywords[keyword] = self.ternary()
+                elif keywords:
+                    raise ExpressionSyntaxError(f"positional argument after keyword argument in {token}()")
+                else:
+                    args.append(self.ternary())
+                if self.peek()[1] != ')':
+                    self.take(',')
+            self.take(')')
+            return ('call', token, args, keywords)
+        raise ExpressionSyntaxError(f"unexpected {token or 'end of expression'}")
+
+
+def parse_expression(expression):
+    return Parser(expression).parse()
+
+
+def scope_of(settings):
+    settings = settings or {}
+    return (str(settings.get('region', 'USA')).upper(), int(settings.get('delay', 1)), str(settings.get('universe', 'TOP3000')).upper())
+
+
+class ExpressionValidator:
+    def __init__(self, operators = None, datafields = None):
+        self.operators = operators or OperatorCatalog.builtin()
+        self.field_types = {}   # scope或None -> {字段id: MATRIX / VECTOR / GROUP}
+        if isinstance(datafields, dict):
+            for scope, frame in datafields.items():
+                self.field_types[scope] = self._types(frame)
+        elif datafields is not None:
+            self.field_types[None] = self._types(datafields)
+
+    @staticmethod
+    def _types(frame):
+        if hasattr(frame, 'columns'):
+            types = frame['type'] if 'type' in frame.columns else ['MATRIX'] * len(frame)
+            return dict(zip(frame['id'], types))
+        return dict(frame)
+
+    def _fields_for(self, settings):
+        if not self.field_types:
+            return None
+        if None in self.field_types:
+            return self.field_types[None]
+        return self.field_types.get(scope_of(settings))
+
+    def validate(self, expression, settings = None):
+        '''
+        返回错误原因列表, 空列表表示没发现问题
+        '''
+        try:
+            statements = parse_expression(expression or '')
+        except ExpressionSyntaxError as e:
+            return [f"syntax error: {e}"]
+        fields = self._fields_for(settings)
+        errors, local_names = [], set()
+        for target, tree in statements:
+            self._check(tree, fields, local_names, errors, parent = None)
+            if target:
+                local_names.add(target)
+        return list(dict.fromkeys(errors))
+
+    def _check(self, node, fields, local_names, errors, parent, parameter = None):
+        kind = node[0]
+        if kind == 'name':
+            self._check_name(node[1], fields, local_names, errors, parent, parameter)
+        elif kind == 'op':
+            for operand in node[2]:
+                self._check(operand, fields, local_names, errors, parent = None)
+        elif kind == 'call':
+            _, name, args, keywords = node
+            signature = self.operators.get(name)
+            if signature is None:
+                suggestion = self.operators.suggest(name)
+                errors.append(f"unknown operator {name}" + (f" (did you mean {suggestion}?)" if suggestion else ''))
+            else:
+                errors.extend(signature.check(len(args), keywords))
+            for index, arg in enumerate(args):
+                self._check(arg, fields, local_names, errors, parent = name, parameter = signature.parameter(index) if signature else None)
+            for keyword, arg in keywords.items():
+                if arg[0] != 'name':   # 关键字参数的值常是 true / gaussian 这样的枚举, 不当成字段检查
+                    self._check(arg, fields, local_names, errors, parent = name, parameter = keyword)
+
+    def _check_name(self, name, fields, local_names, errors, parent, parameter):
+        if name in local_names or name.lower() in CONSTANTS or fields is None:
+            return
+        field_type = fields.get(name)
+        if field_type is None:
+            if name.lower() not in GROUP_NAMES:
+                errors.append(f"unknown datafield {name}")
+            return
+        if field_type == 'VECTOR' and not (parent or '').startswith('vec_'):
+            errors.append(f"VECTOR field {name} must be aggregated with a vec_* operator")
+        if parameter == 'group' and field_type in ('MATRIX', 'VECTOR'):
+            errors.append(f"{parent}: group argument {name} is a {field_type} field, expected a GROUP field")
+
+    def check(self, alpha):
+        '''
+        pending的payload -> 错误原因(多条用; 连接), 合法返回None
+        '''
+        settings = alpha.get('settings')
+        if isinstance(settings, str):
+            try:
+                settings = ast.literal_eval(settings)
+            except (ValueError, SyntaxError):
+                return f"invalid settings: {settings}"
+        errors = self.validate(alpha.get('regular'), settings)
+        return '; '.join(errors) if errors else None
+
+    def filter_valid(self, alphas, rejected_file = INVALID_ALPHAS):
+        '''
+        入队时用: 只保留合法的alpha; 不合法的连同原因追加到rejected_file
+        '''
+        rejected = 0
+        file, writer = None, None
+        try:
+            for alpha in alphas:
+                reason = self.check(alpha)
+                if reason is None:
+                    yield alpha
+                    continue
+                rejected += 1
+                if rejected_file:
+                    if writer is None:
+                        os.makedirs(os.path.dirname(rejected_file) or '.', exist_ok = True)
+                        new_file = not os.path.exists(rejected_file)
+                        file = open(rejected_file, 'a', newline = '')
+                        writer = csv.DictWriter(file, fieldnames = ['regular', 'settings', 'reason'])
+                        if new_file:
+                            writer.writeheader()
+                    writer.writerow({'regular': alpha.get('regular'), 'settings': alpha.get('settings'), 'reason': reason})
+        finally:
+            if file is not None:
+                file.close()
+            if rejected:
+                logging.info(f"Rejected {rejected} invalid alphas" + (f", see {rejected_file}" if rejected_file else ''))
@@ -0,0 +1,489 @@
+'''
+本地模拟的BRAIN API, 用来在不消耗真实额度的情况下测试simulator的调度效率
+
+支持的接口:
+- POST /authentication         basic auth登录, 返回cookie; 可配置session过期时间
+- POST /simulations            提交alpha, 返回Location; 可配置并发上限、429、5xx
+                               body是列表(2~10个)时为multi-simulation: 只占一个槽位, 每个alpha一个child
+- GET  /simulations/{id}       进度: 没跑完带Retry-After, 跑完返回alpha id; multi-simulation返回children
+- GET  /alphas/{id}            结果, 格式和真实的/alphas/{id}一致(settings / regular / is.checks)
+- GET  /alphas/{id}/recordsets/pnl  累计PnL; 第一次请求返回空body + Retry-After(还在生成)
+                               用到同一组数据字段的alpha共用一个因子, 彼此高度相关
+- GET  /alphas/{id}/check      跑PENDING的check(SELF_CORRELATION等): 前check_polls次返回空body + Retry-After, 之后返回is.checks
+- GET  /data-fields            数据字段目录, 支持limit / offset / dataset.id / search, 字段由config.datafields生成
+
+延迟、回测时长、Retry-After都用分布描述:
+    2.5                      固定值
+    ('uniform', 1, 3)        均匀分布
+    ('lognormal', mu, sigma) 对数正态
+    ('exponential', mean)    指数分布
+
+用法:
+    server = MockBrainServer(MockBrainConfig(sim_duration = ('uniform', 5, 15)))
+    server.start()                 # 后台线程, server.base_url 传给 AlphaSimulator(base_url = ...)
+    ...
+    print(server.stats())
+    server.stop()
+也可以直接 python mock_brain_server.py 8765 单独跑
+'''
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+def sample(spec, rng):
+    if spec is None:
+        return 0.0
+    if isinstance(spec, (int, float)):
+        return float(spec)
+    kind = spec[0]
+    if kind == 'uniform':
+        return rng.uniform(spec[1], spec[2])
+    if kind == 'lognormal':
+        return rng.lognormvariate(spec[1], spec[2])
+    if kind == 'exponential':
+        return rng.expovariate(1.0 / spec[1])
+    raise ValueError(f"Unknown distribution: {spec}")
+
+
+class MockBrainConfig:
+    def __init__(self,
+                 submit_latency = ('uniform', 0.05, 0.2),   # POST /simulations 的响应延迟
+                 poll_latency = ('uniform', 0.02, 0.1),   # GET /simulations/{id}
+                 alpha_latency = ('uniform', 0.02, 0.1),   # GET /alphas/{id}
+                 sim_duration = ('uniform', 5, 15),   # 一个simulation跑多久
+                 retry_after = 2.5,   # 没跑完时返回的Retry-After
+                 concurrent_limit = 3,   # 每个账号同时在跑的simulation上限, 超过返回429
+                 throttle_rate = 0.0,   # 任意请求随机返回429的概率
+                 error_rate = 0.0,   # 任意请求随机返回500的概率
+                 sim_error_rate = 0.0,   # simulation以ERROR结束的概率
+                 session_ttl = None,   # 登录后多少秒session过期(返回401), None为不过期
+                 multi_duration_factor = 0.15,   # multi-simulation每多一个child, 时长增加的比例
+                 datafields = None,   # {dataset_id: 字段个数}, /data-fields按这个生成字段; 每10个里有1个VECTOR
+                 pnl_days = 1250,   # recordsets/pnl的交易日数
+                 check_polls = 2,   # /alphas/{id}/check 要请求几次才出结果
+                 seed = 42):
+        self.submit_latency = submit_latency
+        self.poll_latency = poll_latency
+        self.alpha_latency = alpha_latency
+        self.sim_duration = sim_duration
+        self.retry_after = retry_after
+        self.concurrent_limit = concurrent_limit
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.sim_error_rate = sim_error_rate
+        self.session_ttl = session_ttl
+        self.multi_duration_factor = multi_duration_factor
+        self.datafields = datafields if datafields is not None else {'fundamental6': 120, 'pv1': 30}
+        self.pnl_days = pnl_days
+        self.check_polls = check_polls
+        self.seed = seed
+
+
+class MockBrainState:
+    '''
+    所有请求线程共享的状态, 用一把锁保护
+    '''
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.sessions = {}   # token -> (account, expire_at)
+        self.simulations = {}   # sim_id -> dict
+        self.alphas = {}   # alpha_id -> dict
+        self.pnl_requested = set()   # 请求过PnL的alpha id, 第一次请求返回Retry-After
+        self.check_requests = {}   # alpha id -> /check请求次数
+        self.counters = {}
+        self.started_at = time.time()
+
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def random(self):
+        with self.lock:
+            return self.rng.random()
+
+    def sample(self, spec):
+        with self.lock:
+            return sample(spec, self.rng)
+
+    def running(self, account, now):
+        return sum(1 for sim in self.simulations.values() if sim['account'] == account and now < sim['end_at'] and not sim['parent'])
+
+
+class MockBrainHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _send(self, status, body = None, headers = None):
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _account(self):
+        '''
+        cookie里的token对应的账号; 没登录或session过期返回None
+        '''
+        match = re.search(r'\bt=([0-9a-f]+)', self.headers.get('Cookie', ''))
+        if not match:
+            return None
+        with self.state.lock:
+            account, expire_at = self.state.sessions.get(match.group(1), (None, 0))
+        if account is None or (expire_at is not None and time.time() > expire_at):
+            return None
+        return account
+
+    def _chaos(self):
+        '''
+        按配置随机返回429 / 500, 返回True表示已经回复
+        '''
+        config = self.state.config
+        if config.throttle_rate and self.state.random() < config.throttle_rate:
+            with self.state.lock:
+                self.state.count('throttled')
+            self._send(429, {'detail': 'Too many requests'}, {'Retry-After': '1'})
+            return True
+        if config.error_rate and self.state.random() < config.error_rate:
+            with self.state.lock:
+                self.state.count('server_errors')
+            self._send(500, {'detail': 'Internal server error'})
+            return True
+        return False
+
+    def _base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{self.headers.get('Host') or f'{host}:{port}'}"
+
+    def do_POST(self):
+        self.path = self.path.split('?')[0]
+        if self.path == '/authentication':
+            return self._authenticate()
+        if self.path == '/simulations':
+            return self._submit()
+        self._send(404, {'detail': 'Not found'})
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        match = re.fullmatch(r'/simulations/([\w-]+)', path)
+        if match:
+            return self._progress(match.group(1))
+        match = re.fullmatch(r'/alphas/([\w-]+)', path)
+        if match:
+            return self._alpha(match.group(1))
+        match = re.fullmatch(r'/alphas/([\w-]+)/recordsets/pnl', path)
+        if match:
+            return self._pnl(match.group(1))
+        match = re.fullmatch(r'/alphas/([\w-]+)/check', path)
+        if match:
+            return self._check(match.group(1))
+        if path == '/data-fields':
+            return self._datafields()
+        self._send(404, {'detail': 'Not found'})
+
+    def _authenticate(self):
+        with self.state.lock:
+            self.state.count('logins')
+        if not self.headers.get('Authorization', '').startswith('Basic '):
+            return self._send(401, {'detail': 'Invalid credentials'})
+        import base64
+        username = base64.b64decode(self.headers['Authorization'][6:]).decode('utf-8').split(':')[0]
+        token = uuid.uuid4().hex
+        ttl = self.state.config.session_ttl
+        with self.state.lock:
+            self.state.sessions[token] = (username, time.time() + ttl if ttl else None)
+        self._send(201, {'user': {'id': username}, 'token': {'expiry': ttl or 14400}}, {'Set-Cookie': f't={token}; Path=/'})
+
+    def _submit(self):
+        config = self.state.config
+        time.sleep(self.state.sample(config.submit_latency))
+        alpha = self._read_body()
+        with self.state.lock:
+            self.state.count('submit_requests')
+        if isinstance(alpha, list) and not 2 <= len(alpha) <= 10:
+            return self._send(400, {'detail': 'A multi-simulation must contain 2 to 10 simulations.'})
+        account = self._account()
+        if account is None:
+            return self._send(401, {'detail': 'Incorrect authentication credentials.'})
+        if self._chaos():
+            return
+        now = time.time()
+        with self.state.lock:
+            if config.concurrent_limit and self.state.running(account, now) >= config.concurrent_limit:
+                self.state.count('concurrency_rejected')
+                return self._send(429, {'detail': 'CONCURRENT_SIMULATION_LIMIT_EXCEEDED'})
+            payloads = alpha if isinstance(alpha, list) else [alpha]
+            duration = sample(config.sim_duration, self.state.rng) * (1 + config.multi_duration_factor * (len(payloads) - 1))
+            sim_id = self._new_simulation(account, alpha, now, duration)
+            if isinstance(alpha, list):
+                children = [self._new_simulation(account, payload, now, duration, parent = sim_id) for payload in payloads]
+                self.state.simulations[sim_id]['children'] = children
+            self.state.count('submitted', len(payloads))
+        self._send(201, None, {'Location': f"{self._base_url()}/simulations/{sim_id}"})
+
+    def _new_simulation(self, account, payload, now, duration, parent = None):
+        '''
+        调用方已持有锁
+        '''
+        sim_id = uuid.uuid4().hex[:20]
+        # multi-simulation的parent本身不出错, 出错的是各个child
+        error = not isinstance(payload, list) and self.state.rng.random() < self.state.config.sim_error_rate
+        self.state.simulations[sim_id] = {
+            'id': sim_id, 'account': account, 'payload': payload, 'submitted_at': now, 'end_at': now + duration,
+            'error': error, 'alpha': None, 'collected_at': None, 'polls': 0, 'parent': parent, 'children': None,
+        }
+        return sim_id
+
+    def _progress(self, sim_id):
+        config = self.state.config
+        time.sleep(self.state.sample(config.poll_latency))
+        with self.state.lock:
+            self.state.count('polls')
+        if self._account() is None:
+            return self._send(401, {'detail': 'Incorrect authentication credentials.'})
+        if self._chaos():
+            return
+        now = time.time()
+        with self.state.lock:
+            sim = self.state.simulations.get(sim_id)
+            if sim is None:
+                return self._send(404, {'detail': 'Not found'})
+            sim['polls'] += 1
+            if now < sim['end_at']:
+                retry_after = max(0.1, sample(config.retry_after, self.state.rng))
+                return self._send(200, {'progress': round((now - sim['submitted_at']) / (sim['end_at'] - sim['submitted_at']), 2)},
+                                  {'Retry-After': f"{retry_after:.2f}"})
+            if sim['collected_at'] is None:
+                sim['collected_at'] = now
+                children = self._children(sim)
+                for child in ([sim] if children is None else children):
+                    self.state.count('sim_errors' if child['error'] else 'completed')
+            if sim['children']:
+                return self._send(200, {'id': sim_id, 'type': 'REGULAR', 'status': 'COMPLETE', 'children': sim['children']})
+            if sim['error']:
+                return self._send(200, {'id': sim_id, 'type': 'REGULAR', 'status': 'ERROR', 'message': 'Mock simulation error'})
+            if sim['alpha'] is None:
+                sim['alpha'] = self._make_alpha(sim)
+            return self._send(200, {'id': sim_id, 'type': 'REGULAR', 'status': 'COMPLETE', 'alpha': sim['alpha']})
+
+    def _children(self, sim):
+        if sim['children']:
+            return [self.state.simulations[child_id] for child_id in sim['children']]
+        if sim['parent'] is None:
+            return None
+        return []   # child自己不单独计数, 在parent被查到完成时一起算
+
+    def _datafields(self):
+        time.sleep(self.state.sample(self.state.config.poll_latency))
+        with self.state.lock:
+            self.state.count('datafield_requests')
+        if self._account() is None:
+            return self._send(401, {'detail': 'Incorrect authentication credentials.'})
+        if self._chaos():
+            return
+        query = dict(parse_qsl(self.path.split('?', 1)[1] if '?' in self.path else ''))
+        fields = []
+        for dataset_id, count in self.state.config.datafields.items():
+            if query.get('dataset.id') and query['dataset.id'] != dataset_id:
+                continue
+            for i in range(count):
+                field_id = f"{dataset_id[:4]}_field_{i}"
+                if query.get('search') and query['search'] not in field_id:
+                    continue
+                fields.append({
+                    'id': field_id, 'description': f"Mock field {i} of {dataset_id}",
+                    'dataset': {'id': dataset_id, 'name': dataset_id}, 'category': {'id': 'mock', 'name': 'Mock'},
+                    'region': query.get('region', 'USA'), 'delay': int(query.get('delay', 1)), 'universe': query.get('universe', 'TOP3000'),
+                    'type': 'VECTOR' if i % 10 == 9 else 'MATRIX', 'coverage': round(0.5 + (i % 50) / 100, 2),
+                    'userCount': i, 'alphaCount': i * 3, 'dateCreated': '2024-01-01T00:00:00-05:00',
+                })
+        offset, limit = int(query.get('offset', 0)), min(50, int(query.get('limit', 50)))
+        self._send(200, {'count': len(fields), 'results': fields[offset:offset + limit]})
+
+    def _make_alpha(self, sim):
+        '''
+        生成一个和/alphas/{id}同样结构的结果, 调用方已持有锁
+        '''
+        rng = self.state.rng
+        payload = sim['payload'] or {}
+        alpha_id = uuid.uuid4().hex[:7]
+        sharpe = round(rng.gauss(0.3, 0.6), 2)
+        fitness = round(abs(sharpe) * rng.uniform(0.2, 0.8), 2)
+        turnover = round(rng.uniform(0.01, 0.5), 4)
+        checks = [
+            {'name': 'LOW_SHARPE', 'result': 'PASS' if sharpe >= 1.25 else 'FAIL', 'limit': 1.25, 'value': sharpe},
+            {'name': 'LOW_FITNESS', 'result': 'PASS' if fitness >= 1.0 else 'FAIL', 'limit': 1.0, 'value': fitness},
+            {'name': 'LOW_TURNOVER', 'result': 'PASS' if turnover >= 0.01 else 'FAIL', 'limit': 0.01, 'value': turnover},
+            {'name': 'HIGH_TURNOVER', 'result': 'PASS' if turnover <= 0.7 else 'FAIL', 'limit': 0.7, 'value': turnover},
+            {'name': 'CONCENTRATED_WEIGHT', 'result': 'PASS'},
+            {'name': 'SELF_CORRELATION', 'result': 'PENDING'},
+        ]
+        settings = dict(payload.get('settings') or {})
+        settings.setdefault('maxTrade', 'OFF')
+        self.state.alphas[alpha_id] = {
+            'id': alpha_id, 'type': 'REGULAR', 'author': sim['account'], 'settings': settings,
+            'regular': {'code': payload.get('regular'), 'description': None, 'operatorCount': 0},
+            'dateCreated': time.strftime('%Y-%m-%dT%H:%M:%S-04:00'), 'grade': 'INFERIOR', 'stage': 'IS', 'status': 'UNSUBMITTED',
+            'is': {'pnl': int(sharpe * 1e6), 'bookSize': 20000000, 'longCount': 1000, 'shortCount': 1000, 'turnover': turnover,
+                   'returns': round(sharpe * 0.03, 4), 'drawdown': round(rng.uniform(0.02, 0.3), 4), 'margin': 0.0003,
+                   'sharpe': sharpe, 'fitness': fitness, 'startDate': '2018-01-20', 'checks': checks},
+        }
+        return alpha_id
+
+    def _alpha(self, alpha_id):
+        time.sleep(self.state.sample(self.state.config.alpha_latency))
+        with self.state.lock:
+            self.state.count('alpha_requests')
+        if self._account() is None:
+            return self._send(401, {'detail': 'Incorrect authentication credentials.'})
+        if self._chaos():
+            return
+        with self.state.lock:
+            alpha = self.state.alphas.get(alpha_id)
+        if alpha is None:
+            return self._send(404, {'detail': 'Not found'})
+        self._send(200, alpha)
+
+    def _check(self, alpha_id):
+        time.sleep(self.state.sample(self.state.config.alpha_latency))
+        with self.state.lock:
+            self.state.count('check_requests')
+        if self._account() is None:
+            return self._send(401, {'detail': 'Incorrect authentication credentials.'})
+        if self._chaos():
+            return
+        with self.state.lock:
+            alpha = self.state.alphas.get(alpha_id)
+            if alpha is None:
+                return self._send(404, {'detail': 'Not found'})
+            polls = self.state.check_requests[alpha_id] = self.state.check_requests.get(alpha_id, 0) + 1
+            if polls <= self.state.config.check_polls:
+                return self._send(200, None, {'Retry-After': '0.5'})
+            checks = []
+            for check in alpha['is']['checks']:
+                if check['result'] == 'PENDING':
+                    value = round(random.Random(f"{alpha_id}/{check['name']}").uniform(0.3, 0.95), 4)
+                    check = {'name': check['name'], 'result': 'PASS' if value < 0.7 else 'FAIL', 'limit': 0.7, 'value': value}
+                checks.append(check)
+            alpha['is']['checks'] = checks
+        self._send(200, {'is': {'checks': checks}})
+
+    def _pnl(self, alpha_id):
+        time.sleep(self.state.sample(self.state.config.alpha_latency))
+        with self.state.lock:
+            self.state.count('pnl_requests')
+        if self._account() is None:
+            return self._send(401, {'detail': 'Incorrect authentication credentials.'})
+        if self._chaos():
+            return
+        with self.state.lock:
+            alpha = self.state.alphas.get(alpha_id)
+            first = alpha is not None and alpha_id not in self.state.pnl_requested
+            self.state.pnl_requested.add(alpha_id)
+        if alpha is None:
+            return self._send(404, {'detail': 'Not found'})
+        if first:
+            return self._send(200, None, {'Retry-After': '0.2'})
+        # 因子按表达式里的标识符(去掉操作符)播种, 噪声按alpha id播种
+        code = (alpha.get('regular') or {}).get('code') or ''
+        fields = ','.join(sorted(set(re.findall(r'\b([a-z]\w*)\b(?!\s*\()', code)) - {'market', 'sector', 'industry', 'subindustry'}))
+        days = self.state.config.pnl_days
+        factor = random.Random(fields)
+        noise = random.Random(alpha_id)
+        dates = [time.strftime('%Y-%m-%d', time.gmtime(1516579200 + 86400 * (i + 2 * (i // 5)))) for i in range(days)]   # 跳过周末
+        total, records = 0.0, []
+        for date in dates:
+            total += 1e4 * (0.8 * factor.gauss(0, 1) + 0.6 * noise.gauss(0, 1) + 0.05)
+            records.append([date, round(total, 2)])
+        self._send(200, {'schema': {'name': 'pnl', 'properties': [{'name': 'date', 'type': 'date'}, {'name': 'pnl', 'type': 'amount'}]},
+                         'records': records})
+
+
+class MockBrainServer:
+    def __init__(self, config = None, host = '127.0.0.1', port = 0):
+        self.config = config or MockBrainConfig()
+        self.httpd = ThreadingHTTPServer((host, port), MockBrainHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = MockBrainState(self.config)
+        self.thread = None
+
+    @property
+    def state(self):
+        return self.httpd.state
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target = self.httpd.serve_forever, daemon = True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self, slots = None, since = None, until = None):
+        '''
+        服务器视角的统计:
+        - completed / polls / polls_per_completion
+        - busy_slot_seconds: 每个simulation从提交到客户端第一次查到它结束(collected)所占的槽位时间
+        - idle_slot_seconds: slots(每个账号的并发数 × 账号数) × 时长 - busy_slot_seconds
+          客户端查询得晚、提交得慢, 都会体现在这里
+        '''
+        until = until or time.time()
+        since = since or self.state.started_at
+        with self.state.lock:
+            counters = dict(self.state.counters)
+            busy = 0.0
+            accounts = set()
+            for sim in self.state.simulations.values():
+                if sim['parent']:
+                    continue
+                accounts.add(sim['account'])
+                start = max(sim['submitted_at'], since)
+                end = min(sim['collected_at'] or until, until)
+                busy += max(0.0, end - start)
+        finished = counters.get('completed', 0) + counters.get('sim_errors', 0)
+        stats = dict(counters)
+        stats['polls_per_completion'] = counters.get('polls', 0) / finished if finished else None
+        stats['busy_slot_seconds'] = busy
+        if slots is None:
+            slots = (self.config.concurrent_limit or 0) * max(1, len(accounts))
+        stats['idle_slot_seconds'] = max(0.0, slots * (until - since) - busy)
+        stats['slot_utilization'] = busy / (slots * (until - since)) if slots and until > since else None
+        return stats
+
+
+if __name__ == '__main__':
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    server = MockBrainServer(port = port).start()
+    print(f"Mock BRAIN API listening on {server.base_url}  (BRAIN_API_URL={server.base_url})")
+    try:
+        while True:
+            time.sleep(10)
+            print(server.stats())
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,103 @@
+'''
+simulation进度查询的调度器
+
+用一个最小堆保存 (到期时间, sim_url), 只有到期的simulation才会被查询:
+- 每次查询后按服务器返回的Retry-After重新排期
+- 每个simulation的超时(默认600秒)也作为一个deadline放在同一个堆里
+- 重新排期/移除时不去堆里删旧条目, 弹出时对不上当前时间的条目直接丢弃(lazy deletion)
+'''
+import heapq
+import itertools
+import time
+
+POLL = 'poll'
+DEADLINE = 'deadline'
+
+
+class PollScheduler:
+    def __init__(self, default_interval = 2, timeout = 600):
+        self.default_interval = default_interval
+        self.timeout = timeout
+        self._heap = []
+        self._seq = itertools.count()   # 同一时间到期时保持先进先出, 也避免比较到sim_url
+        self._poll_due = {}   # sim_url -> 当前有效的查询时间
+        self._deadlines = {}   # sim_url -> 超时时间
+
+    def __len__(self):
+        return len(self._poll_due)
+
+    def __contains__(self, sim_url):
+        return sim_url in self._poll_due
+
+    def _push(self, due, kind, sim_url):
+        heapq.heappush(self._heap, (due, next(self._seq), kind, sim_url))
+
+    def add(self, sim_url, start_time = None, delay = 0):
+        '''
+        新增一个simulation: delay秒后第一次查询, start_time + timeout 时超时
+        '''
+        now = time.time()
+        start_time = start_time or now
+        self._poll_due[sim_url] = now + delay
+        self._deadlines[sim_url] = start_time + self.timeout
+        self._push(now + delay, POLL, sim_url)
+        self._push(start_time + self.timeout, DEADLINE, sim_url)
+
+    def reschedule(self, sim_url, retry_after = None):
+        '''
+        retry_after秒后再查询; 没有Retry-After时用default_interval
+        '''
+        if sim_url not in self._poll_due:
+            return
+        if not retry_after or retry_after <= 0:
+            retry_after = self.default_interval
+        due = time.time() + retry_after
+        self._poll_due[sim_url] = due
+        self._push(due, POLL, sim_url)
+
+    def remove(self, sim_url):
+        self._poll_due.pop(sim_url, None)
+        self._deadlines.pop(sim_url, None)
+
+    def _is_current(self, due, kind, sim_url):
+        if kind == POLL:
+            return self._poll_due.get(sim_url) == due
+        return self._deadlines.get(sim_url) == due
+
+    def _drop_stale(self):
+        while self._heap and not self._is_current(self._heap[0][0], self._heap[0][2], self._heap[0][3]):
+            heapq.heappop(self._heap)
+
+    def next_due(self):
+        '''
+        最早到期的时间戳, 没有任何simulation时返回None
+        '''
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def seconds_until_due(self, cap = None):
+        due = self.next_due()
+        if due is None:
+            return cap
+        wait = max(0, due - time.time())
+        return wait if cap is None else min(wait, cap)
+
+    def pop_due(self, now = None):
+        '''
+        弹出所有已到期的条目, 返回 [(sim_url, kind)], kind为POLL或DEADLINE
+        DEADLINE到期的simulation会同时被移出调度器
+        弹出的POLL条目在调用方reschedule之前不会再次到期
+        '''
+        now = now or time.time()
+        due_items = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            due, _, kind, sim_url = heapq.heappop(self._heap)
+            if kind == DEADLINE:
+                self.remove(sim_url)
+            else:
+                self._poll_due[sim_url] = None
+            due_items.append((sim_url, kind))
+        return due_items
@@ -0,0 +1,236 @@
+'''
+历史回测结果 simulated_alphas/simulated_alphas_*.csv 的快速加载, 代替逐格ast.literal_eval
+
+- 每天一个文件, 用进程池并发解析; 每个文件解析完存一份pickle的DataFrame(sidecar, simulated_alphas/.cache/),
+  文件大小和修改时间没变就直接读sidecar, 只有当天还在写的文件要重新解析
+- 列对齐: 文件没有表头, 每行按当时那次返回的key顺序写, 个别行的列会错位;
+  列数和顺序正常的行按ALPHA_CSV_COLUMNS取, 错位的行按内容认列: settings / regular / is 看开头, grade / stage / status看取值
+- is / settings / regular 是python repr, 不再literal_eval: 每个字段用pandas的向量化正则提取, 再统一转类型
+- 返回一个紧凑的DataFrame:
+    id / code / operator_count / type / author / grade / stage / status / date_created(datetime)
+    settings的每个字段(region, universe, delay, decay, neutralization, truncation ...) 同results_store的列名
+    is里的指标(sharpe, fitness, turnover, returns, drawdown, margin ...) float32
+    每个check三列: check_<name>(PASS / FAIL / PENDING ...), check_<name>_limit, check_<name>_value
+      例如 check_low_sharpe, check_low_sub_universe_sharpe_value, check_self_correlation
+  重复的alpha id保留最后一次
+  低基数的文本列是category, 一万行大约几MB
+
+用法:
+    from results_loader import load_results
+    df = load_results()
+    df[(df['sharpe'] > 1.25) & (df['check_low_sub_universe_sharpe'] == 'PASS')]
+    python results_loader.py            # 加载并打印概况
+'''
+import ast
+import csv
+import glob
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from results_store import ALPHA_CSV_COLUMNS, SETTINGS_COLUMNS, METRIC_COLUMNS
+
+CACHE_DIR = 'simulated_alphas/.cache'
+CACHE_VERSION = 1   # 解析逻辑变了就加一, 旧的sidecar作废
+
+FILE_COLUMNS = ALPHA_CSV_COLUMNS[:-1]   # 每日csv里没有account列
+SETTINGS_POSITION = FILE_COLUMNS.index('settings')
+REGULAR_POSITION = FILE_COLUMNS.index('regular')
+IS_POSITION = FILE_COLUMNS.index('is')
+TEXT_COLUMNS = ['id', 'type', 'author', 'settings', 'regular', 'dateCreated', 'grade', 'stage', 'status', 'is']
+CATEGORY_COLUMNS = ['type', 'author', 'grade', 'stage', 'status'] + [column for column, sql_type, _ in SETTINGS_COLUMNS if sql_type == 'TEXT']
+
+CHECK_NAME_PATTERN = r"'name': '([A-Z0-9_]+)', 'result'"
+# 错位的行按取值认列
+ALPHA_TYPES = {'REGULAR', 'SUPER'}
+GRADES = {'INFERIOR', 'AVERAGE', 'GOOD', 'EXCELLENT', 'SPECTACULAR'}
+STAGES = {'IS', 'OS', 'PROD'}
+STATUSES = {'UNSUBMITTED', 'ACTIVE', 'DECOMMISSIONED'}
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}T')
+
+
+def _realign(row):
+    '''
+    错位的行: 按内容找到settings / regular / is, type / grade / stage / status / dateCreated按取值认
+    '''
+    def find(match):
+        return next((i for i, value in enumerate(row) if i and match(value)), None)
+
+    def value_of(match):
+        i = find(match)
+        return row[i] if i is not None else ''
+    type_position = find(lambda value: value in ALPHA_TYPES)
+    return {
+        'id': row[0],
+        'type': row[type_position] if type_position is not None else '',
+        'author': row[type_position + 1] if type_position is not None and type_position + 1 < len(row) else '',   # author紧跟在type后面
+        'settings': value_of(lambda value: value.startswith("{'instrumentType'")),
+        'regular': value_of(lambda value: value.startswith("{'code'")),
+        'dateCreated': value_of(lambda value: DATE_PATTERN.match(value) is not None),
+        'grade': value_of(lambda value: value in GRADES),
+        'stage': value_of(lambda value: value in STAGES),
+        'status': value_of(lambda value: value in STATUSES),
+        'is': value_of(lambda value: value.startswith("{'pnl'")),
+    }
+
+
+def read_raw(csv_path):
+    '''
+    读一个每日csv, 返回列对齐后的文本DataFrame(TEXT_COLUMNS), 不做解析
+    '''
+    with open(csv_path, 'r', newline = '', encoding = 'utf-8') as file:
+        rows = [row for row in csv.reader(file) if row]
+    aligned, shifted = [], []
+    for row in rows:
+        if len(row) >= len(FILE_COLUMNS) and row[SETTINGS_POSITION].startswith("{'") and row[REGULAR_POSITION].startswith("{'") \
+                and row[IS_POSITION].startswith("{'"):
+            aligned.append(row)
+        else:
+            shifted.append(_realign(row))
+    positions = [FILE_COLUMNS.index(column) for column in TEXT_COLUMNS]
+    frame = pd.DataFrame([[row[i] for i in positions] for row in aligned], columns = TEXT_COLUMNS, dtype = object)
+    if shifted:
+        logging.info(f"Realigned {len(shifted)} shifted rows in {csv_path}")
+        frame = pd.concat([frame, pd.DataFrame(shifted, columns = TEXT_COLUMNS, dtype = object)], ignore_index = True)
+    return frame
+
+
+def extract(text, key):
+    '''
+    从一列python repr里取出key的值(向量化正则): 字符串值去掉引号, 其他(数字 / True / None)原样返回文本
+    '''
+    found = text.str.extract(rf"'{key}': (?:'((?:[^'\\]|\\.)*)'|\"((?:[^\"\\]|\\.)*)\"|([^,}}\]]+))")
+    value = found[0].mask(found[0].isna(), found[1])
+    value = value.mask(value.isna(), found[2])
+    escaped = value.str.contains('\\', regex = False, na = False)
+    if escaped.any():
+        # 带转义的(表达式里有换行之类)很少, 这几个按python字符串字面量还原
+        quote = found[0].notna()
+        value[escaped] = [ast.literal_eval(f"'{v}'" if q else f'"{v}"') for v, q in zip(value[escaped], quote[escaped])]
+    return value.where(value != 'None')
+
+
+def _number(values, dtype = 'float32'):
+    return pd.to_numeric(values, errors = 'coerce').astype(dtype)
+
+
+def _boolean(values):
+    return values.map({'True': True, 'False': False}).astype('boolean')
+
+
+def parse_results(raw):
+    '''
+    read_raw的结果 -> 展开、带类型的DataFrame
+    '''
+    settings, regular, metrics = raw['settings'].fillna(''), raw['regular'].fillna(''), raw['is'].fillna('')
+    frame = pd.DataFrame({
+        'id': raw['id'].astype('string'),
+        'code': extract(regular, 'code').astype('string'),
+        'operator_count': _number(extract(regular, 'operatorCount'), 'Int16'),
+        'type': raw['type'], 'author': raw['author'], 'grade': raw['grade'], 'stage': raw['stage'], 'status': raw['status'],
+        'date_created': pd.to_datetime(raw['dateCreated'], errors = 'coerce', utc = True),
+    })
+    for column, sql_type, key in SETTINGS_COLUMNS:
+        values = extract(settings, key)
+        if sql_type == 'INTEGER':
+            frame[column] = _boolean(values) if key == 'visualization' else _number(values, 'Int16')
+        elif sql_type == 'REAL':
+            frame[column] = _number(values)
+        else:
+            frame[column] = values
+    for column, sql_type, key in METRIC_COLUMNS:
+        frame[column] = _number(extract(metrics, key), 'Int32' if sql_type == 'INTEGER' else 'float32')
+    # 只看is里的checks: 'name': 'XXX', 'result': ... 这个组合别的地方不会出现
+    names = pd.unique(metrics.str.findall(CHECK_NAME_PATTERN).explode().dropna())
+    for name in names:
+        # result后面跟着的标量字段(limit / value / date ...), 顺序和有无因check而异, 遇到嵌套的列表(competitions)为止
+        found = metrics.str.extract(rf"'name': '{name}', 'result': '(\w+)'((?:, '\w+': (?:'[^']*'|[^,{{}}\[\]]+))*)")
+        prefix = f"check_{name.lower()}"
+        frame[prefix] = found[0]
+        for key in ('limit', 'value'):
+            values = _number(extract(found[1].fillna(''), key))
+            if values.notna().any():
+                frame[f"{prefix}_{key}"] = values
+    frame['checks_failed'] = metrics.str.count(r"'result': '(?:FAIL|ERROR)'").astype('Int16')
+    frame['checks_pending'] = metrics.str.count(r"'result': 'PENDING'").astype('Int16')
+    for column in CATEGORY_COLUMNS + [column for column in frame.columns if column.startswith('check_') and frame[column].dtype == object]:
+        frame[column] = frame[column].where(frame[column] != '').astype('category')
+    return frame
+
+
+def sidecar_path(csv_path, cache_dir = CACHE_DIR):
+    return os.path.join(cache_dir, os.path.basename(csv_path) + '.pkl')
+
+
+def _signature(csv_path):
+    stat = os.stat(csv_path)
+    return [CACHE_VERSION, stat.st_size, stat.st_mtime_ns]
+
+
+def load_file(csv_path, cache_dir = CACHE_DIR, refresh = False):
+    '''
+    一个每日csv: sidecar有效就直接读, 否则解析并写sidecar (进程池里跑的就是这个函数)
+    '''
+    path = sidecar_path(csv_path, cache_dir)
+    signature = _signature(csv_path)
+    if not refresh and os.path.exists(path):
+        frame = pd.read_pickle(path)
+        if frame.attrs.get('signature') == signature:
+            return frame
+    frame = parse_results(read_raw(csv_path))
+    frame.attrs['signature'] = signature
+    frame.attrs['source'] = csv_path
+    os.makedirs(cache_dir, exist_ok = True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    frame.to_pickle(temp_path)
+    os.replace(temp_path, path)
+    return frame
+
+
+def _is_fresh(csv_path, cache_dir):
+    path = sidecar_path(csv_path, cache_dir)
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(csv_path)
+
+
+def load_results(pattern = 'simulated_alphas/simulated_alphas_*.csv', cache_dir = CACHE_DIR, refresh = False, workers = None):
+    '''
+    加载全部每日结果; 需要重新解析的文件多于一个时用进程池并发
+    '''
+    started = time.time()
+    paths = sorted(glob.glob(pattern)) if isinstance(pattern, str) else list(pattern)
+    stale = [path for path in paths if refresh or not _is_fresh(path, cache_dir)]
+    frames = {}
+    workers = min(len(stale), workers or os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            for path, frame in zip(stale, executor.map(load_file, stale, [cache_dir] * len(stale), [refresh] * len(stale))):
+                frames[path] = frame
+    for path in paths:
+        if path not in frames:
+            frames[path] = load_file(path, cache_dir, refresh and path in stale)
+    if not frames:
+        return parse_results(pd.DataFrame(columns = TEXT_COLUMNS, dtype = object))
+    frames = [frames[path] for path in paths]
+    for frame in frames:
+        frame.attrs = {}
+    # concat后category列的取值集合不一样会退化成object, 重新转一次
+    result = pd.concat(frames, ignore_index = True)
+    result = result.drop_duplicates('id', keep = 'last').reset_index(drop = True)
+    for column in result.columns:
+        if result[column].dtype == object and any(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames if column in frame):
+            result[column] = result[column].astype('category')
+    logging.info(f"Loaded {len(result)} alphas from {len(paths)} files ({len(stale)} parsed) in {time.time() - started:.2f}s")
+    return result
+
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s - %(levelname)s - %(message)s')
+    args = [arg for arg in sys.argv[1:] if arg != '--refresh']
+    results = load_results(*args[:1], refresh = '--refresh' in sys.argv)
+    results.info(memory_usage = 'deep')
+    print(results[['sharpe', 'fitness', 'turnover', 'check_low_sub_universe_sharpe_value']].describe())
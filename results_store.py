@@ -0,0 +1,289 @@
+'''
+回测结果库: 用一个带索引的SQLite数据库代替每天的 simulated_alphas/simulated_alphas_<date>.csv
+
+- alphas表: 每个alpha一行, settings的每个字段、is里的各项指标都是单独的有类型的列
+- alpha_checks表: 每个check一行 (alpha_id, name, result, limit, value)
+- 常用的筛选列(sharpe / fitness / turnover / code / settings)都建了索引
+- query(): "sharpe > 1.25 且 fitness > 1" 这类筛选直接走SQL, 返回DataFrame
+- migrate_csvs(): 一次性把历史的 simulated_alphas_*.csv 导进来
+'''
+import ast
+import csv
+import glob
+import json
+import logging
+import sqlite3
+
+import pandas as pd
+
+# simulated_alphas_*.csv 没有表头, 列顺序就是 /alphas/{id} 返回的字段顺序
+ALPHA_CSV_COLUMNS = [
+    'id', 'type', 'author', 'settings', 'regular', 'dateCreated', 'dateSubmitted', 'dateModified', 'name',
+    'favorite', 'hidden', 'color', 'category', 'tags', 'classifications', 'grade', 'stage', 'status',
+    'is', 'os', 'train', 'test', 'prod', 'competitions', 'themes', 'pyramids', 'pyramidThemes', 'team',
+    'account',
+]
+
+# (列名, SQL类型, settings里的字段)
+SETTINGS_COLUMNS = [
+    ('instrument_type', 'TEXT', 'instrumentType'),
+    ('region', 'TEXT', 'region'),
+    ('universe', 'TEXT', 'universe'),
+    ('delay', 'INTEGER', 'delay'),
+    ('decay', 'INTEGER', 'decay'),
+    ('neutralization', 'TEXT', 'neutralization'),
+    ('truncation', 'REAL', 'truncation'),
+    ('pasteurization', 'TEXT', 'pasteurization'),
+    ('unit_handling', 'TEXT', 'unitHandling'),
+    ('nan_handling', 'TEXT', 'nanHandling'),
+    ('max_trade', 'TEXT', 'maxTrade'),
+    ('language', 'TEXT', 'language'),
+    ('visualization', 'INTEGER', 'visualization'),
+    ('start_date', 'TEXT', 'startDate'),
+    ('end_date', 'TEXT', 'endDate'),
+]
+
+# (列名, SQL类型, is里的字段)
+METRIC_COLUMNS = [
+    ('pnl', 'REAL', 'pnl'),
+    ('book_size', 'REAL', 'bookSize'),
+    ('long_count', 'INTEGER', 'longCount'),
+    ('short_count', 'INTEGER', 'shortCount'),
+    ('turnover', 'REAL', 'turnover'),
+    ('returns', 'REAL', 'returns'),
+    ('drawdown', 'REAL', 'drawdown'),
+    ('margin', 'REAL', 'margin'),
+    ('sharpe', 'REAL', 'sharpe'),
+    ('fitness', 'REAL', 'fitness'),
+]
+
+BASE_COLUMNS = [
+    ('id', 'TEXT PRIMARY KEY'),
+    ('type', 'TEXT'),
+    ('author', 'TEXT'),
+    ('account', 'TEXT'),
+    ('code', 'TEXT'),
+    ('operator_count', 'INTEGER'),
+    ('date_created', 'TEXT'),
+    ('grade', 'TEXT'),
+    ('stage', 'TEXT'),
+    ('status', 'TEXT'),
+]
+
+SUMMARY_COLUMNS = [
+    ('checks_failed', 'INTEGER'),   # FAIL + ERROR 的个数
+    ('checks_pending', 'INTEGER'),
+    ('raw', 'TEXT'),   # 完整的API返回, JSON
+]
+
+ALL_COLUMNS = BASE_COLUMNS + [(c, t) for c, t, _ in SETTINGS_COLUMNS] + [(c, t) for c, t, _ in METRIC_COLUMNS] + SUMMARY_COLUMNS
+COLUMN_NAMES = [c for c, _ in ALL_COLUMNS]
+
+INDEXES = {
+    'idx_alphas_sharpe': 'sharpe',
+    'idx_alphas_fitness': 'fitness',
+    'idx_alphas_turnover': 'turnover',
+    'idx_alphas_code': 'code',
+    'idx_alphas_settings': 'region, universe, delay, decay, neutralization, truncation',
+    'idx_alphas_date_created': 'date_created',
+}
+
+
+def _literal(value):
+    '''
+    csv里的dict/list是python repr, 从API直接来的已经是对象
+    '''
+    if isinstance(value, str):
+        if not value:
+            return None
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+    return value
+
+
+def flatten_alpha(alpha, account = None):
+    '''
+    /alphas/{id}的返回 -> (alphas表的一行, [(alpha_id, name, result, limit, value)])
+    '''
+    settings = _literal(alpha.get('settings')) or {}
+    regular = _literal(alpha.get('regular')) or {}
+    metrics = _literal(alpha.get('is')) or {}
+    checks = metrics.get('checks') or []
+    if isinstance(regular, str):
+        regular = {'code': regular}
+
+    row = {
+        'id': alpha.get('id'),
+        'type': alpha.get('type'),
+        'author': alpha.get('author'),
+        'account': account or alpha.get('account') or None,
+        'code': regular.get('code'),
+        'operator_count': regular.get('operatorCount'),
+        'date_created': alpha.get('dateCreated'),
+        'grade': alpha.get('grade'),
+        'stage': alpha.get('stage'),
+        'status': alpha.get('status'),
+    }
+    for column, _, key in SETTINGS_COLUMNS:
+        row[column] = settings.get(key)
+    for column, _, key in METRIC_COLUMNS:
+        row[column] = metrics.get(key)
+    row['checks_failed'] = sum(1 for c in checks if c.get('result') in ('FAIL', 'ERROR'))
+    row['checks_pending'] = sum(1 for c in checks if c.get('result') == 'PENDING')
+    raw = {k: _literal(v) if k in ('settings', 'regular', 'is') else v for k, v in alpha.items()}
+    row['raw'] = json.dumps(raw, default = str)
+
+    check_rows = [(row['id'], c.get('name'), c.get('result'), c.get('limit'), c.get('value')) for c in checks]
+    return row, check_rows
+
+
+class ResultsStore:
+    def __init__(self, db_path = 'simulated_alphas/simulated_alphas.db'):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread = False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS alphas ({', '.join(f'{c} {t}' for c, t in ALL_COLUMNS)})")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS alpha_checks ("
+            " alpha_id TEXT NOT NULL, name TEXT NOT NULL, result TEXT, limit_value REAL, value REAL,"
+            " PRIMARY KEY (alpha_id, name))"
+        )
+        for name, columns in INDEXES.items():
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON alphas ({columns})")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_checks_name_result ON alpha_checks (name, result)")
+        self.conn.commit()
+
+    def add_many(self, alphas, account = None):
+        rows, check_rows = [], []
+        for alpha in alphas:
+            row, checks = flatten_alpha(alpha, account)
+            if not row['id']:
+                continue
+            rows.append(tuple(row[c] for c in COLUMN_NAMES))
+            check_rows.extend(checks)
+        placeholders = ', '.join('?' for _ in COLUMN_NAMES)
+        with self.conn:
+            self.conn.executemany(f"INSERT OR REPLACE INTO alphas ({', '.join(COLUMN_NAMES)}) VALUES ({placeholders})", rows)
+            self.conn.executemany("DELETE FROM alpha_checks WHERE alpha_id = ?", [(r[0],) for r in rows])
+            self.conn.executemany("INSERT OR REPLACE INTO alpha_checks VALUES (?, ?, ?, ?, ?)", check_rows)
+        return len(rows)
+
+    def add(self, alpha, account = None):
+        return self.add_many([alpha], account)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM alphas").fetchone()[0]
+
+    def __contains__(self, alpha_id):
+        return self.conn.execute("SELECT 1 FROM alphas WHERE id = ?", (alpha_id,)).fetchone() is not None
+
+    def query(self, min_sharpe = None, min_fitness = None, max_turnover = None, passing = False,
+              where = None, params = (), columns = None, order_by = 'sharpe DESC', limit = None, **equals):
+        '''
+        筛选alpha, 返回DataFrame
+        - min_sharpe / min_fitness / max_turnover: 阈值
+        - passing=True: 没有FAIL/ERROR的check
+        - where / params: 额外的SQL条件, 例如 where="abs(sharpe) > ?", params=(1.0,)
+        - 其余关键字按列相等筛选, 例如 universe='TOP3000', neutralization='SUBINDUSTRY'
+        '''
+        conditions, values = [], []
+        if min_sharpe is not None:
+            conditions.append("sharpe >= ?")
+            values.append(min_sharpe)
+        if min_fitness is not None:
+            conditions.append("fitness >= ?")
+            values.append(min_fitness)
+        if max_turnover is not None:
+            conditions.append("turnover <= ?")
+            values.append(max_turnover)
+        if passing:
+            conditions.append("checks_failed = 0")
+        for column, value in equals.items():
+            if column not in COLUMN_NAMES:
+                raise ValueError(f"Unknown column: {column}")
+            conditions.append(f"{column} = ?")
+            values.append(value)
+        if where:
+            conditions.append(f"({where})")
+            values.extend(params)
+        selected = ', '.join(columns) if columns else ', '.join(c for c in COLUMN_NAMES if c != 'raw')
+        sql = f"SELECT {selected} FROM alphas"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return pd.read_sql_query(sql, self.conn, params = values)
+
+    def checks(self, alpha_ids = None, name = None):
+        '''
+        check明细, 可按alpha_id列表和check名称筛选
+        '''
+        sql, values, conditions = "SELECT * FROM alpha_checks", [], []
+        if alpha_ids is not None:
+            alpha_ids = list(alpha_ids)
+            conditions.append(f"alpha_id IN ({', '.join('?' for _ in alpha_ids)})")
+            values.extend(alpha_ids)
+        if name:
+            conditions.append("name = ?")
+            values.append(name)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return pd.read_sql_query(sql, self.conn, params = values)
+
+    def update_checks(self, alpha_id, checks):
+        '''
+        /alphas/{id}/check 跑完PENDING的check之后, 用新结果替换这个alpha的check明细和checks_failed / checks_pending
+        '''
+        check_rows = [(alpha_id, c.get('name'), c.get('result'), c.get('limit'), c.get('value')) for c in checks]
+        failed = sum(1 for c in checks if c.get('result') in ('FAIL', 'ERROR'))
+        pending = sum(1 for c in checks if c.get('result') == 'PENDING')
+        with self.conn:
+            self.conn.execute("DELETE FROM alpha_checks WHERE alpha_id = ?", (alpha_id,))
+            self.conn.executemany("INSERT OR REPLACE INTO alpha_checks VALUES (?, ?, ?, ?, ?)", check_rows)
+            self.conn.execute("UPDATE alphas SET checks_failed = ?, checks_pending = ? WHERE id = ?", (failed, pending, alpha_id))
+
+    def get(self, alpha_id):
+        '''
+        完整的API返回(dict), 没有时返回None
+        '''
+        row = self.conn.execute("SELECT raw FROM alphas WHERE id = ?", (alpha_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def migrate_csv(self, csv_path, chunk_size = 2000):
+        total, chunk = 0, []
+        with open(csv_path, 'r', newline = '') as file:
+            for values in csv.reader(file):
+                chunk.append(dict(zip(ALPHA_CSV_COLUMNS, values)))
+                if len(chunk) >= chunk_size:
+                    total += self.add_many(chunk)
+                    chunk = []
+        if chunk:
+            total += self.add_many(chunk)
+        return total
+
+    def migrate_csvs(self, pattern = 'simulated_alphas/simulated_alphas_*.csv'):
+        '''
+        一次性导入历史的每日结果csv; 按id去重, 重复运行不会产生重复行
+        '''
+        total = 0
+        for csv_path in sorted(glob.glob(pattern)):
+            count = self.migrate_csv(csv_path)
+            logging.info(f"Migrated {count} alphas from {csv_path}")
+            total += count
+        return total
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s - %(levelname)s - %(message)s')
+    store = ResultsStore()
+    store.migrate_csvs()
+    print(f"{len(store)} alphas in {store.db_path}")
+    print(store.query(min_sharpe = 1.25, min_fitness = 1, columns = ['id', 'code', 'sharpe', 'fitness', 'turnover']))
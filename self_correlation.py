@@ -0,0 +1,301 @@
+'''
+本地自相关: 结果里的SELF_CORRELATION一直是PENDING, 不用再一个个去平台上查和已提交alpha的相关性
+
+- 每个alpha的日PnL从 /alphas/{id}/recordsets/pnl 拉一次(累计PnL, 这里差分成日PnL), 缓存在 simulated_alphas/pnl_matrix.npz
+- 内存里是一个稠密的 日期 x alpha 的float32矩阵, 缺失为NaN; 新alpha追加一列, 出现新日期时补行
+- 相关系数按矩阵乘法一次算完: 两两只用都有数据的日期(pairwise complete), 共同日期少于min_periods为NaN
+  只看最近window_days天(平台的自相关也是看最近4年)
+- book: 已提交(status为ACTIVE)的alpha, max_vs_book()给每个候选算和book里所有alpha的最大相关
+- observe(result, session): simulator每完成一个alpha调用一次, 后台线程拉PnL加进矩阵, 不阻塞调度
+
+用法:
+    engine = SelfCorrelation(session)
+    engine.sync_book(ResultsStore())                  # book里缺PnL的并发拉下来
+    engine.ensure(candidate_ids)
+    engine.max_vs_book(candidate_ids)                 # 每个候选一行: max_correlation / most_correlated
+    engine.screen(candidate_ids, threshold = 0.7)     # 最大相关低于阈值的候选
+    python self_correlation.py                        # 同步book, 给结果库里通过检查的alpha算自相关
+'''
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from brain_transport import BRAIN_API_URL
+
+PNL_PATH = 'simulated_alphas/pnl_matrix.npz'
+WINDOW_DAYS = 4 * 365
+MIN_PERIODS = 60
+THRESHOLD = 0.7
+
+
+def parse_pnl(payload):
+    '''
+    recordsets/pnl的返回 -> 按日期索引的日PnL Series
+    {'schema': {'properties': [{'name': 'date'}, {'name': 'pnl'}, ...]}, 'records': [['2018-01-22', 0.0, ...], ...]}
+    '''
+    names = [prop['name'] for prop in payload.get('schema', {}).get('properties', [])] or ['date', 'pnl']
+    records = payload.get('records') or []
+    if not records:
+        return pd.Series(dtype = 'float64')
+    frame = pd.DataFrame([record[:len(names)] for record in records], columns = names[:len(records[0])])
+    cumulative = pd.Series(pd.to_numeric(frame['pnl'], errors = 'coerce').to_numpy(), index = pd.to_datetime(frame['date']))
+    cumulative = cumulative[~cumulative.index.duplicated(keep = 'last')].sort_index()
+    return cumulative.diff().iloc[1:]
+
+
+def pairwise_correlation(left, right, min_periods = MIN_PERIODS):
+    '''
+    left: T x n, right: T x m, NaN为缺失; 返回 n x m 的相关系数矩阵
+    每一对只用两边都有数据的日期, 各项和都用矩阵乘法算
+    '''
+    left_mask, right_mask = ~np.isnan(left), ~np.isnan(right)
+    x, y = np.where(left_mask, left, 0.0), np.where(right_mask, right, 0.0)
+    mx, my = left_mask.astype(np.float64), right_mask.astype(np.float64)
+    count = mx.T @ my
+    sum_x, sum_y = x.T @ my, mx.T @ y
+    sum_xx, sum_yy = (x * x).T @ my, mx.T @ (y * y)
+    sum_xy = x.T @ y
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        covariance = sum_xy - sum_x * sum_y / count
+        variance_x = sum_xx - sum_x ** 2 / count
+        variance_y = sum_yy - sum_y ** 2 / count
+        correlation = covariance / np.sqrt(variance_x * variance_y)
+    correlation[(count < min_periods) | ~np.isfinite(correlation)] = np.nan
+    return np.clip(correlation, -1.0, 1.0)
+
+
+class SelfCorrelation:
+    def __init__(self, session = None, base_url = BRAIN_API_URL, path = PNL_PATH, window_days = WINDOW_DAYS,
+                 min_periods = MIN_PERIODS, workers = 4, save_every = 50):
+        self.session = session   # requests.Session 或 BrainTransport; observe()可以传各账号自己的session
+        self.base_url = base_url.rstrip('/')
+        self.path = path
+        self.window_days = window_days
+        self.min_periods = min_periods
+        self.workers = workers
+        self.save_every = save_every   # observe()每加这么多个alpha落一次盘
+        self.dates = np.array([], dtype = 'datetime64[D]')
+        self.values = np.empty((0, 0), dtype = np.float32)   # 预留了列, 前len(self.ids)列有效
+        self.ids = []
+        self.columns = {}   # alpha id -> 列号
+        self.book = set()
+        self.unsaved = 0
+        self.executor = None
+        self.lock = threading.RLock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, alpha_id):
+        return alpha_id in self.columns
+
+    def load(self):
+        with np.load(self.path, allow_pickle = False) as data:
+            self.dates = data['dates'].astype('datetime64[D]')
+            self.values = data['values'].astype(np.float32)
+            self.ids = [str(alpha_id) for alpha_id in data['ids']]
+            self.book = {str(alpha_id) for alpha_id in data['book']}
+        self.columns = {alpha_id: column for column, alpha_id in enumerate(self.ids)}
+        logging.info(f"Loaded PnL for {len(self.ids)} alphas x {len(self.dates)} days ({len(self.book)} in book) from {self.path}")
+
+    def save(self):
+        with self.lock:
+            dates, ids, book = self.dates, np.array(self.ids, dtype = str), np.array(sorted(self.book), dtype = str)
+            values = self.values[:, :len(self.ids)]
+            self.unsaved = 0
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok = True)
+        temp_path = self.path + '.tmp.npz'
+        np.savez(temp_path, dates = dates, ids = ids, book = book, values = values)
+        os.replace(temp_path, self.path)
+
+    def _extend_dates(self, dates):
+        '''
+        调用方持有锁; 出现矩阵里没有的日期时重建行
+        '''
+        merged = np.union1d(self.dates, dates)
+        values = np.full((len(merged), self.values.shape[1]), np.nan, dtype = np.float32)
+        values[np.searchsorted(merged, self.dates)] = self.values
+        self.dates, self.values = merged, values
+
+    def _column(self, alpha_id):
+        '''
+        调用方持有锁; 列不够时按两倍扩容, 追加一列是均摊O(T)
+        '''
+        column = self.columns.get(alpha_id)
+        if column is not None:
+            return column
+        if len(self.ids) == self.values.shape[1]:
+            grown = np.full((len(self.dates), max(16, 2 * len(self.ids))), np.nan, dtype = np.float32)
+            grown[:, :len(self.ids)] = self.values[:, :len(self.ids)]
+            self.values = grown
+        column = len(self.ids)
+        self.ids.append(alpha_id)
+        self.columns[alpha_id] = column
+        return column
+
+    def add(self, alpha_id, pnl, book = False):
+        '''
+        pnl: 按日期索引的日PnL Series(parse_pnl的返回); 已有的alpha整列替换
+        '''
+        dates = pd.DatetimeIndex(pnl.index).values.astype('datetime64[D]')
+        with self.lock:
+            missing = np.setdiff1d(dates, self.dates)
+            if len(missing):
+                self._extend_dates(missing)
+            column = self._column(alpha_id)
+            self.values[:, column] = np.nan
+            self.values[np.searchsorted(self.dates, dates), column] = pnl.to_numpy(dtype = np.float32)
+            if book:
+                self.book.add(alpha_id)
+            self.unsaved += 1
+
+    def fetch_pnl(self, alpha_id, session = None, max_wait = 120):
+        '''
+        PnL还没生成好时返回空body + Retry-After, 按它等
+        '''
+        session = session or self.session
+        url = f"{self.base_url}/alphas/{alpha_id}/recordsets/pnl"
+        deadline = time.time() + max_wait
+        while True:
+            response = session.get(url)
+            response.raise_for_status()
+            retry_after = float(response.headers.get('Retry-After', 0) or 0)
+            if retry_after == 0 and response.content:
+                return parse_pnl(response.json())
+            if time.time() + retry_after > deadline:
+                raise TimeoutError(f"PnL of alpha {alpha_id} not ready after {max_wait}s")
+            time.sleep(retry_after or 1)
+
+    def ensure(self, alpha_ids, book = False, session = None):
+        '''
+        矩阵里没有的alpha并发拉PnL; 返回新加的个数
+        '''
+        with self.lock:
+            missing = [alpha_id for alpha_id in dict.fromkeys(alpha_ids) if alpha_id not in self.columns]
+            if book:
+                self.book.update(alpha_id for alpha_id in alpha_ids if alpha_id in self.columns)
+        added = 0
+        with ThreadPoolExecutor(max_workers = max(1, self.workers)) as executor:
+            futures = {alpha_id: executor.submit(self.fetch_pnl, alpha_id, session) for alpha_id in missing}
+            for alpha_id, future in futures.items():
+                try:
+                    self.add(alpha_id, future.result(), book = book)
+                    added += 1
+                except Exception as e:
+                    logging.error(f"Failed to fetch PnL of alpha {alpha_id}: {e}")
+        if added:
+            self.save()
+            logging.info(f"Fetched PnL for {added} of {len(missing)} alphas, {len(self.ids)} in matrix")
+        return added
+
+    def observe(self, result, session = None):
+        '''
+        simulator里一个alpha完成时调用: 提交到后台线程拉PnL, 立即返回
+        '''
+        alpha_id = result.get('id')
+        if not alpha_id or alpha_id in self.columns:
+            return
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers = max(1, self.workers), thread_name_prefix = 'pnl')
+        self.executor.submit(self._observe, alpha_id, session, result.get('status') == 'ACTIVE')
+
+    def _observe(self, alpha_id, session, book):
+        try:
+            self.add(alpha_id, self.fetch_pnl(alpha_id, session), book = book)
+        except Exception as e:
+            logging.error(f"Failed to fetch PnL of alpha {alpha_id}: {e}")
+            return
+        if self.unsaved >= self.save_every:
+            self.save()
+
+    def mark_book(self, alpha_ids):
+        with self.lock:
+            self.book.update(alpha_ids)
+
+    def sync_book(self, results_store, session = None):
+        '''
+        结果库里status为ACTIVE(已提交)的alpha作为book, 缺PnL的拉下来
+        '''
+        frame = results_store.query(columns = ['id'], where = "status = 'ACTIVE'", order_by = None)
+        book_ids = list(frame['id'])
+        self.mark_book(book_ids)
+        self.ensure(book_ids, book = True, session = session)
+        return book_ids
+
+    def _window(self, alpha_ids):
+        '''
+        最近window_days天, 这几个alpha的列(float64)
+        '''
+        with self.lock:
+            columns = [self.columns[alpha_id] for alpha_id in alpha_ids]
+            rows = self.dates >= self.dates[-1] - np.timedelta64(self.window_days, 'D') if len(self.dates) else slice(None)
+            return self.values[rows][:, columns].astype(np.float64)
+
+    def correlation(self, left, right = None):
+        '''
+        两组alpha两两之间的相关系数, 返回DataFrame(行left, 列right); right不传为left自己
+        '''
+        left = [alpha_id for alpha_id in left if alpha_id in self.columns]
+        right = left if right is None else [alpha_id for alpha_id in right if alpha_id in self.columns]
+        matrix = pairwise_correlation(self._window(left), self._window(right), self.min_periods)
+        return pd.DataFrame(matrix, index = left, columns = right)
+
+    def max_vs_book(self, candidates = None):
+        '''
+        每个候选和book里alpha的最大相关(不算自己): 返回 max_correlation / most_correlated 两列
+        没有PnL的候选不在结果里; 和book没有足够共同日期的max_correlation为NaN
+        '''
+        with self.lock:
+            book = [alpha_id for alpha_id in self.ids if alpha_id in self.book]
+            if candidates is None:
+                candidates = [alpha_id for alpha_id in self.ids if alpha_id not in self.book]
+        matrix = self.correlation(candidates, book)
+        if matrix.empty:
+            return pd.DataFrame({'max_correlation': np.nan, 'most_correlated': None}, index = matrix.index)
+        values = matrix.to_numpy()
+        values[np.asarray(matrix.index)[:, None] == np.asarray(matrix.columns)[None, :]] = np.nan
+        has_value = ~np.isnan(values).all(axis = 1)
+        best = np.argmax(np.where(np.isnan(values), -np.inf, values), axis = 1)
+        return pd.DataFrame({
+            'max_correlation': np.where(has_value, values[np.arange(len(values)), best], np.nan),
+            'most_correlated': np.where(has_value, np.asarray(matrix.columns, dtype = object)[best], None),
+        }, index = matrix.index)
+
+    def screen(self, candidates = None, threshold = THRESHOLD):
+        '''
+        和book的最大相关低于threshold的候选(book为空或共同日期不够的也算通过)
+        '''
+        maximum = self.max_vs_book(candidates)['max_correlation']
+        return list(maximum.index[~(maximum >= threshold)])
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait = True)
+            self.executor = None
+        if self.unsaved:
+            self.save()
+
+
+if __name__ == '__main__':
+    import sys
+    from alpha_creator import sign_in
+    from results_store import ResultsStore
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s - %(levelname)s - %(message)s')
+    store = ResultsStore()
+    engine = SelfCorrelation(sign_in())
+    engine.sync_book(store)
+    candidates = list(store.query(passing = True, columns = ['id'], limit = int(sys.argv[1]) if len(sys.argv) > 1 else 200)['id'])
+    engine.ensure(candidates)
+    started = time.perf_counter()
+    result = engine.max_vs_book(candidates)
+    print(f"{len(result)} candidates vs {len(engine.book)} book alphas in {(time.perf_counter() - started) * 1000:.1f} ms")
+    print(result.sort_values('max_correlation'))
+    engine.close()
@@ -0,0 +1,169 @@
+'''
+事件流(logs/events_*.jsonl, 见simulator_events.py)的分析, 代替little_work.ipynb里对日志的正则扫描
+
+- load_events(): 多天的事件文件一次读进一个DataFrame (pd.read_json(lines=True), 不逐行解析)
+- simulation_latency(): 按(sim_url, fingerprint)把submitted和completed/failed配对, 得到每个alpha的准确耗时和查询次数
+  multi-simulation的各个child共用一个sim_url, 按fingerprint区分; 同一个run里用mono相减, 跨run(中途重启)用ts相减
+- throughput(): 按完成时间的滑动窗口吞吐(个/小时)
+- completions(): 按时间段统计完成数
+- slot_utilization(): 按时间段统计槽位占用率(在跑的simulation数按时间加权 / 槽位数)
+- summary(): 汇总成一个dict
+
+用法:
+    python simulation_analytics.py                      # logs/events_*.jsonl
+    python simulation_analytics.py "logs/events_2025-09-*.jsonl"
+'''
+import glob
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+TIMEZONE = 'US/Eastern'
+FINAL_EVENTS = ('completed', 'failed')
+
+
+def _read_event_file(path):
+    '''
+    进程被杀时最后一行可能只写了一半, 去掉再交给pandas
+    '''
+    with open(path, 'r', encoding = 'utf-8') as file:
+        text = file.read()
+    if text and not text.endswith('\n'):
+        text = text[:text.rfind('\n') + 1]
+    if not text.strip():
+        return pd.DataFrame()
+    return pd.read_json(io.StringIO(text), lines = True, dtype = False)
+
+
+def load_events(pattern = 'logs/events_*.jsonl'):
+    '''
+    返回按ts排序的DataFrame, time列是美东时间
+    '''
+    paths = sorted(glob.glob(pattern)) if isinstance(pattern, str) else list(pattern)
+    frames = [frame for frame in (_read_event_file(path) for path in paths) if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns = ['event', 'ts', 'mono', 'run', 'time'])
+    events = pd.concat(frames, ignore_index = True).sort_values('ts', kind = 'stable').reset_index(drop = True)
+    events['time'] = pd.to_datetime(events['ts'], unit = 's', utc = True).dt.tz_convert(TIMEZONE)
+    return events
+
+
+def _select(events, names, columns):
+    return events.loc[events['event'].isin(names)].reindex(columns = columns)
+
+
+def simulation_latency(events, include_open = False):
+    '''
+    每个alpha一行(multi-simulation的每个child各一行): sim_url, account, fingerprint, expression, start, end, duration(秒), polls(multi-simulation按child数平摊), outcome, alpha_id, reason
+    include_open: 还没结束的simulation也返回(end/duration为空)
+    '''
+    starts = _select(events, ['submitted'], ['sim_url', 'run', 'ts', 'mono', 'account', 'fingerprint', 'expression'])
+    starts = starts.dropna(subset = ['sim_url']).drop_duplicates(['sim_url', 'fingerprint'], keep = 'last')
+    ends = _select(events, FINAL_EVENTS, ['sim_url', 'event', 'run', 'ts', 'mono', 'alpha_id', 'reason', 'fingerprint'])
+    ends = ends.dropna(subset = ['sim_url'])
+    # 重启后从旧版journal恢复的simulation没有payload, 结束事件不带fingerprint: 只有一个alpha的sim_url按sim_url配对
+    first = starts.drop_duplicates('sim_url').set_index('sim_url')['fingerprint']
+    single = first[first.index.map(starts['sim_url'].value_counts()) == 1]
+    ends['fingerprint'] = ends['fingerprint'].fillna(ends['sim_url'].map(single))
+    ends = ends.drop_duplicates(['sim_url', 'fingerprint'], keep = 'first')
+    df = starts.merge(ends, on = ['sim_url', 'fingerprint'], how = 'left' if include_open else 'inner', suffixes = ('_start', '_end'))
+    same_run = df['run_start'] == df['run_end']
+    df['duration'] = np.where(same_run, df['mono_end'] - df['mono_start'], df['ts_end'] - df['ts_start'])
+    polls = events.loc[events['event'] == 'polled'].groupby('sim_url').size() if 'sim_url' in events else pd.Series(dtype = int)
+    # multi-simulation的查询是整批一起的, 平摊到每个child上, 加起来还是这一批的查询次数
+    df['polls'] = df['sim_url'].map(polls).fillna(0) / df.groupby('sim_url')['sim_url'].transform('size')
+    df['start'] = pd.to_datetime(df['ts_start'], unit = 's', utc = True).dt.tz_convert(TIMEZONE)
+    df['end'] = df['start'] + pd.to_timedelta(df['duration'], unit = 's')
+    df = df.rename(columns = {'event': 'outcome'})
+    return df[['sim_url', 'account', 'fingerprint', 'expression', 'start', 'end', 'duration', 'polls', 'outcome', 'alpha_id', 'reason']]
+
+
+def completions(events, freq = '1h', account = None):
+    done = events.loc[events['event'] == 'completed']
+    if account is not None:
+        done = done.loc[done['account'] == account]
+    return done.set_index('time').resample(freq).size().rename('completed')
+
+
+def throughput(events, window = '1h', account = None):
+    '''
+    每个完成时刻往前window内的完成数, 换算成个/小时 (与notebook里"过去N个alpha"的滑动速率不同, 这里窗口是固定时长)
+    '''
+    done = events.loc[events['event'] == 'completed']
+    if account is not None:
+        done = done.loc[done['account'] == account]
+    series = pd.Series(1, index = pd.DatetimeIndex(done['time'].dt.tz_convert('UTC')))
+    counts = series.rolling(window).sum()
+    per_hour = counts * (3600 / pd.Timedelta(window).total_seconds())
+    per_hour.index = per_hour.index.tz_convert(TIMEZONE)
+    return per_hour.rename('per_hour')
+
+
+def total_slots(events, default = None):
+    '''
+    每个run里各账号max_concurrent之和, 取所有run的最大值
+    '''
+    started = _select(events, ['started'], ['run', 'account', 'max_concurrent']).dropna()
+    if started.empty:
+        return default
+    return int(started.drop_duplicates(['run', 'account'], keep = 'last').groupby('run')['max_concurrent'].sum().max())
+
+
+def slot_utilization(events, freq = '1h', slots = None):
+    '''
+    每个时间段: busy_slot_seconds(在跑的simulation数对时间的积分)、mean_active、utilization(= mean_active / slots)
+    还没结束的simulation算到事件流的最后时刻
+    '''
+    slots = slots or total_slots(events)
+    latency = simulation_latency(events, include_open = True)
+    if latency.empty:
+        return pd.DataFrame(columns = ['busy_slot_seconds', 'mean_active', 'utilization'])
+    last = events['time'].max()
+    # multi-simulation只占一个槽位: 按sim_url合并, 到最后一个child结束为止
+    latency = latency.assign(end = latency['end'].fillna(last)).groupby('sim_url').agg(start = ('start', 'min'), end = ('end', 'max'))
+    start = latency['start'].dt.tz_convert('UTC')
+    end = latency['end'].dt.tz_convert('UTC')
+    # 在跑数量的阶梯函数: 开始+1, 结束-1
+    steps = pd.concat([pd.Series(1, index = start), pd.Series(-1, index = end)]).groupby(level = 0).sum().cumsum()
+    boundaries = pd.date_range(steps.index.min().floor(freq), steps.index.max().ceil(freq), freq = freq)
+    active = steps.reindex(steps.index.union(boundaries)).ffill().fillna(0)
+    seconds = np.diff(active.index.asi8) / 1e9
+    busy = pd.Series(active.values[:-1] * seconds, index = active.index[:-1])
+    busy = busy.groupby(busy.index.floor(freq)).sum()
+    bin_seconds = pd.Timedelta(freq).total_seconds()
+    result = pd.DataFrame({'busy_slot_seconds': busy, 'mean_active': busy / bin_seconds})
+    result['utilization'] = result['mean_active'] / slots if slots else np.nan
+    result.index = result.index.tz_convert(TIMEZONE)
+    return result
+
+
+def summary(events, slots = None):
+    latency = simulation_latency(events)
+    completed = latency.loc[latency['outcome'] == 'completed']
+    failed = _select(events, ['failed'], ['reason'])
+    span_hours = (events['ts'].max() - events['ts'].min()) / 3600 if len(events) else 0
+    utilization = slot_utilization(events, slots = slots)
+    slots = slots or total_slots(events)
+    return {
+        'events': len(events),
+        'runs': int(events['run'].nunique()) if len(events) else 0,
+        'completed': len(completed),
+        'failed': failed['reason'].fillna('unknown').value_counts().to_dict(),
+        'dropped': int((events['event'] == 'dropped').sum()) if len(events) else 0,
+        'duration_mean': round(completed['duration'].mean(), 1) if len(completed) else None,
+        'duration_p50': round(completed['duration'].median(), 1) if len(completed) else None,
+        'duration_p95': round(completed['duration'].quantile(0.95), 1) if len(completed) else None,
+        'share_over_100s': round((completed['duration'] > 100).mean(), 3) if len(completed) else None,
+        'polls_per_completion': round(completed['polls'].mean(), 2) if len(completed) else None,
+        'completed_per_hour': round(len(completed) / span_hours, 1) if span_hours else None,
+        'slot_utilization': round(utilization['busy_slot_seconds'].sum() / (slots * span_hours * 3600), 3) if slots and span_hours else None,
+    }
+
+
+if __name__ == '__main__':
+    import sys
+    events = load_events(sys.argv[1] if len(sys.argv) > 1 else 'logs/events_*.jsonl')
+    print(json.dumps(summary(events), indent = 2, ensure_ascii = False))
+    print(pd.concat([completions(events), slot_utilization(events)], axis = 1).tail(24))
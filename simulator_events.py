@@ -0,0 +1,66 @@
+'''
+结构化事件流: 每个事件一行JSON, 写到 logs/events_<美东日期>.jsonl
+
+代替从 logs/simulation_<date>.log 里用正则扫 "Strating simulation" / "ended with status":
+- 每个事件都带 ts(墙上时间, 秒) 和 mono(time.monotonic(), 同一次运行内用来算耗时, 不受系统校时影响)
+- run: 每个进程一个id, 只有同一个run里的mono可以相减
+- 开始/结束都带sim_url, 分析时按sim_url精确配对, 不会因为完成顺序和提交顺序不同而配错
+
+事件:
+    started    account, max_concurrent           simulator开始运行
+    login      account, relogin                  登录成功
+    submitted  sim_url, account, fingerprint, expression, submit_seconds
+    polled     sim_url, account, retry_after
+    completed  sim_url, account, fingerprint, alpha_id
+    failed     sim_url, account, fingerprint, reason (submit / error / timeout)
+    dropped    account, fingerprint, reason      已回测过(无reason)或被pruner淘汰(reason=pruned), 跳过
+    limit      account, old, new, reason         AIMD调整了并发上限
+分析见 simulation_analytics.py
+'''
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from pytz import timezone
+
+
+class EventStream:
+    def __init__(self, directory = 'logs', prefix = 'events'):
+        self.directory = directory
+        self.prefix = prefix
+        self.run_id = uuid.uuid4().hex[:12]
+        self.eastern = timezone('US/Eastern')
+        self.lock = threading.Lock()   # 查询进度在线程池里跑, 多个线程会同时写
+        self.current_date = None
+        self.file = None
+
+    def _path(self, date):
+        return os.path.join(self.directory, f"{self.prefix}_{date}.jsonl")
+
+    def _open(self):
+        date = datetime.now(self.eastern).strftime('%Y-%m-%d')
+        if date != self.current_date:
+            if self.file is not None:
+                self.file.close()
+            os.makedirs(self.directory, exist_ok = True)
+            self.file = open(self._path(date), 'a', encoding = 'utf-8')
+            self.current_date = date
+        return self.file
+
+    def emit(self, event, **fields):
+        record = {'event': event, 'ts': round(time.time(), 3), 'mono': round(time.monotonic(), 3), 'run': self.run_id}
+        record.update((key, value) for key, value in fields.items() if value is not None)
+        line = json.dumps(record, default = str) + '\n'
+        with self.lock:
+            file = self._open()
+            file.write(line)
+            file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
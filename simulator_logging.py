@@ -0,0 +1,259 @@
+'''
+simulator的日志: 主循环里的logging.info只把record放进有界队列, 由后台线程批量写文件和控制台
+
+- BoundedQueueHandler: 调用logging只是一次queue.put, 不碰磁盘; 队列满了(默认10000条)时INFO及以下直接丢弃并计数,
+  不阻塞调度; WARNING及以上等队列有空位再放, 不丢
+- LogWriter: 后台线程一次把队列里已有的record全取出来(最多batch_size条), 交给各handler写, 整批写完每个handler只flush一次;
+  有丢弃时补一条WARNING说明丢了多少
+- EasternTimeRotatingFileHandler: 按美东日期每天一个文件 logs/simulation_<date>.log;
+  下一个美东零点的时间戳算一次缓存在rollover_at, shouldRollover只比较 record.created >= rollover_at,
+  不再每条日志都 datetime.now(timezone('US/Eastern'))
+- 进程正常退出(atexit)或stop_logging()时, 先把队列里剩下的日志写完、flush, 再返回;
+  之后再有日志(其他线程、atexit里的清理)不进队列, 直接写文件和控制台, 不会因为没人取而卡住
+'''
+import atexit
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timedelta
+from logging.handlers import BaseRotatingHandler, QueueHandler
+
+from pytz import timezone
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+_STOP = object()
+
+
+class DeferredFlushMixin:
+    '''
+    deferred_flush为True时emit之后不flush, 由LogWriter每批写完调用flush_batch(); 直接挂在logger上用时和普通handler一样
+    '''
+    deferred_flush = False
+
+    def flush(self):
+        if not self.deferred_flush:
+            super().flush()
+
+    def flush_batch(self):
+        super().flush()
+
+
+# 自定义美东时间轮换处理器
+class EasternTimeRotatingFileHandler(DeferredFlushMixin, BaseRotatingHandler):
+    def __init__(self, filename_template, backupCount=30):
+        self.eastern = timezone('US/Eastern')
+        self.filename_template = filename_template  # 传入带占位符的模板，如"logs/simulation_{}.log"
+        self.backupCount = backupCount
+        self.current_date = self._get_current_eastern_date()
+        self.rollover_at = self._next_midnight()
+        self.baseFilename = self._get_current_filename()
+        # 确保日志目录存在
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        super().__init__(self.baseFilename, 'a', encoding='utf-8')
+
+    def _get_current_eastern_date(self):
+        return datetime.now(self.eastern).strftime('%Y-%m-%d')
+
+    def _next_midnight(self):
+        # 下一个美东零点的时间戳; localize按当天的夏令时/冬令时换算
+        tomorrow = datetime.now(self.eastern).date() + timedelta(days=1)
+        return self.eastern.localize(datetime(tomorrow.year, tomorrow.month, tomorrow.day)).timestamp()
+
+    def _get_current_filename(self):
+        return self.filename_template.format(self.current_date)
+
+    def shouldRollover(self, record):
+        # 只和缓存的零点时间戳比较
+        return record.created >= self.rollover_at
+
+    def doRollover(self):
+        # 关闭当前日志文件
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        # 更新日期、下一次轮换时间和文件名, 打开新文件
+        self.current_date = self._get_current_eastern_date()
+        self.rollover_at = self._next_midnight()
+        self.baseFilename = self._get_current_filename()
+        self.stream = self._open()
+
+        # 删除超出保留数量的旧日志
+        self._cleanup_old_logs()
+
+    def _cleanup_old_logs(self):
+        # 获取所有日志文件并按日期排序
+        log_dir = os.path.dirname(self.baseFilename)
+        log_files = [f for f in os.listdir(log_dir) if f.startswith('simulation_') and f.endswith('.log')]
+        log_files.sort(reverse=True)  # 最新的在前
+
+        # 删除多余日志
+        if len(log_files) > self.backupCount:
+            for file in log_files[self.backupCount:]:
+                os.remove(os.path.join(log_dir, file))
+
+
+class ConsoleHandler(DeferredFlushMixin, logging.StreamHandler):
+    pass
+
+
+class BoundedQueueHandler(QueueHandler):
+    def __init__(self, log_queue, block_level = logging.WARNING, block_timeout = 5):
+        super().__init__(log_queue)
+        self.block_level = block_level
+        self.block_timeout = block_timeout   # 后台线程意外挂掉时也不会一直等
+        self.dropped = 0
+        self.writer = None   # LogWriter停了以后直接交给它写
+
+    def prepare(self, record):
+        # 根日志器上只有这一个handler, record不会再给别人用, 不像QueueHandler.prepare那样复制、格式化;
+        # 只把参数合进msg(参数对象之后可能被改), 异常堆栈留给后台线程格式化
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.writer is not None and self.writer.stopped:
+            self.writer.write_now([record])
+            return
+        try:
+            if record.levelno >= self.block_level:
+                self.queue.put(record, timeout = self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogWriter:
+    def __init__(self, log_queue, handlers, queue_handler = None, batch_size = 1000):
+        self.queue = log_queue
+        self.handlers = list(handlers)
+        self.queue_handler = queue_handler
+        self.batch_size = batch_size
+        self.reported_drops = 0
+        self.thread = None
+        self.stopped = False
+        self.direct_lock = threading.Lock()
+        for handler in self.handlers:
+            handler.deferred_flush = True
+        if queue_handler is not None:
+            queue_handler.writer = self
+
+    def start(self):
+        self.thread = threading.Thread(target = self._run, name = 'log-writer', daemon = True)
+        self.thread.start()
+        return self
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _report_drops(self):
+        dropped = self.queue_handler.dropped if self.queue_handler is not None else 0
+        if dropped > self.reported_drops:
+            self._write(logging.makeLogRecord({'levelno': logging.WARNING, 'levelname': 'WARNING',
+                                               'msg': f"Log queue full: dropped {dropped - self.reported_drops} records"}))
+            self.reported_drops = dropped
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = self._next_batch()
+            for record in batch:
+                if record is _STOP:
+                    stopping = True   # 哨兵之前的都已经在这一批里了, 写完再退出
+                    continue
+                self._write(record)
+            self._report_drops()
+            for handler in self.handlers:
+                handler.flush_batch()
+
+    def write_now(self, records):
+        '''
+        后台线程停了以后, 在调用方线程里直接写
+        '''
+        with self.direct_lock:
+            for record in records:
+                if record is not _STOP:
+                    self._write(record)
+            for handler in self.handlers:
+                handler.flush_batch()
+
+    def stop(self, timeout = 10):
+        '''
+        写完队列里剩下的日志再返回; 之后的日志由BoundedQueueHandler直接交给write_now
+        '''
+        if self.stopped:
+            return
+        self.stopped = True
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join(timeout)
+        # 停止前一刻放进队列、在哨兵之后的
+        remaining = []
+        while True:
+            try:
+                remaining.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        self.write_now(remaining)
+
+
+_writer = None
+
+
+# 配置日志按美东时间按天分割
+def setup_logging(queue_size = 10000, batch_size = 1000):
+    '''
+    根日志器只挂一个BoundedQueueHandler, 文件和控制台由后台的LogWriter写; 返回LogWriter
+    '''
+    global _writer
+    stop_logging()
+    # 日志格式（包含美东时间）
+    log_format = logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
+
+    # 创建自定义处理器（指定日志路径模板）
+    handler = EasternTimeRotatingFileHandler(
+        filename_template="logs/simulation_{}.log",
+        backupCount=30  # 保留30天的日志
+    )
+    handler.setFormatter(log_format)
+    # 添加控制台输出
+    console_handler = ConsoleHandler()
+    console_handler.setFormatter(log_format)
+
+    log_queue = queue.Queue(maxsize = queue_size)
+    queue_handler = BoundedQueueHandler(log_queue)
+    # 获取根日志器并配置
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    # 移除现有处理器避免重复输出
+    if logger.hasHandlers():
+        logger.handlers.clear()
+    logger.addHandler(queue_handler)
+    _writer = LogWriter(log_queue, [handler, console_handler], queue_handler, batch_size = batch_size).start()
+    return _writer
+
+
+def stop_logging():
+    '''
+    把队列里剩下的日志写完; 进程退出时自动调用
+    '''
+    if _writer is not None:
+        _writer.stop()
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,245 @@
+'''
+simulator进程的运行指标和状态接口
+
+- 内存里的计数器和直方图: 提交耗时、从提交到完成的耗时、每个simulation的查询次数、失败(按原因)、重新登录次数
+- 队列深度、在跑的槽位数是取值时直接从已注册的simulator上读, 不需要另外维护
+- start_status_server(): 本地HTTP接口
+    GET /metrics   Prometheus文本格式
+    GET /status    JSON状态
+多账号(AlphaSimulatorPool)共用一个SimulatorMetrics, 每个指标带account标签
+'''
+import bisect
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = 'brain_simulator'
+
+# name -> help
+COUNTERS = {
+    'submitted_total': 'Simulations submitted (location received)',
+    'completed_total': 'Simulations completed with a result',
+    'failures_total': 'Failures by cause (submit / error / timeout / poll)',
+    'polls_total': 'Simulation progress requests',
+    'logins_total': 'Successful sign-ins',
+    'relogins_total': 'Sign-ins after the first one (session expired)',
+    'http_retries_total': 'HTTP retries by cause (network / server_error / throttled / concurrent_limit)',
+    'duplicates_skipped_total': 'Alphas skipped because their fingerprint was already simulated',
+    'pruned_total': 'Alphas dropped because their group failed the successive-halving probe',
+}
+
+# name -> (help, buckets)
+HISTOGRAMS = {
+    'submit_latency_seconds': ('Time from the first POST /simulations attempt to receiving a location',
+                               (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)),
+    'completion_seconds': ('Time from submission to completed result',
+                           (10, 30, 60, 90, 120, 180, 240, 300, 420, 600, 900)),
+    'polls_per_simulation': ('Progress requests per finished simulation',
+                             (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)),
+}
+
+THROUGHPUT_WINDOW = 3600   # /status里completed_last_hour的窗口(秒)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # 最后一个是+Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        '''
+        按桶估算分位数(取所在桶的上界), 只用于/status的概览
+        '''
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound if bound != float('inf') else self.buckets[-1]
+        return self.buckets[-1]
+
+    def summary(self):
+        return {'count': self.count, 'sum': round(self.sum, 3),
+                'mean': round(self.sum / self.count, 3) if self.count else None,
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95)}
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value)}"' for key, value in labels) + '}'
+
+
+class SimulatorMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()   # 提交、查询在线程池里跑, 读在HTTP线程里
+        self.started_at = time.time()
+        self.counters = {}   # (name, ((label, value), ...)) -> 数值
+        self.histograms = {}   # (name, ((label, value), ...)) -> Histogram
+        self.completions = deque()   # 最近THROUGHPUT_WINDOW秒内完成的时间戳
+        self.simulators = []
+
+    def register(self, simulator):
+        '''
+        注册后/metrics和/status会带上它的在跑槽位、队列深度
+        '''
+        if simulator not in self.simulators:
+            self.simulators.append(simulator)
+
+    def inc(self, name, account = None, amount = 1, **labels):
+        if account:
+            labels['account'] = account
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+            if name == 'completed_total':
+                now = time.time()
+                self.completions.append(now)
+                while self.completions and self.completions[0] < now - THROUGHPUT_WINDOW:
+                    self.completions.popleft()
+
+    def observe(self, name, value, account = None):
+        key = (name, (('account', account),) if account else ())
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(HISTOGRAMS[name][1])
+            self.histograms[key].observe(value)
+
+    def counter(self, name, **labels):
+        '''
+        按标签求和, 例如 counter('failures_total', cause = 'timeout')
+        '''
+        with self.lock:
+            return sum(value for (key, key_labels), value in self.counters.items()
+                       if key == name and all(dict(key_labels).get(k) == v for k, v in labels.items()))
+
+    def gauges(self):
+        '''
+        [(name, help, labels, value)], 取值时从simulator上读
+        '''
+        gauges = []
+        for simulator in self.simulators:
+            labels = (('account', simulator.username),)
+            gauges.append(('active_simulations', 'Simulations currently running', labels, len(simulator.active_simulations)))
+            gauges.append(('max_concurrent', 'Current concurrent simulation limit (AIMD)', labels, simulator.max_concurrent))
+        queues = {id(s.alpha_queue): s.alpha_queue for s in self.simulators}
+        for alpha_queue in queues.values():
+            gauges.append(('queue_buffered_alphas', 'Alphas taken from pending and waiting in memory', (), len(alpha_queue.buffer)))
+            if hasattr(alpha_queue, 'count'):
+                gauges.append(('queue_pending_alphas', 'Alphas still in the SQLite pending table', (), alpha_queue.count()[0]))
+        return gauges
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in self.histograms.items()}
+        for name, help_text in COUNTERS.items():
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} counter")
+            for (key, labels), value in sorted(counters.items()):
+                if key == name:
+                    lines.append(f"{PREFIX}_{name}{_labels(labels)} {value}")
+        for name, (help_text, _) in HISTOGRAMS.items():
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} histogram")
+            for (key, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+                if key != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{PREFIX}_{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{PREFIX}_{name}_sum{_labels(labels)} {total}")
+                lines.append(f"{PREFIX}_{name}_count{_labels(labels)} {count}")
+        seen = set()
+        for name, help_text, labels, value in self.gauges():
+            if name not in seen:
+                lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+                lines.append(f"# TYPE {PREFIX}_{name} gauge")
+                seen.add(name)
+            lines.append(f"{PREFIX}_{name}{_labels(labels)} {value}")
+        lines.append(f"# TYPE {PREFIX}_uptime_seconds gauge")
+        lines.append(f"{PREFIX}_uptime_seconds {time.time() - self.started_at:.1f}")
+        return '\n'.join(lines) + '\n'
+
+    def status(self):
+        now = time.time()
+        with self.lock:
+            while self.completions and self.completions[0] < now - THROUGHPUT_WINDOW:
+                self.completions.popleft()
+            completed_last_hour = len(self.completions)
+            histograms = {}
+            for (name, labels), histogram in self.histograms.items():
+                histograms.setdefault(name, {})[dict(labels).get('account', 'all')] = histogram.summary()
+        accounts = {}
+        for simulator in self.simulators:
+            accounts[simulator.username] = {
+                'active_simulations': len(simulator.active_simulations),
+                'max_concurrent': simulator.max_concurrent,
+                'submitted': self.counter('submitted_total', account = simulator.username),
+                'completed': self.counter('completed_total', account = simulator.username),
+                'failures': self.counter('failures_total', account = simulator.username),
+                'relogins': self.counter('relogins_total', account = simulator.username),
+            }
+        failures = {}
+        with self.lock:
+            counters = list(self.counters.items())
+        for (name, labels), value in counters:
+            if name == 'failures_total':
+                cause = dict(labels).get('cause')
+                failures[cause] = failures.get(cause, 0) + value
+        gauges = {name: value for name, _, labels, value in self.gauges() if not labels}
+        return {
+            'uptime_seconds': round(now - self.started_at, 1),
+            'completed': self.counter('completed_total'),
+            'completed_last_hour': completed_last_hour,
+            'failures': failures,
+            'duplicates_skipped': self.counter('duplicates_skipped_total'),
+            'pruned': self.counter('pruned_total'),
+            'queue': gauges,
+            'accounts': accounts,
+            'histograms': histograms,
+        }
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        metrics = self.server.metrics
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            body, content_type = metrics.prometheus().encode('utf-8'), 'text/plain; version=0.0.4'
+        elif path in ('/status', '/'):
+            body, content_type = json.dumps(metrics.status(), indent = 2).encode('utf-8'), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_status_server(metrics, port = 9108, host = '127.0.0.1'):
+    '''
+    后台线程里起状态接口, 返回server(server.shutdown()停止)
+    '''
+    server = ThreadingHTTPServer((host, port), StatusHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
@@ -0,0 +1,152 @@
+'''
+提交候选筛选: 代替跑完之后手工筛结果、再一个个去点PENDING的check
+
+1. shortlist(): 结果库里没提交过、除了PENDING全部check为PASS(WARNING也不算)、指标过阈值的alpha (SQL筛, 几万行也是毫秒级)
+2. 可选: 传了correlation(见self_correlation.py)时, 本地自相关已经超过阈值的先剔掉, 不浪费check请求
+3. fetch_checks(): 还有PENDING的(SELF_CORRELATION等), 并发请求 /alphas/{id}/check
+   - 线程池限制并发数workers; 每个请求按Retry-After等, 单个alpha最多等max_wait秒
+   - 拿到的结果写回结果库(update_checks), 下次不用再查
+4. select(): 全部check为PASS的按rank_by排序, 写 simulated_alphas/submit_list.csv
+
+用法:
+    selector = SubmissionSelector(ResultsStore(), session, thresholds = {'sharpe': 1.25, 'fitness': 1.0})
+    submit_list = selector.select()
+    python submission_selector.py [最多几个]
+'''
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from brain_transport import BRAIN_API_URL
+
+SUBMIT_LIST_PATH = 'simulated_alphas/submit_list.csv'
+DEFAULT_THRESHOLDS = {'sharpe': 1.25, 'fitness': 1.0}   # 列 >= 阈值
+DEFAULT_MAXIMA = {'turnover': 0.7}   # 列 <= 阈值
+RANK_BY = ('fitness', 'sharpe')
+SHORTLIST_COLUMNS = ['id', 'code', 'account', 'region', 'universe', 'delay', 'decay', 'neutralization', 'truncation',
+                     'sharpe', 'fitness', 'turnover', 'returns', 'drawdown', 'margin', 'checks_pending']
+# 结果库里已有结果的check只认PASS, 和查完PENDING之后的all_passed是同一个规则
+NO_UNPASSED_CHECKS = ("NOT EXISTS (SELECT 1 FROM alpha_checks WHERE alpha_checks.alpha_id = alphas.id"
+                      " AND COALESCE(alpha_checks.result, '') NOT IN ('PASS', 'PENDING'))")
+
+
+def all_passed(checks):
+    return all(check.get('result') == 'PASS' for check in checks)
+
+
+class SubmissionSelector:
+    def __init__(self, results_store, session = None, base_url = BRAIN_API_URL, thresholds = None, maxima = None,
+                 workers = 4, max_wait = 600, correlation = None, correlation_threshold = 0.7):
+        self.results_store = results_store
+        self.session = session   # requests.Session 或 BrainTransport, 只有要查PENDING的check时才用到
+        self.base_url = base_url.rstrip('/')
+        self.thresholds = DEFAULT_THRESHOLDS if thresholds is None else thresholds
+        self.maxima = DEFAULT_MAXIMA if maxima is None else maxima
+        self.workers = workers
+        self.max_wait = max_wait
+        self.correlation = correlation
+        self.correlation_threshold = correlation_threshold
+
+    def shortlist(self, limit = None):
+        '''
+        没提交过、除了PENDING全部check为PASS、过阈值的alpha; 按RANK_BY排好序
+        '''
+        conditions, params = ["status = 'UNSUBMITTED'", NO_UNPASSED_CHECKS], []
+        for column, value in self.thresholds.items():
+            conditions.append(f"{column} >= ?")
+            params.append(value)
+        for column, value in self.maxima.items():
+            conditions.append(f"{column} <= ?")
+            params.append(value)
+        return self.results_store.query(passing = True, where = ' AND '.join(conditions), params = params, columns = SHORTLIST_COLUMNS,
+                                        order_by = ', '.join(f"{column} DESC" for column in RANK_BY), limit = limit)
+
+    def fetch_check(self, alpha_id):
+        '''
+        /alphas/{id}/check: 还在算时返回空body + Retry-After; 返回is.checks列表
+        '''
+        deadline = time.time() + self.max_wait
+        while True:
+            response = self.session.get(f"{self.base_url}/alphas/{alpha_id}/check")
+            response.raise_for_status()
+            retry_after = float(response.headers.get('Retry-After', 0) or 0)
+            if retry_after == 0 and response.content:
+                return (response.json().get('is') or {}).get('checks') or []
+            if time.time() + retry_after > deadline:
+                raise TimeoutError(f"Checks of alpha {alpha_id} still pending after {self.max_wait}s")
+            time.sleep(retry_after or 1)
+
+    def fetch_checks(self, alpha_ids):
+        '''
+        并发查询, 结果写回结果库; 返回 {alpha_id: checks}, 失败的不在里面
+        '''
+        started = time.time()
+        results = {}
+        with ThreadPoolExecutor(max_workers = max(1, self.workers)) as executor:
+            futures = {executor.submit(self.fetch_check, alpha_id): alpha_id for alpha_id in alpha_ids}
+            for future in as_completed(futures):
+                alpha_id = futures[future]
+                try:
+                    checks = future.result()
+                except Exception as e:
+                    logging.error(f"Failed to fetch checks of alpha {alpha_id}: {e}")
+                    continue
+                self.results_store.update_checks(alpha_id, checks)   # sqlite连接只在这个线程里写
+                results[alpha_id] = checks
+        logging.info(f"Fetched checks for {len(results)} of {len(futures)} alphas in {time.time() - started:.1f}s")
+        return results
+
+    def _drop_correlated(self, shortlist):
+        '''
+        本地自相关已经超过阈值的先去掉; 矩阵里没有PnL的保留, 交给平台的check判断
+        '''
+        maximum = self.correlation.max_vs_book([alpha_id for alpha_id in shortlist['id'] if alpha_id in self.correlation])['max_correlation']
+        correlated = set(maximum.index[maximum >= self.correlation_threshold])
+        if correlated:
+            logging.info(f"Dropped {len(correlated)} candidates with local self-correlation >= {self.correlation_threshold}")
+        shortlist = shortlist[~shortlist['id'].isin(correlated)].copy()
+        shortlist['local_correlation'] = shortlist['id'].map(maximum)
+        return shortlist
+
+    def select(self, limit = None, output = SUBMIT_LIST_PATH):
+        '''
+        返回全部check为PASS、排好序的候选, 同时写到output
+        limit: 最多要几个; 按排名从前往后查PENDING的check, 凑够就停
+        '''
+        shortlist = self.shortlist()
+        logging.info(f"Shortlisted {len(shortlist)} alphas passing {self.thresholds} / {self.maxima}")
+        if self.correlation is not None and len(shortlist):
+            shortlist = self._drop_correlated(shortlist)
+        selected = []
+        batch_size = max(self.workers * 4, limit or 0)
+        for start in range(0, len(shortlist), batch_size):
+            batch = shortlist.iloc[start:start + batch_size]
+            ready = batch[batch['checks_pending'] == 0]
+            pending = batch[batch['checks_pending'] > 0]
+            passed = set(ready['id'])
+            if len(pending):
+                if self.session is None:
+                    raise ValueError("A session is required to fetch pending checks")
+                for alpha_id, checks in self.fetch_checks(list(pending['id'])).items():
+                    if all_passed(checks):
+                        passed.add(alpha_id)
+            selected.append(batch[batch['id'].isin(passed)])
+            if limit and sum(len(frame) for frame in selected) >= limit:
+                break
+        submit_list = pd.concat(selected, ignore_index = True) if selected else shortlist.iloc[0:0]
+        submit_list = submit_list.drop(columns = 'checks_pending').head(limit) if limit else submit_list.drop(columns = 'checks_pending')
+        if output:
+            submit_list.to_csv(output, index = False)
+        logging.info(f"{len(submit_list)} alphas ready to submit" + (f", written to {output}" if output else ''))
+        return submit_list
+
+
+if __name__ == '__main__':
+    import sys
+    from alpha_creator import sign_in
+    from results_store import ResultsStore
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s - %(levelname)s - %(message)s')
+    selector = SubmissionSelector(ResultsStore(), sign_in())
+    print(selector.select(limit = int(sys.argv[1]) if len(sys.argv) > 1 else None))
@@ -0,0 +1,178 @@
+'''
+回测任务的预写日志(write-ahead log)
+
+每个alpha从进入内存队列到结束, 状态变化都追加一行JSON到日志文件:
+    queued(payload) -> submitted(url) -> completed / failed
+- 只追加, 不再整份重写progress_state.json
+- 每条记录都带时间戳; queued/submitted带payload, submitted/completed/failed带url
+  重启后超时时间按原来的提交时间算, 也能知道每个url对应哪个表达式
+- 每次写入都flush到操作系统, fsync按条数/时间批量做
+- 日志里已结束的任务多了就压缩(compaction): 只把还活着的任务重写成一份新日志
+- 恢复 = 顺序重放日志, 最后一行写了一半(进程被杀)会被跳过
+'''
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+TASK_ID_KEY = '_task'   # alpha里记录任务id的字段, 提交前会被payload_of去掉
+
+QUEUED = 'queued'
+SUBMITTED = 'submitted'
+COMPLETED = 'completed'
+FAILED = 'failed'
+DROPPED = 'dropped'
+FINAL_STATES = (COMPLETED, FAILED, DROPPED)
+
+
+class TaskJournal:
+    def __init__(self, path, fsync_every = 50, fsync_interval = 1.0, compact_every = 10000):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.tasks = {}   # task_id -> {'state', 'payload', 'url', 'account', 'queued_at', 'submitted_at'}
+        self.records = 0   # 当前日志文件里的记录数
+        self.unsynced = 0
+        self.last_sync = time.time()
+        self.lock = threading.Lock()
+        self._ids = itertools.count()
+        self._id_prefix = uuid.uuid4().hex[:8]
+        os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+        self._replay()
+        self.file = open(self.path, 'a', encoding = 'utf-8')
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        started = time.time()
+        with open(self.path, 'r', encoding = 'utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.error(f"Skip broken journal record: {line[:100]}")
+                    continue
+                self._apply(record)
+                self.records += 1
+        for task_id in [t for t, task in self.tasks.items() if task['state'] in FINAL_STATES]:
+            del self.tasks[task_id]
+        logging.info(f"Replayed {self.records} journal records in {time.time() - started:.2f}s: {len(self.queued_tasks())} queued, {len(self.active_tasks())} active")
+
+    def _apply(self, record):
+        op = record['op']
+        task = self.tasks.setdefault(record['task'], {'state': op, 'payload': None, 'url': None, 'account': None, 'queued_at': None, 'submitted_at': None})
+        task['state'] = op
+        if record.get('payload') is not None:
+            task['payload'] = record['payload']
+        if record.get('url'):
+            task['url'] = record['url']
+        if record.get('account'):
+            task['account'] = record['account']
+        if op == QUEUED:
+            task['queued_at'] = record['ts']
+        elif op == SUBMITTED:
+            task['submitted_at'] = record['ts']
+
+    def _write(self, record):
+        with self.lock:
+            self._apply(record)
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+            self.records += 1
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_every or time.time() - self.last_sync >= self.fsync_interval:
+                self._fsync()
+            if record['op'] in FINAL_STATES:
+                self.tasks.pop(record['task'], None)
+                if self.records >= self.compact_every and self.records > 4 * len(self.tasks):
+                    self._compact()
+
+    def _fsync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    def sync(self):
+        with self.lock:
+            self.file.flush()
+            self._fsync()
+
+    def _compact(self):
+        '''
+        只保留还活着的任务, 写到临时文件后原子替换
+        '''
+        temp_path = self.path + '.tmp'
+        count = 0
+        with open(temp_path, 'w', encoding = 'utf-8') as f:
+            for task_id, task in self.tasks.items():
+                f.write(json.dumps({'op': QUEUED, 'task': task_id, 'ts': task['queued_at'], 'payload': task['payload']}) + '\n')
+                count += 1
+                if task['state'] == SUBMITTED:
+                    f.write(json.dumps({'op': SUBMITTED, 'task': task_id, 'ts': task['submitted_at'], 'payload': task['payload'],
+                                        'url': task['url'], 'account': task['account']}) + '\n')
+                    count += 1
+            f.flush()
+            os.fsync(f.fileno())
+        self.file.close()
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, 'a', encoding = 'utf-8')
+        logging.info(f"Compacted task journal: {self.records} -> {count} records")
+        self.records = count
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    def new_task_id(self):
+        return f"{self._id_prefix}-{next(self._ids)}"
+
+    def queued(self, alpha, ts = None):
+        '''
+        alpha进入内存队列; 给alpha分配任务id(写在TASK_ID_KEY字段)
+        '''
+        task_id = alpha.get(TASK_ID_KEY) or self.new_task_id()
+        alpha[TASK_ID_KEY] = task_id
+        payload = {k: v for k, v in alpha.items() if k != TASK_ID_KEY}
+        self._write({'op': QUEUED, 'task': task_id, 'ts': ts or time.time(), 'payload': payload})
+        return task_id
+
+    def submitted(self, alpha, url, account = None, ts = None):
+        task_id = alpha.get(TASK_ID_KEY) or self.queued(alpha)
+        payload = {k: v for k, v in alpha.items() if k != TASK_ID_KEY}
+        self._write({'op': SUBMITTED, 'task': task_id, 'ts': ts or time.time(), 'payload': payload, 'url': url, 'account': account})
+
+    def completed(self, task_id, url = None, alpha_id = None):
+        self._write({'op': COMPLETED, 'task': task_id, 'ts': time.time(), 'url': url, 'alpha_id': alpha_id})
+
+    def failed(self, task_id, url = None, reason = None):
+        self._write({'op': FAILED, 'task': task_id, 'ts': time.time(), 'url': url, 'reason': reason})
+
+    def dropped(self, task_id):
+        self._write({'op': DROPPED, 'task': task_id, 'ts': time.time()})
+
+    def queued_tasks(self):
+        return [(task_id, task) for task_id, task in self.tasks.items() if task['state'] == QUEUED]
+
+    def active_tasks(self, account = None):
+        return [(task_id, task) for task_id, task in self.tasks.items()
+                if task['state'] == SUBMITTED and (account is None or task['account'] == account)]
+
+    def queued_alphas(self):
+        '''
+        恢复内存队列: 按进入队列的顺序返回还没提交的alpha(带任务id)
+        '''
+        alphas = []
+        for task_id, task in sorted(self.queued_tasks(), key = lambda item: item[1]['queued_at'] or 0):
+            alpha = dict(task['payload'])
+            alpha[TASK_ID_KEY] = task_id
+            alphas.append(alpha)
+        return alphas
+
+    def is_empty(self):
+        return self.records == 0
+
+    def close(self):
+        self.sync()
+        self.file.close()